@@ -150,6 +150,7 @@ class ExperimentSessionCreateSerializer(serializers.ModelSerializer):
         instance = super().create(validated_data)
         if messages:
             ChatMessage.objects.bulk_create([ChatMessage(chat=instance.chat, **message) for message in messages])
+            instance.update_last_human_message()
         return instance
 
 
@@ -1,19 +1,156 @@
+"""
+Audio conversion and metadata.
+
+Audio is converted by a single ffmpeg process that reads the source audio from stdin and encodes it straight to the
+target format. Converting with pydub takes two ffmpeg processes, one to decode the audio to raw samples which are
+held in memory and another to encode them again.
+
+The duration of synthesized audio is read from the WAV or MP3 headers where possible so that the audio doesn't have
+to be decoded just to find out how long it is.
+"""
+
+import logging
+import subprocess
+import tempfile
+import wave
 from io import BytesIO
 
-from pydub import AudioSegment
+logger = logging.getLogger("ocs.channels")
 
+# Containers that ffmpeg can't stream because the index is at the end of the file (input) or because the header is
+# written once the size of the audio is known (output). These are read from or written to temporary files instead.
+SEEKABLE_INPUT_FORMATS = {"mp4", "m4a", "mov", "3gp"}
+SEEKABLE_OUTPUT_FORMATS = {"wav", "mp4", "m4a"}
 
-def convert_audio(audio: BytesIO, target_format: str, source_format="ogg", codec=None) -> BytesIO:
-    audio = AudioSegment.from_file(audio, format=source_format)
-    # Convert to mono
-    audio = audio.set_channels(1)
+# Maps MIME subtypes (e.g. from a `Content-Type` header) to ffmpeg formats where they differ
+FFMPEG_FORMATS = {"mpeg": "mp3", "x-wav": "wav", "wave": "wav", "x-m4a": "m4a"}
+
+MPEG1_LAYER3_BITRATES = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]
+MPEG2_LAYER3_BITRATES = [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+MPEG_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+# How far into the file to look for the first MP3 frame
+MP3_FRAME_SEARCH_LIMIT = 64 * 1024
+
+
+class AudioConversionError(Exception):
+    pass
 
-    convertion_kwargs = {}
+
+def convert_audio(audio: BytesIO, target_format: str, source_format="ogg", codec=None) -> BytesIO:
+    """Converts the audio to mono `target_format` audio, optionally using `codec`"""
+    source_format = FFMPEG_FORMATS.get(source_format, source_format)
+    output_args = ["-vn", "-ac", "1"]
     if codec:
-        convertion_kwargs["codec"] = codec
+        output_args += ["-acodec", codec]
+    output_args += ["-f", target_format]
+
+    with (
+        tempfile.NamedTemporaryFile(suffix=f".{source_format}") as input_file,
+        tempfile.NamedTemporaryFile(suffix=f".{target_format}") as output_file,
+    ):
+        stdin = _get_buffer(audio)
+        input_path = "pipe:0"
+        if source_format in SEEKABLE_INPUT_FORMATS:
+            input_file.write(stdin)
+            input_file.flush()
+            input_path, stdin = input_file.name, None
+
+        output_path = output_file.name if target_format in SEEKABLE_OUTPUT_FORMATS else "pipe:1"
+        command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f", source_format, "-i", input_path]
+        result = subprocess.run(command + output_args + [output_path], input=stdin, capture_output=True)
+        if result.returncode != 0:
+            raise AudioConversionError(f"Unable to convert {source_format} audio to {target_format}: {result.stderr}")
 
-    new_audio = BytesIO()
-    audio.export(new_audio, format=target_format, **convertion_kwargs)
-    new_audio.seek(0)
+        data = result.stdout if output_path == "pipe:1" else output_file.read()
+
+    new_audio = BytesIO(data)
     new_audio.name = f"some_name.{target_format}"
     return new_audio
+
+
+def get_duration(audio: BytesIO | bytes, format: str) -> float:
+    """Returns the duration of the audio in seconds. The duration of WAV and MP3 audio is read from the headers,
+    other formats (or audio with headers that can't be parsed) are probed with ffprobe."""
+    data = _get_buffer(audio)
+    try:
+        if format == "wav":
+            return _get_wav_duration(data)
+        if format == "mp3":
+            return _get_mp3_duration(data)
+    except (ValueError, EOFError, wave.Error) as e:
+        logger.debug("Unable to read the duration from the %s headers: %s", format, e)
+    return _probe_duration(data, format)
+
+
+def _get_buffer(audio: BytesIO | bytes) -> bytes | memoryview:
+    if isinstance(audio, BytesIO):
+        return audio.getbuffer()
+    if isinstance(audio, bytes | memoryview):
+        return audio
+    return audio.read()
+
+
+def _get_wav_duration(data: bytes | memoryview) -> float:
+    with wave.open(BytesIO(data)) as wav:
+        return wav.getnframes() / wav.getframerate()
+
+
+def _get_mp3_duration(data: bytes | memoryview) -> float:
+    """Reads the duration from the VBR header (Xing / Info or VBRI) if there is one, otherwise assumes a constant
+    bitrate and uses the bitrate from the first frame header"""
+    offset = 0
+    if bytes(data[:3]) == b"ID3":
+        tag_size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+        has_footer = data[5] & 0x10
+        offset = 10 + tag_size + (10 if has_footer else 0)
+
+    search_limit = min(len(data) - 4, offset + MP3_FRAME_SEARCH_LIMIT)
+    while offset < search_limit and not (data[offset] == 0xFF and data[offset + 1] & 0xE0 == 0xE0):
+        offset += 1
+    if offset >= search_limit:
+        raise ValueError("No MP3 frame found")
+
+    header = int.from_bytes(data[offset : offset + 4], "big")
+    version = (header >> 19) & 0x3
+    layer = (header >> 17) & 0x3
+    bitrate_index = (header >> 12) & 0xF
+    sample_rate_index = (header >> 10) & 0x3
+    is_mono = (header >> 6) & 0x3 == 0x3
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        raise ValueError("Unsupported MP3 frame header")
+
+    is_mpeg1 = version == 3
+    sample_rate = MPEG_SAMPLE_RATES[version][sample_rate_index]
+    samples_per_frame = 1152 if is_mpeg1 else 576
+
+    side_info_size = (17 if is_mono else 32) if is_mpeg1 else (9 if is_mono else 17)
+    xing_offset = offset + 4 + side_info_size
+    if bytes(data[xing_offset : xing_offset + 4]) in (b"Xing", b"Info"):
+        flags = int.from_bytes(data[xing_offset + 4 : xing_offset + 8], "big")
+        if flags & 0x1:
+            frame_count = int.from_bytes(data[xing_offset + 8 : xing_offset + 12], "big")
+            return frame_count * samples_per_frame / sample_rate
+
+    vbri_offset = offset + 4 + 32
+    if bytes(data[vbri_offset : vbri_offset + 4]) == b"VBRI":
+        frame_count = int.from_bytes(data[vbri_offset + 14 : vbri_offset + 18], "big")
+        return frame_count * samples_per_frame / sample_rate
+
+    bitrate = (MPEG1_LAYER3_BITRATES if is_mpeg1 else MPEG2_LAYER3_BITRATES)[bitrate_index] * 1000
+    audio_size = len(data) - offset
+    if len(data) >= 128 and bytes(data[-128:-125]) == b"TAG":
+        audio_size -= 128  # ID3v1 tag
+    return audio_size * 8 / bitrate
+
+
+def _probe_duration(data: bytes | memoryview, format: str) -> float:
+    format = FFMPEG_FORMATS.get(format, format)
+    with tempfile.NamedTemporaryFile(suffix=f".{format}") as audio_file:
+        audio_file.write(data)
+        audio_file.flush()
+        command = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", audio_file.name]
+        result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise AudioConversionError(f"Unable to read the duration of {format} audio: {result.stderr}")
+    return float(result.stdout.strip())
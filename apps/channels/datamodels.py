@@ -3,7 +3,7 @@ from functools import cached_property
 from typing import Literal
 
 import phonenumbers
-from pydantic import BaseModel, ConfigDict, Field, field_validator
+from pydantic import BaseModel, ConfigDict, Field, ValidationInfo, field_validator
 
 from apps.channels.models import ChannelPlatform
 from apps.chat.channels import MESSAGE_TYPES
@@ -12,6 +12,14 @@ logger = logging.getLogger("ocs.channels")
 
 AttachmentType = Literal["code_interpreter", "file_search"]
 
+# Validation context for messages that are loaded from their serialized form, e.g. `model_validate_json(data,
+# context=DESERIALIZE_CONTEXT)`. The content type has already been parsed so it is used as it is.
+DESERIALIZE_CONTEXT = {"deserialize": True}
+
+
+def _is_deserializing(info: ValidationInfo) -> bool:
+    return bool(info.context and info.context.get("deserialize"))
+
 
 class Attachment(BaseModel):
     file_id: int
@@ -107,7 +115,9 @@ class TwilioMessage(BaseMessage):
 
     @field_validator("content_type", mode="before")
     @classmethod
-    def determine_content_type(cls, value):
+    def determine_content_type(cls, value, info: ValidationInfo):
+        if _is_deserializing(info):
+            return value
         if not value:
             # Normal test messages doesn't have a content type
             return MESSAGE_TYPES.TEXT
@@ -190,7 +200,9 @@ class FacebookMessage(BaseMessage):
 
     @field_validator("content_type", mode="before")
     @classmethod
-    def determine_content_type(cls, value):
+    def determine_content_type(cls, value, info: ValidationInfo):
+        if _is_deserializing(info):
+            return value
         if not value:
             return MESSAGE_TYPES.TEXT
         if value and value == "audio":
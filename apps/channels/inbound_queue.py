@@ -0,0 +1,179 @@
+"""
+Per-session queue for messages coming in from external channels.
+
+Each inbound message is pushed onto a Redis list for the channel and participant. The worker that handles the
+message then tries to take the queue's lock. Workers that don't get the lock return straight away since the lock
+holder will pick up their message. The lock holder waits until no new message has arrived for
+`settings.INBOUND_MESSAGE_DEBOUNCE` seconds, reads the queue and responds to consecutive text messages as a single
+turn. This means that there is only one generation in-flight per session and that messages are handled in the
+order they arrived.
+
+Messages are stored as JSON along with the name of their class. They are only removed from the queue once the turn
+they belong to has been handled, so if the lock holder dies part way through, the remaining messages are handled by
+the worker that handles the next message for the session.
+
+Usage:
+
+    inbound_queue.process(
+        f"{experiment_channel.id}:{message.participant_id}",
+        message,
+        lambda message: WhatsappChannel(experiment, experiment_channel).new_user_message(message),
+    )
+"""
+
+import json
+import logging
+import time
+from collections.abc import Callable
+
+from django.conf import settings
+from redis.exceptions import LockError
+
+from apps.channels.datamodels import DESERIALIZE_CONTEXT, BaseMessage
+from apps.chat.channels import MESSAGE_TYPES
+
+logger = logging.getLogger("ocs.channels")
+
+# How long the lock is held for without being refreshed. The lock is refreshed before each turn so this only needs
+# to be longer than a single generation.
+LOCK_TIMEOUT = 60 * 10
+
+# Queued messages are removed if they haven't been processed in this time, e.g. if the lock holder crashed
+QUEUE_TIMEOUT = 60 * 60
+
+
+def coalesce_messages(messages: list[BaseMessage]) -> list[BaseMessage]:
+    """Combine consecutive text messages into a single message. Other messages (e.g. voice messages, messages
+    with attachments and commands like `/reset`) are kept as they are."""
+    return [_combine(group) for group in _group_messages(messages)]
+
+
+def _group_messages(messages: list[BaseMessage | None]) -> list[list[BaseMessage | None]]:
+    """Split the messages into the groups of messages that make up each turn. Missing messages (`None`) are kept
+    in a group of their own."""
+    groups = []
+    for message in messages:
+        if groups and groups[-1][-1] and message and _can_coalesce(groups[-1][-1]) and _can_coalesce(message):
+            groups[-1].append(message)
+        else:
+            groups.append([message])
+    return groups
+
+
+def _combine(messages: list[BaseMessage]) -> BaseMessage:
+    if len(messages) == 1:
+        return messages[0]
+    message_text = "\n\n".join(message.message_text for message in messages)
+    return messages[0].model_copy(update={"message_text": message_text})
+
+
+def _can_coalesce(message: BaseMessage) -> bool:
+    return (
+        message.content_type == MESSAGE_TYPES.TEXT
+        and not message.attachments
+        and not message.message_text.strip().startswith("/")
+    )
+
+
+def _get_message_class(name: str) -> type[BaseMessage]:
+    classes = [BaseMessage]
+    for cls in classes:
+        if cls.__name__ == name:
+            return cls
+        classes.extend(cls.__subclasses__())
+    raise ValueError(f"Unknown message type '{name}'")
+
+
+class InboundMessageQueue:
+    def process(self, key: str, message: BaseMessage, handle_message: Callable[[BaseMessage], None]):
+        """Queue the message and, unless another worker is already handling messages for the same `key`,
+        handle all the queued messages by calling `handle_message` once per turn."""
+        redis = self._get_redis_connection()
+        queue_key = self._queue_key(key)
+        with redis.pipeline() as pipe:
+            pipe.rpush(queue_key, self._serialize(message))
+            pipe.expire(queue_key, QUEUE_TIMEOUT)
+            pipe.set(self._last_message_key(key), time.time(), ex=QUEUE_TIMEOUT)
+            pipe.execute()
+
+        while True:
+            lock = redis.lock(self._lock_key(key), timeout=LOCK_TIMEOUT)
+            if not lock.acquire(blocking=False):
+                return
+
+            try:
+                self._process_queue(redis, key, lock, handle_message)
+            finally:
+                try:
+                    lock.release()
+                except LockError:
+                    logger.warning("Inbound message lock for '%s' expired before it was released", key)
+
+            # A message may have been queued after the queue was last drained but before the lock was released, in
+            # which case the worker that queued it gave up on the lock.
+            if not redis.llen(queue_key):
+                return
+
+    def _process_queue(self, redis, key: str, lock, handle_message: Callable[[BaseMessage], None]):
+        queue_key = self._queue_key(key)
+        while True:
+            self._wait_for_messages(redis, key)
+            entries = redis.lrange(queue_key, 0, -1)
+            if not entries:
+                return
+
+            groups = _group_messages([self._deserialize(key, entry) for entry in entries])
+            if len(groups) < len(entries):
+                logger.info("Combined %s messages from '%s' into %s turns", len(entries), key, len(groups))
+
+            for group in groups:
+                lock.reacquire()
+                if group[0]:
+                    try:
+                        handle_message(_combine(group))
+                    except Exception:
+                        logger.exception("Error handling inbound message for '%s'", key)
+                # Only remove the messages once they have been handled. New messages are added to the end of the
+                # queue so they aren't affected.
+                redis.ltrim(queue_key, len(group), -1)
+
+    def _wait_for_messages(self, redis, key: str):
+        """Wait until no new messages have arrived for the debounce period"""
+        while True:
+            last_message_at = redis.get(self._last_message_key(key))
+            if last_message_at is None:
+                return
+            remaining = float(last_message_at) + settings.INBOUND_MESSAGE_DEBOUNCE - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def _serialize(self, message: BaseMessage) -> str:
+        return json.dumps({"type": type(message).__name__, "message": message.model_dump_json()})
+
+    def _deserialize(self, key: str, entry: bytes) -> BaseMessage | None:
+        """Rebuild a queued message. Returns `None` (and logs an error) if the message can't be read."""
+        try:
+            data = json.loads(entry)
+            message_class = _get_message_class(data["type"])
+            return message_class.model_validate_json(data["message"], context=DESERIALIZE_CONTEXT)
+        except Exception:
+            logger.exception("Unable to read queued inbound message for '%s'", key)
+            return None
+
+    def _get_redis_connection(self):
+        from django_redis import get_redis_connection
+
+        return get_redis_connection("default")
+
+    def _queue_key(self, key: str) -> str:
+        return f"inbound_messages:{key}"
+
+    def _last_message_key(self, key: str) -> str:
+        return f"inbound_messages:{key}:last"
+
+    def _lock_key(self, key: str) -> str:
+        return f"inbound_messages:{key}:lock"
+
+
+inbound_queue = InboundMessageQueue()
@@ -9,9 +9,11 @@ from twilio.request_validator import RequestValidator
 
 from apps.channels.clients.connect_client import CommCareConnectClient, Message
 from apps.channels.datamodels import BaseMessage, SureAdhereMessage, TelegramMessage, TurnWhatsappMessage, TwilioMessage
+from apps.channels.inbound_queue import inbound_queue
 from apps.channels.models import ChannelPlatform, ExperimentChannel
 from apps.chat.channels import (
     ApiChannel,
+    ChannelBase,
     CommCareConnectChannel,
     FacebookMessengerChannel,
     SureAdhereChannel,
@@ -45,8 +47,7 @@ def handle_telegram_message(self, message_data: str, channel_external_id: uuid):
     message_handler = TelegramChannel(experiment_channel.experiment.default_version, experiment_channel)
     update_taskbadger_data(self, message_handler, message)
 
-    with current_team(experiment_channel.team):
-        message_handler.new_user_message(message)
+    _queue_message(experiment_channel, message, TelegramChannel)
 
 
 @shared_task(bind=True, base=TaskbadgerTask, ignore_result=True)
@@ -80,8 +81,7 @@ def handle_twilio_message(self, message_data: str, request_uri: str, signature:
     message_handler = ChannelClass(experiment_channel.experiment.default_version, experiment_channel=experiment_channel)
     update_taskbadger_data(self, message_handler, message)
 
-    with current_team(experiment_channel.team):
-        message_handler.new_user_message(message)
+    _queue_message(experiment_channel, message, ChannelClass)
 
 
 def validate_twillio_request(experiment_channel, raw_data, request_uri, signature):
@@ -139,8 +139,19 @@ def handle_turn_message(self, experiment_id: uuid, message_data: dict):
     channel = WhatsappChannel(experiment_channel.experiment.default_version, experiment_channel)
     update_taskbadger_data(self, channel, message)
 
-    with current_team(experiment_channel.team):
-        channel.new_user_message(message)
+    _queue_message(experiment_channel, message, WhatsappChannel)
+
+
+def _queue_message(experiment_channel: ExperimentChannel, message: BaseMessage, channel_class: type[ChannelBase]):
+    """Handle the message through the participant's inbound queue so that messages sent in quick succession are
+    answered in order and as a single turn. A new channel is created for each turn."""
+
+    def handle_message(message):
+        channel = channel_class(experiment_channel.experiment.default_version, experiment_channel)
+        with current_team(experiment_channel.team):
+            channel.new_user_message(message)
+
+    inbound_queue.process(f"{experiment_channel.id}:{message.participant_id}", message, handle_message)
 
 
 def handle_api_message(
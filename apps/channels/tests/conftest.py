@@ -41,3 +41,14 @@ def slack_provider():
             "slack_installation_id": 1,
         },
     )
+
+
+@pytest.fixture(autouse=True)
+def _no_inbound_message_debounce(settings):
+    settings.INBOUND_MESSAGE_DEBOUNCE = 0
+
+
+@pytest.fixture(autouse=True)
+def _no_speech_cache(settings):
+    """Channel tests mock speech synthesis, so the synthesized audio shouldn't be cached"""
+    settings.SPEECH_CACHE_ENABLED = False
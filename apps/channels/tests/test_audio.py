@@ -0,0 +1,42 @@
+import wave
+from io import BytesIO
+
+import pytest
+
+from apps.channels.audio import get_duration
+
+# MPEG1 Layer III, 128 kbps, 44.1 kHz, stereo
+MP3_FRAME_HEADER = bytes([0xFF, 0xFB, 0x90, 0x64])
+MP3_FRAME_SIZE = 417
+
+
+def _mp3_frame(payload=b""):
+    return MP3_FRAME_HEADER + payload + b"\x00" * (MP3_FRAME_SIZE - 4 - len(payload))
+
+
+def test_mp3_duration_from_bitrate():
+    audio = _mp3_frame() * 100
+    assert get_duration(audio, format="mp3") == pytest.approx(100 * MP3_FRAME_SIZE * 8 / 128000)
+
+
+def test_mp3_duration_skips_id3_tag():
+    id3_tag = b"ID3\x04\x00\x00\x00\x00\x00\x0a" + b"\x00" * 10
+    audio = _mp3_frame() * 100
+    assert get_duration(BytesIO(id3_tag + audio), format="mp3") == get_duration(audio, format="mp3")
+
+
+def test_mp3_duration_from_xing_header():
+    side_info = b"\x00" * 32
+    xing_header = b"Xing" + (1).to_bytes(4, "big") + (2000).to_bytes(4, "big")
+    audio = _mp3_frame(side_info + xing_header) + _mp3_frame() * 10
+    assert get_duration(audio, format="mp3") == pytest.approx(2000 * 1152 / 44100)
+
+
+def test_wav_duration():
+    audio = BytesIO()
+    with wave.open(audio, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(b"\x00\x00" * 24000)
+    assert get_duration(audio, format="wav") == pytest.approx(1.5)
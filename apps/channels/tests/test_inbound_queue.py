@@ -0,0 +1,125 @@
+import threading
+import time
+import uuid
+from unittest.mock import Mock
+
+import pytest
+
+from apps.channels.datamodels import Attachment, BaseMessage, TwilioMessage
+from apps.channels.inbound_queue import InboundMessageQueue, coalesce_messages
+from apps.channels.models import ChannelPlatform
+from apps.chat.channels import MESSAGE_TYPES
+
+
+def _message(text, **kwargs):
+    return BaseMessage(participant_id="123", message_text=text, **kwargs)
+
+
+def test_coalesce_messages():
+    voice = _message("", content_type=MESSAGE_TYPES.VOICE)
+    attachment = Attachment(file_id=1, type="file_search", name="file.txt", size=10)
+    with_attachment = _message("see attached", attachments=[attachment])
+    turns = coalesce_messages(
+        [_message("hi"), _message("how are you?"), voice, _message("/reset"), _message("hello"), with_attachment]
+    )
+    assert [turn.message_text for turn in turns] == ["hi\n\nhow are you?", "", "/reset", "hello", "see attached"]
+    assert turns[1] is voice
+    assert turns[4].attachments == [attachment]
+
+
+def test_single_message_is_handled():
+    handle_message = Mock()
+    message = _message("hi")
+    InboundMessageQueue().process(str(uuid.uuid4()), message, handle_message)
+    handle_message.assert_called_once_with(message)
+
+
+def test_burst_is_handled_as_one_turn(settings):
+    """Messages that arrive while the lock holder is waiting for the debounce period are handled in one turn and
+    the other workers return without handling any messages"""
+    settings.INBOUND_MESSAGE_DEBOUNCE = 0.3
+    key = str(uuid.uuid4())
+    queue = InboundMessageQueue()
+    handled = []
+    handle_message = Mock(side_effect=lambda message: handled.append(message.message_text))
+
+    first = threading.Thread(target=queue.process, args=(key, _message("one"), handle_message))
+    first.start()
+    time.sleep(0.1)
+    queue.process(key, _message("two"), handle_message)
+    queue.process(key, _message("three"), handle_message)
+    first.join(timeout=5)
+
+    assert handled == ["one\n\ntwo\n\nthree"]
+
+
+def test_messages_queued_during_a_turn_are_handled_in_order():
+    key = str(uuid.uuid4())
+    queue = InboundMessageQueue()
+    handled = []
+
+    def handle_message(message):
+        handled.append(message.message_text)
+        if message.message_text == "one":
+            # arrives while the bot is responding to the first message
+            queue.process(key, _message("two"), handle_message)
+            queue.process(key, _message("three"), handle_message)
+
+    queue.process(key, _message("one"), handle_message)
+    assert handled == ["one", "two\n\nthree"]
+
+
+def test_errors_do_not_drop_queued_messages():
+    key = str(uuid.uuid4())
+    queue = InboundMessageQueue()
+    handled = []
+
+    def handle_message(message):
+        if message.message_text == "one":
+            queue.process(key, _message("/reset"), handle_message)
+            raise Exception("boom")
+        handled.append(message.message_text)
+
+    queue.process(key, _message("one"), handle_message)
+    assert handled == ["/reset"]
+    # the lock is released
+    queue.process(key, _message("two"), handle_message)
+    assert handled == ["/reset", "two"]
+
+
+@pytest.mark.parametrize(
+    ("content_type", "expected_type"),
+    [("audio/ogg", MESSAGE_TYPES.VOICE), ("image/jpeg", None), (None, MESSAGE_TYPES.TEXT)],
+)
+def test_messages_are_rebuilt_with_their_class(content_type, expected_type):
+    message = TwilioMessage(
+        participant_id="+27123456789",
+        to="+27987654321",
+        message_text="hi",
+        content_type=content_type,
+        media_url="https://example.com/media" if content_type else None,
+        platform=ChannelPlatform.WHATSAPP,
+        attachments=[Attachment(file_id=1, type="file_search", name="file.txt", size=10)],
+    )
+    queue = InboundMessageQueue()
+    rebuilt = queue._deserialize("key", queue._serialize(message).encode())
+    assert type(rebuilt) is TwilioMessage
+    assert rebuilt == message
+    assert rebuilt.content_type == expected_type
+
+
+def test_messages_are_kept_until_they_are_handled():
+    key = str(uuid.uuid4())
+    queue = InboundMessageQueue()
+
+    def crash(message):
+        # e.g. the worker is shut down part way through the turn
+        raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        queue.process(key, _message("one"), crash)
+
+    handle_message = Mock()
+    queue.process(key, _message("/reset"), handle_message)
+    assert [call.args[0].message_text for call in handle_message.call_args_list] == ["one", "/reset"]
+    assert not queue._get_redis_connection().llen(queue._queue_key(key))
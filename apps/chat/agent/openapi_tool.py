@@ -1,9 +1,12 @@
 import enum
+import hashlib
+import json
 import logging
 import pathlib
 import tempfile
+import threading
 import uuid
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from email.message import Message
 from typing import Any
 from urllib.parse import urljoin
@@ -86,15 +89,15 @@ class OpenAPIOperationExecutor:
         kwargs = {k: v.model_dump() if isinstance(v, BaseModel) else v for k, v in kwargs.items()}
 
         url = self._get_url(path_params)
-        with self.auth_service.get_http_client() as client:
-            try:
-                return self.auth_service.call_with_retries(self._make_request, client, url, method, **kwargs)
-            except httpx.HTTPStatusError as e:
-                if e.response and e.response.status_code == 400:
-                    raise ToolException(f"Bad request: {e.response.text}")
-                raise ToolException(f"Error making request: {str(e)}")
-            except httpx.HTTPError as e:
-                raise ToolException(f"Error making request: {str(e)}")
+        client = self.auth_service.get_http_client()
+        try:
+            return self.auth_service.call_with_retries(self._make_request, client, url, method, **kwargs)
+        except httpx.HTTPStatusError as e:
+            if e.response and e.response.status_code == 400:
+                raise ToolException(f"Bad request: {e.response.text}")
+            raise ToolException(f"Error making request: {str(e)}")
+        except httpx.HTTPError as e:
+            raise ToolException(f"Error making request: {str(e)}")
 
     def _make_request(
         self, http_client: httpx.Client, url: str, method: str, **kwargs
@@ -224,6 +227,49 @@ def openapi_spec_op_to_function_def(spec: OpenAPISpec, path: str, method: str) -
     )
 
 
+class FunctionDefCache:
+    """Per-process LRU cache of function definitions built from standalone operation schemas.
+
+    Parsing the spec and generating the pydantic models for the tool arguments is expensive, so it is only done
+    once for each version of an operation. The cache is keyed by a hash of the schema so that changes to the
+    operation are picked up without needing to invalidate the cache.
+    """
+
+    def __init__(self, max_size=256) -> None:
+        self.max_size = max_size
+        self.function_defs: OrderedDict[str, FunctionDef | None] = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get(self, operation_schema: dict) -> FunctionDef | None:
+        """Return the function definition for the first operation in the schema or None if it has no paths."""
+        key = hashlib.sha256(json.dumps(operation_schema, sort_keys=True).encode()).hexdigest()
+        with self.lock:
+            if key in self.function_defs:
+                self.function_defs.move_to_end(key)
+                return self.function_defs[key]
+
+        logger.debug("Building function definition with key '%s'", key)
+        function_def = None
+        spec = OpenAPISpec.from_spec_dict(operation_schema)
+        if spec.paths:
+            path = list(spec.paths)[0]
+            method = spec.get_methods_for_path(path)[0]
+            function_def = openapi_spec_op_to_function_def(spec, path, method)
+
+        with self.lock:
+            self.function_defs[key] = function_def
+            while len(self.function_defs) > self.max_size:
+                self.function_defs.popitem(last=False)
+        return function_def
+
+    def clear(self):
+        with self.lock:
+            self.function_defs.clear()
+
+
+function_def_cache = FunctionDefCache(max_size=settings.CUSTOM_ACTION_TOOL_CACHE_SIZE)
+
+
 def _openapi_params_to_pydantic_model(name, params: list[Parameter], spec: OpenAPISpec) -> type[BaseModel]:
     """
     Converts OpenAPI parameters to a Pydantic model.
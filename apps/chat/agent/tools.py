@@ -1,20 +1,22 @@
+import dataclasses
 import logging
 from collections.abc import Callable
 from datetime import datetime, timedelta
 from functools import cached_property
-from typing import TYPE_CHECKING, Any, Union
+from typing import TYPE_CHECKING, Any, Self, Union
 
 from django.db import transaction, utils
-from langchain_community.utilities.openapi import OpenAPISpec
 from langchain_core.tools import BaseTool
 
 from apps.chat.agent import schemas
-from apps.chat.agent.openapi_tool import openapi_spec_op_to_function_def
+from apps.chat.agent.openapi_tool import FunctionDef, function_def_cache
 from apps.chat.models import ChatAttachment
 from apps.events.forms import ScheduledMessageConfigForm
 from apps.events.models import ScheduledMessage, TimePeriod
-from apps.experiments.models import AgentTools, Experiment, ExperimentSession, ParticipantData
+from apps.experiments.models import AgentTools, Experiment, ExperimentSession
 from apps.pipelines.models import Node
+from apps.service_providers.auth_service import AuthService
+from apps.service_providers.llm_service.prompt_context import ParticipantDataProxy
 from apps.utils.time import pretty_date
 
 if TYPE_CHECKING:
@@ -163,21 +165,8 @@ class UpdateParticipantDataTool(CustomBaseTool):
     requires_session: bool = True
     args_schema: type[schemas.UpdateUserDataSchema] = schemas.UpdateUserDataSchema
 
-    @transaction.atomic
     def action(self, key: str, value: Any):
-        try:
-            participant_data = ParticipantData.objects.for_experiment(self.experiment_session.experiment).get(
-                participant=self.experiment_session.participant
-            )
-            participant_data.data[key] = value
-            participant_data.save()
-        except ParticipantData.DoesNotExist:
-            ParticipantData.objects.create(
-                participant=self.experiment_session.participant,
-                experiment=self.experiment_session.experiment,
-                team=self.experiment_session.team,
-                data={key: value},
-            )
+        ParticipantDataProxy.for_session(self.experiment_session).update({key: value})
         return "Success"
 
 
@@ -274,16 +263,38 @@ TOOL_CLASS_MAP = {
 }
 
 
-def get_tools(experiment_session, experiment) -> list[BaseTool]:
+@dataclasses.dataclass(frozen=True)
+class ToolConfig:
+    """The tool configuration of an experiment or assistant. This is loaded once for published experiment versions
+    (see `apps.chat.blueprints`) so that the custom action operations aren't queried for every message. It only holds
+    the function definitions and auth services of the custom actions, which are never modified, so it can be shared
+    between threads. The tool instances themselves are bound to the session so they are created for each message."""
+
+    tools_enabled: bool
+    custom_actions: tuple[tuple[FunctionDef, AuthService], ...]
+
+    @classmethod
+    def load(cls, tool_holder: Union[Experiment, "OpenAiAssistant"]) -> Self:
+        operations = tool_holder.get_custom_action_operations().select_related("custom_action__auth_provider")
+        custom_actions = []
+        for operation in operations:
+            if function_def := function_def_cache.get(operation.operation_schema):
+                custom_actions.append((function_def, operation.custom_action.get_auth_service()))
+        return cls(tools_enabled=tool_holder.tools_enabled, custom_actions=tuple(custom_actions))
+
+
+def get_tools(experiment_session, experiment, tool_config: ToolConfig | None = None) -> list[BaseTool]:
     tool_holder = experiment.assistant if experiment.assistant else experiment
     tools = get_tool_instances(tool_holder.tools, experiment_session)
-    tools.extend(get_custom_action_tools(tool_holder))
+    tools.extend(get_custom_action_tools(tool_holder, tool_config))
     return tools
 
 
-def get_assistant_tools(assistant, experiment_session: ExperimentSession | None = None) -> list[BaseTool]:
+def get_assistant_tools(
+    assistant, experiment_session: ExperimentSession | None = None, tool_config: ToolConfig | None = None
+) -> list[BaseTool]:
     tools = get_tool_instances(assistant.tools, experiment_session)
-    tools.extend(get_custom_action_tools(assistant))
+    tools.extend(get_custom_action_tools(assistant, tool_config))
     return tools
 
 
@@ -306,19 +317,20 @@ def get_tool_instances(tools_list, experiment_session: ExperimentSession | None
     return tools
 
 
-def get_custom_action_tools(action_holder: Union[Experiment, "OpenAiAssistant"]) -> list[BaseTool]:
-    operations = action_holder.get_custom_action_operations().select_related("custom_action__auth_provider").all()
+def get_custom_action_tools(
+    action_holder: Union[Experiment, "OpenAiAssistant"], tool_config: ToolConfig | None = None
+) -> list[BaseTool]:
+    if tool_config:
+        return [function_def.build_tool(auth_service) for function_def, auth_service in tool_config.custom_actions]
+
+    operations = action_holder.get_custom_action_operations().select_related("custom_action__auth_provider")
     return list(filter(None, [get_tool_for_custom_action_operation(operation) for operation in operations]))
 
 
 def get_tool_for_custom_action_operation(custom_action_operation) -> BaseTool | None:
-    custom_action = custom_action_operation.custom_action
-    spec = OpenAPISpec.from_spec_dict(custom_action_operation.operation_schema)
-    if not spec.paths:
+    function_def = function_def_cache.get(custom_action_operation.operation_schema)
+    if not function_def:
         return
 
-    auth_service = custom_action.get_auth_service()
-    path = list(spec.paths)[0]
-    method = spec.get_methods_for_path(path)[0]
-    function_def = openapi_spec_op_to_function_def(spec, path, method)
+    auth_service = custom_action_operation.custom_action.get_auth_service()
     return function_def.build_tool(auth_service)
@@ -0,0 +1,186 @@
+"""
+Per-process cache of the configuration that a `TopicBot` is built from.
+
+Building a `TopicBot` loads the experiment's safety layers, routes, source material and custom actions. Published
+experiment versions are immutable so this configuration is loaded once into a `TopicBotBlueprint` and reused for
+every message until it is evicted.
+
+Blueprints are shared between threads so they only hold data that is never modified: the field values of the model
+instances (`ModelSnapshot`), the source material and the tool configuration of each experiment. The model instances
+are restored from their snapshots for each message, without any queries, along with the other session-bound pieces
+(runnables, history managers, tools).
+
+Working versions can be edited at any time so their blueprints are never cached and the caller's instance of the
+experiment is used as it is.
+
+Usage:
+
+    blueprint = blueprint_cache.get(experiment)
+    experiment = blueprint.experiment.restore()
+    for route in blueprint.child_routes:
+        ...
+"""
+
+import copy
+import dataclasses
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
+from typing import Self
+
+from django.conf import settings
+from django.db import models
+
+from apps.chat.agent.tools import ToolConfig
+from apps.experiments.models import Experiment, ExperimentRoute, ExperimentRouteType
+
+logger = logging.getLogger("ocs.chat.blueprints")
+
+EXPERIMENT_RELATED_FIELDS = [
+    "llm_provider",
+    "llm_provider_model",
+    "source_material",
+    "assistant",
+    "assistant__llm_provider",
+    "assistant__llm_provider_model",
+    "trace_provider",
+    "team",
+]
+
+
+@dataclasses.dataclass(frozen=True)
+class ModelSnapshot:
+    """The field values of a model instance and of the related instances that were loaded with it"""
+
+    model: type[models.Model]
+    values: tuple
+    related: tuple[tuple[str, Self | None], ...]
+
+    @classmethod
+    def take(cls, instance: models.Model, related_fields: Iterable[str] = ()) -> Self:
+        """Take a snapshot of `instance` and the instances of `related_fields` (which use the same `__` lookups as
+        `select_related`)"""
+        nested = {}
+        for path in related_fields:
+            name, _, rest = path.partition("__")
+            nested.setdefault(name, [])
+            if rest:
+                nested[name].append(rest)
+
+        related = []
+        for name, nested_fields in nested.items():
+            related_instance = getattr(instance, name)
+            related.append((name, cls.take(related_instance, nested_fields) if related_instance else None))
+
+        values = tuple(copy.deepcopy(getattr(instance, field.attname)) for field in instance._meta.concrete_fields)
+        return cls(model=type(instance), values=values, related=tuple(related))
+
+    def restore(self) -> models.Model:
+        """Create a new instance from the snapshot, as if it had been loaded from the DB"""
+        field_names = [field.attname for field in self.model._meta.concrete_fields]
+        # JSON field values are copied so that changes to the instance don't affect the snapshot
+        values = [copy.deepcopy(value) if isinstance(value, dict | list) else value for value in self.values]
+        instance = self.model.from_db("default", field_names, values)
+        for name, snapshot in self.related:
+            self.model._meta.get_field(name).set_cached_value(instance, snapshot.restore() if snapshot else None)
+        return instance
+
+
+@dataclasses.dataclass(frozen=True)
+class ChildRoute:
+    keyword: str
+    experiment: ModelSnapshot
+    is_default: bool
+
+
+@dataclasses.dataclass(frozen=True)
+class TopicBotBlueprint:
+    experiment: ModelSnapshot
+    source_material: str | None
+    safety_layers: tuple[ModelSnapshot, ...]
+    child_routes: tuple[ChildRoute, ...]
+    terminal_experiment: ModelSnapshot | None
+    tool_configs: tuple[tuple[int, ToolConfig], ...]
+
+    @classmethod
+    def build(cls, experiment: Experiment) -> Self:
+        child_related_fields = [f"child__{field}" for field in EXPERIMENT_RELATED_FIELDS]
+        routes = list(
+            ExperimentRoute.objects.select_related("child", *child_related_fields)
+            .filter(parent=experiment)
+            .order_by("id")
+        )
+        processor_routes = [route for route in routes if route.type == ExperimentRouteType.PROCESSOR]
+        terminal_routes = [route for route in routes if route.type == ExperimentRouteType.TERMINAL]
+        terminal_experiment = terminal_routes[0].child if terminal_routes else None
+
+        experiments = [experiment, *(route.child for route in processor_routes)]
+        if terminal_experiment:
+            experiments.append(terminal_experiment)
+        return cls(
+            experiment=ModelSnapshot.take(experiment, EXPERIMENT_RELATED_FIELDS),
+            source_material=experiment.source_material.material if experiment.source_material else None,
+            safety_layers=tuple(ModelSnapshot.take(layer) for layer in experiment.safety_layers.all()),
+            child_routes=tuple(
+                ChildRoute(
+                    keyword=route.keyword.lower().strip(),
+                    experiment=ModelSnapshot.take(route.child, EXPERIMENT_RELATED_FIELDS),
+                    is_default=route.is_default,
+                )
+                for route in processor_routes
+            ),
+            terminal_experiment=ModelSnapshot.take(terminal_experiment, EXPERIMENT_RELATED_FIELDS)
+            if terminal_experiment
+            else None,
+            tool_configs=tuple((exp.id, ToolConfig.load(exp.assistant or exp)) for exp in experiments),
+        )
+
+    def get_tool_config(self, experiment_id: int) -> ToolConfig | None:
+        return dict(self.tool_configs).get(experiment_id)
+
+
+class BlueprintCache:
+    """LRU cache of blueprints for published experiment versions keyed by the experiment ID.
+
+    The LLM and trace providers that experiments reference aren't versioned, so entries expire after `timeout`
+    seconds to pick up changes to them (e.g. rotated API keys).
+    """
+
+    def __init__(self, max_size=128, timeout=300) -> None:
+        self.max_size = max_size
+        self.timeout = timeout
+        self.blueprints: OrderedDict[int, tuple[float, TopicBotBlueprint]] = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get(self, experiment: Experiment) -> TopicBotBlueprint:
+        if experiment.is_working_version:
+            return TopicBotBlueprint.build(experiment)
+
+        with self.lock:
+            if entry := self.blueprints.get(experiment.id):
+                expires_at, blueprint = entry
+                if expires_at > time.monotonic():
+                    self.blueprints.move_to_end(experiment.id)
+                    return blueprint
+
+        logger.debug("Building blueprint for experiment %s", experiment.id)
+        # Load a fresh instance with the related instances that are included in the snapshot
+        experiment = Experiment.objects.select_related(*EXPERIMENT_RELATED_FIELDS).get(id=experiment.id)
+        blueprint = TopicBotBlueprint.build(experiment)
+        with self.lock:
+            self.blueprints[experiment.id] = (time.monotonic() + self.timeout, blueprint)
+            self.blueprints.move_to_end(experiment.id)
+            while len(self.blueprints) > self.max_size:
+                self.blueprints.popitem(last=False)
+        return blueprint
+
+    def clear(self):
+        with self.lock:
+            self.blueprints.clear()
+
+
+blueprint_cache = BlueprintCache(
+    max_size=settings.TOPIC_BOT_BLUEPRINT_CACHE_SIZE, timeout=settings.TOPIC_BOT_BLUEPRINT_CACHE_TIMEOUT
+)
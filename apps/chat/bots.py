@@ -1,22 +1,27 @@
 import textwrap
+from collections.abc import Callable
+from concurrent.futures import Future
+from functools import cached_property
 from typing import TYPE_CHECKING, Any
 
 from langchain.memory import ConversationBufferMemory
 from langchain_core.language_models import BaseChatModel
 from langchain_core.runnables import chain
+from langchain_core.runnables.config import ContextThreadPoolExecutor
 from pydantic import ValidationError
 
 from apps.annotations.models import TagCategories
+from apps.chat.blueprints import blueprint_cache
 from apps.chat.conversation import BasicConversation, Conversation
 from apps.chat.exceptions import ChatException
 from apps.chat.models import ChatMessageType
 from apps.events.models import StaticTriggerType
-from apps.events.tasks import enqueue_static_triggers
-from apps.experiments.models import Experiment, ExperimentRoute, ExperimentSession, SafetyLayer
+from apps.events.tasks import enqueue_static_trigger_event
+from apps.experiments.models import Experiment, ExperimentSession, SafetyLayer, SafetyLayerModes
 from apps.pipelines.nodes.base import PipelineState
 from apps.service_providers.llm_service.default_models import get_default_model
-from apps.service_providers.llm_service.prompt_context import PromptTemplateContext
-from apps.service_providers.llm_service.runnables import create_experiment_runnable
+from apps.service_providers.llm_service.prompt_context import ParticipantDataProxy, PromptTemplateContext
+from apps.service_providers.llm_service.runnables import SimpleLLMChat, create_experiment_runnable
 
 if TYPE_CHECKING:
     from apps.channels.datamodels import Attachment
@@ -44,11 +49,16 @@ def notify_users_of_violation(session_id: int, safety_layer_id: int):
     notify_users_of_safety_violations_task.delay(session_id, safety_layer_id)
 
 
-def get_bot(session: ExperimentSession, experiment: Experiment | None = None, disable_tools: bool = False):
+def get_bot(
+    session: ExperimentSession,
+    experiment: Experiment | None = None,
+    disable_tools: bool = False,
+    stream_tokens: bool = False,
+):
     experiment = experiment or session.experiment_version
     if experiment.pipeline_id:
         return PipelineBot(session, experiment=experiment, disable_reminder_tools=disable_tools)
-    return TopicBot(session, experiment, disable_tools=disable_tools)
+    return TopicBot(session, experiment, disable_tools=disable_tools, stream_tokens=stream_tokens)
 
 
 class TopicBot:
@@ -63,26 +73,34 @@ class TopicBot:
         the session's own experiment will be used. This is used in a multi-bot setup where the user might want
         a specific bot to handle a scheduled message, in which case it would be useful for the LLM to have the
         conversation history of the participant's chat with the router / main bot.
+    stream_tokens: (optional)
+        Publish the response tokens to the session as they are generated. Tokens are only published when the
+        response will be shown to the user unchanged i.e. there is no terminal bot or AI safety layer.
     """
 
-    def __init__(self, session: ExperimentSession, experiment: Experiment | None = None, disable_tools: bool = False):
-        self.experiment = experiment or session.experiment_version
+    def __init__(
+        self,
+        session: ExperimentSession,
+        experiment: Experiment | None = None,
+        disable_tools: bool = False,
+        stream_tokens: bool = False,
+    ):
+        experiment = experiment or session.experiment_version
+        self.blueprint = blueprint_cache.get(experiment)
+        # Blueprints of working versions aren't cached so the caller's instance can be used
+        self.experiment = experiment if experiment.is_working_version else self.blueprint.experiment.restore()
         self.disable_tools = disable_tools
+        self.stream_tokens = stream_tokens
         self.prompt = self.experiment.prompt_text
         self.input_formatter = self.experiment.input_formatter
-        self.llm = self.experiment.get_chat_model()
-        self.source_material = self.experiment.source_material.material if self.experiment.source_material else None
-        self.safety_layers = self.experiment.safety_layers.all()
+        self.source_material = self.blueprint.source_material
+        self.safety_layers = [layer.restore() for layer in self.blueprint.safety_layers]
         self.chat = session.chat
         self.session = session
         self.max_token_limit = self.experiment.max_token_limit
         self.input_tokens = 0
         self.output_tokens = 0
 
-        # maps keywords to child experiments.
-        self.child_experiment_routes = (
-            ExperimentRoute.objects.select_related("child").filter(parent=self.experiment, type="processor").all()
-        )
         self.child_chains = {}
         self.default_child_chain = None
         self.default_tag = None
@@ -94,29 +112,44 @@ class TopicBot:
         self.generator_chain = None
         self._initialize()
 
+    @cached_property
+    def llm(self):
+        return self.experiment.get_chat_model()
+
     def _initialize(self):
-        for child_route in self.child_experiment_routes:
+        # maps keywords to child experiments.
+        for child_route in self.blueprint.child_routes:
+            child_experiment = child_route.experiment.restore()
             child_runnable = create_experiment_runnable(
-                child_route.child, self.session, self.disable_tools, trace_service=self.trace_service
+                child_experiment,
+                self.session,
+                self.disable_tools,
+                trace_service=self.trace_service,
+                tool_config=self.blueprint.get_tool_config(child_experiment.id),
             )
-            self.child_chains[child_route.keyword.lower().strip()] = child_runnable
+            self.child_chains[child_route.keyword] = child_runnable
             if child_route.is_default:
                 self.default_child_chain = child_runnable
-                self.default_tag = child_route.keyword.lower().strip()
+                self.default_tag = child_route.keyword
 
         if self.child_chains and not self.default_child_chain:
             self.default_tag, self.default_child_chain = list(self.child_chains.items())[0]
 
         self.chain = create_experiment_runnable(
-            self.experiment, self.session, self.disable_tools, trace_service=self.trace_service
+            self.experiment,
+            self.session,
+            self.disable_tools,
+            trace_service=self.trace_service,
+            tool_config=self.blueprint.get_tool_config(self.experiment.id),
         )
 
-        terminal_route = (
-            ExperimentRoute.objects.select_related("child").filter(parent=self.experiment, type="terminal").first()
-        )
-        if terminal_route:
+        if self.blueprint.terminal_experiment:
+            terminal_experiment = self.blueprint.terminal_experiment.restore()
             self.terminal_chain = create_experiment_runnable(
-                terminal_route.child, self.session, trace_service=self.trace_service
+                terminal_experiment,
+                self.session,
+                trace_service=self.trace_service,
+                tool_config=self.blueprint.get_tool_config(terminal_experiment.id),
             )
 
         # load up the safety bots. They should not be agents. We don't want them using tools (for now)
@@ -124,7 +157,20 @@ class TopicBot:
             SafetyBot(safety_layer, self.llm, self.source_material) for safety_layer in self.safety_layers
         ]
 
-    def _call_predict(self, input_str, save_input_to_history=True, attachments: list["Attachment"] | None = None):
+    def _call_predict(
+        self,
+        input_str,
+        save_input_to_history=True,
+        attachments: list["Attachment"] | None = None,
+        should_save_to_history: Callable[[], bool] | None = None,
+    ):
+        """
+        Parameters
+        ----------
+        should_save_to_history: (optional)
+            Called once the response has been generated to decide whether the messages should be saved to the
+            history. Tokens aren't streamed to the session since the response may be discarded.
+        """
         if self.child_chains:
             tag, chain = self._get_child_chain(input_str, attachments)
         else:
@@ -139,6 +185,8 @@ class TopicBot:
                     "save_input_to_history": save_input_to_history,
                     "save_output_to_history": self.terminal_chain is None,
                     "experiment_tag": tag,
+                    "stream_to_session": should_save_to_history is None and self._should_stream_tokens(),
+                    "should_save_to_history": should_save_to_history,
                 }
             },
             attachments=attachments,
@@ -154,17 +202,24 @@ class TopicBot:
                         "save_input_to_history": False,
                         "experiment_tag": tag,
                         "include_conversation_history": False,
+                        "should_save_to_history": should_save_to_history,
                     },
                 },
             )
 
         self.generator_chain = chain
 
-        enqueue_static_triggers.delay(self.session.id, StaticTriggerType.NEW_BOT_MESSAGE)
+        if should_save_to_history is None or should_save_to_history():
+            enqueue_static_trigger_event(self.session, StaticTriggerType.NEW_BOT_MESSAGE)
         self.input_tokens = self.input_tokens + result.prompt_tokens
         self.output_tokens = self.output_tokens + result.completion_tokens
         return result.output
 
+    def _should_stream_tokens(self) -> bool:
+        if not self.stream_tokens or self.terminal_chain:
+            return False
+        return not any(safety_bot.filter_ai_messages() for safety_bot in self.safety_bots)
+
     def _get_child_chain(self, input_str: str, attachments: list["Attachment"] | None = None) -> tuple[str, Any]:
         result = self.chain.invoke(
             input_str,
@@ -189,25 +244,9 @@ class TopicBot:
     def process_input(self, user_input: str, save_input_to_history=True, attachments: list["Attachment"] | None = None):
         @chain
         def main_bot_chain(user_input):
-            # human safety layers
-            for safety_bot in self.safety_bots:
-                if safety_bot.filter_human_messages() and not safety_bot.is_safe(user_input):
-                    self._save_message_to_history(user_input, ChatMessageType.HUMAN)
-                    enqueue_static_triggers.delay(self.session.id, StaticTriggerType.HUMAN_SAFETY_LAYER_TRIGGERED)
-                    notify_users_of_violation(self.session.id, safety_layer_id=safety_bot.safety_layer.id)
-                    return self._get_safe_response(safety_bot.safety_layer)
-
-            response = self._call_predict(
-                user_input, save_input_to_history=save_input_to_history, attachments=attachments
-            )
-
-            # ai safety layers
-            for safety_bot in self.safety_bots:
-                if safety_bot.filter_ai_messages() and not safety_bot.is_safe(response):
-                    enqueue_static_triggers.delay(self.session.id, StaticTriggerType.BOT_SAFETY_LAYER_TRIGGERED)
-                    return self._get_safe_response(safety_bot.safety_layer)
-
-            return response
+            if self.experiment.safety_layer_mode == SafetyLayerModes.SPECULATIVE:
+                return self._process_input_concurrently(user_input, save_input_to_history, attachments)
+            return self._process_input_sequentially(user_input, save_input_to_history, attachments)
 
         config = {}
         if self.trace_service:
@@ -228,9 +267,74 @@ class TopicBot:
         try:
             return main_bot_chain.invoke(user_input, config=config)
         finally:
+            ParticipantDataProxy.end_turn(self.session)
             if self.trace_service:
                 self.trace_service.end()
 
+    def _process_input_sequentially(
+        self, user_input: str, save_input_to_history: bool, attachments: list["Attachment"] | None
+    ):
+        # human safety layers
+        for safety_bot in self.safety_bots:
+            if safety_bot.filter_human_messages() and not safety_bot.is_safe(user_input):
+                return self._handle_unsafe_input(user_input, safety_bot)
+
+        response = self._call_predict(user_input, save_input_to_history=save_input_to_history, attachments=attachments)
+
+        # ai safety layers
+        for safety_bot in self.safety_bots:
+            if safety_bot.filter_ai_messages() and not safety_bot.is_safe(response):
+                enqueue_static_trigger_event(self.session, StaticTriggerType.BOT_SAFETY_LAYER_TRIGGERED)
+                return self._get_safe_response(safety_bot.safety_layer)
+
+        return response
+
+    def _process_input_concurrently(
+        self, user_input: str, save_input_to_history: bool, attachments: list["Attachment"] | None
+    ):
+        """Run the safety layers concurrently. When possible, the response is generated while the user's message is
+        being checked and is only saved to the history if all the checks pass."""
+        human_safety_bots = [safety_bot for safety_bot in self.safety_bots if safety_bot.filter_human_messages()]
+        ai_safety_bots = [safety_bot for safety_bot in self.safety_bots if safety_bot.filter_ai_messages()]
+        with ContextThreadPoolExecutor(max_workers=max(len(self.safety_bots), 1)) as executor:
+            human_checks = [(bot, executor.submit(bot.is_safe, user_input)) for bot in human_safety_bots]
+
+            response = None
+            if human_checks and self._can_speculate():
+                response = self._call_predict(
+                    user_input,
+                    save_input_to_history=save_input_to_history,
+                    attachments=attachments,
+                    should_save_to_history=lambda: _get_unsafe_bot(human_checks) is None,
+                )
+
+            if unsafe_bot := _get_unsafe_bot(human_checks):
+                return self._handle_unsafe_input(user_input, unsafe_bot)
+
+            if response is None:
+                response = self._call_predict(
+                    user_input, save_input_to_history=save_input_to_history, attachments=attachments
+                )
+
+            ai_checks = [(bot, executor.submit(bot.is_safe, response)) for bot in ai_safety_bots]
+            if unsafe_bot := _get_unsafe_bot(ai_checks):
+                enqueue_static_trigger_event(self.session, StaticTriggerType.BOT_SAFETY_LAYER_TRIGGERED)
+                return self._get_safe_response(unsafe_bot.safety_layer)
+
+        return response
+
+    def _can_speculate(self) -> bool:
+        """Responses can only be generated speculatively if discarding them has no side effects. Assistants and bots
+        with tools are excluded since they change state outside of the chat history."""
+        chains = [self.chain, self.terminal_chain, *self.child_chains.values()]
+        return all(isinstance(chain, SimpleLLMChat) for chain in chains if chain)
+
+    def _handle_unsafe_input(self, user_input: str, safety_bot: "SafetyBot"):
+        self._save_message_to_history(user_input, ChatMessageType.HUMAN)
+        enqueue_static_trigger_event(self.session, StaticTriggerType.HUMAN_SAFETY_LAYER_TRIGGERED)
+        notify_users_of_violation(self.session.id, safety_layer_id=safety_bot.safety_layer.id)
+        return self._get_safe_response(safety_bot.safety_layer)
+
     def get_ai_message_id(self) -> int | None:
         """Returns the generated AI message's ID. The caller can use this to fetch more information on this message"""
         if self.generator_chain and self.generator_chain.history_manager.ai_message:
@@ -257,6 +361,13 @@ class TopicBot:
         self.chain.history_manager.save_message_to_history(message, type_=message_type)
 
 
+def _get_unsafe_bot(checks: list[tuple["SafetyBot", Future]]) -> "SafetyBot | None":
+    """Wait for the safety checks to complete and return the first safety bot that failed, if any"""
+    for safety_bot, is_safe in checks:
+        if not is_safe.result():
+            return safety_bot
+
+
 class SafetyBot:
     def __init__(self, safety_layer: SafetyLayer, llm: BaseChatModel, source_material: str | None):
         self.safety_layer = safety_layer
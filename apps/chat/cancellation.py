@@ -0,0 +1,157 @@
+"""
+Push based cancellation of in-flight LLM generations.
+
+Each generation is registered with the `GenerationCancellationManager` for the duration of the generation. This
+records the ID of the current generation for the chat in Redis until the generation ends. Cancelling a chat's
+generation publishes the generation ID on a Redis channel. Each process runs a single listener thread which sets an
+in-memory event for generations that it is tracking, so the streaming loop only ever needs to check the event.
+
+Usage:
+
+    with cancellation_manager.track(chat.id) as cancelled:
+        for token in chain.stream(...):
+            if cancelled.is_set():
+                break
+
+    # from anywhere else (e.g. a view or another worker)
+    cancellation_manager.cancel(chat.id)
+"""
+
+import logging
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from threading import RLock
+from uuid import uuid4
+
+logger = logging.getLogger("ocs.chat.cancellation")
+
+CANCELLATION_CHANNEL = "ocs:generation_cancelled"
+
+# How long to keep track of the current generation for a chat. Generations that run longer than this can't be
+# cancelled.
+GENERATION_TIMEOUT = 60 * 10
+
+# Time in seconds to wait before trying to subscribe to cancellations again after failing to subscribe. The wait is
+# doubled after each failure up to the maximum.
+LISTENER_RETRY_MIN = 1
+LISTENER_RETRY_MAX = 60
+
+# Deletes the key only if it still holds the given generation ID, i.e. a newer generation hasn't replaced it
+COMPARE_AND_DELETE = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class GenerationCancellationManager:
+    def __init__(self) -> None:
+        self.events: dict[str, threading.Event] = {}
+        self.lock = RLock()
+        self._listener_thread = None
+        self._listener_retry_at = 0.0
+        self._listener_backoff = 0
+
+    @contextmanager
+    def track(self, chat_id: int) -> Iterator[threading.Event]:
+        """Track a generation for the chat. The yielded event will be set if the generation is cancelled."""
+        generation_id = uuid4().hex
+        event = threading.Event()
+        with self.lock:
+            self.events[generation_id] = event
+        self._ensure_listener()
+        key = self._current_generation_key(chat_id)
+        try:
+            self._get_redis_connection().set(key, generation_id, ex=GENERATION_TIMEOUT)
+        except Exception:
+            logger.exception("Unable to record the current generation for chat %s", chat_id)
+        try:
+            yield event
+        finally:
+            with self.lock:
+                self.events.pop(generation_id, None)
+            try:
+                self._get_redis_connection().eval(COMPARE_AND_DELETE, 1, key, generation_id)
+            except Exception:
+                logger.exception("Unable to clear the current generation for chat %s", chat_id)
+
+    def cancel(self, chat_id: int) -> bool:
+        """Cancel the in-flight generation for the chat. Returns `False` if there is no generation to cancel."""
+        generation_id = self._get_redis_connection().getdel(self._current_generation_key(chat_id))
+        if not generation_id:
+            return False
+
+        generation_id = generation_id.decode()
+        if not self._set_cancelled(generation_id):
+            # The generation is running in another process
+            try:
+                self._get_redis_connection().publish(CANCELLATION_CHANNEL, generation_id)
+            except Exception:
+                logger.exception("Unable to publish cancellation for generation %s", generation_id)
+                return False
+        return True
+
+    def _set_cancelled(self, generation_id: str) -> bool:
+        with self.lock:
+            event = self.events.get(generation_id)
+        if event:
+            logger.debug("Cancelling generation %s", generation_id)
+            event.set()
+            return True
+        return False
+
+    def _ensure_listener(self):
+        with self.lock:
+            if self._listener_thread and self._listener_thread.is_alive():
+                return
+            if time.monotonic() < self._listener_retry_at:
+                return
+
+            try:
+                pubsub = self._get_redis_connection().pubsub(ignore_subscribe_messages=True)
+                # Subscribe before starting the thread so that cancellations aren't missed while it starts
+                pubsub.subscribe(CANCELLATION_CHANNEL)
+            except Exception as e:
+                self._listener_backoff = min(max(self._listener_backoff * 2, LISTENER_RETRY_MIN), LISTENER_RETRY_MAX)
+                self._listener_retry_at = time.monotonic() + self._listener_backoff
+                if self._listener_backoff == LISTENER_RETRY_MIN:
+                    logger.exception("Unable to subscribe to generation cancellations")
+                else:
+                    logger.warning(
+                        "Unable to subscribe to generation cancellations, retrying in %ss: %s",
+                        self._listener_backoff,
+                        e,
+                    )
+                return
+
+            self._listener_backoff = 0
+            self._listener_thread = threading.Thread(target=self._listen, args=(pubsub,), daemon=True)
+            self._listener_thread.start()
+
+    def _listen(self, pubsub):
+        try:
+            for message in pubsub.listen():
+                if message["type"] == "message":
+                    generation_id = message["data"]
+                    if isinstance(generation_id, bytes):
+                        generation_id = generation_id.decode()
+                    self._set_cancelled(generation_id)
+        except Exception:
+            # The listener will be restarted by the next call to `track`
+            logger.exception("Generation cancellation listener stopped")
+        finally:
+            pubsub.close()
+
+    def _get_redis_connection(self):
+        from django_redis import get_redis_connection
+
+        return get_redis_connection("default")
+
+    def _current_generation_key(self, chat_id: int) -> str:
+        return f"current_generation:{chat_id}"
+
+
+cancellation_manager = GenerationCancellationManager()
@@ -26,9 +26,10 @@ from apps.chat.exceptions import (
     VersionedExperimentSessionsNotAllowedException,
 )
 from apps.chat.models import Chat, ChatMessage, ChatMessageType
+from apps.chat.streaming import SessionEvent, publish_session_event
 from apps.chat.tasks import STATUSES_FOR_COMPLETE_CHATS
 from apps.events.models import StaticTriggerType
-from apps.events.tasks import enqueue_static_triggers
+from apps.events.tasks import enqueue_static_trigger_event
 from apps.experiments.models import (
     Experiment,
     ExperimentSession,
@@ -37,6 +38,7 @@ from apps.experiments.models import (
     SessionStatus,
     VoiceResponseBehaviours,
 )
+from apps.service_providers.client_pool import client_pool
 from apps.service_providers.llm_service.runnables import GenerationCancelled
 from apps.service_providers.speech_service import SynthesizedAudio
 from apps.slack.utils import parse_session_external_id
@@ -86,6 +88,8 @@ class ChannelBase(ABC):
 
     Attributes:
         voice_replies_supported: Indicates whether the channel supports voice messages
+        stream_tokens_supported: Indicates whether the bot response should be streamed to the session as it is
+            generated
 
     Args:
         experiment: An Experiment object representing the experiment associated with the handler.
@@ -112,6 +116,7 @@ class ChannelBase(ABC):
     """
 
     voice_replies_supported: ClassVar[bool] = False
+    stream_tokens_supported: ClassVar[bool] = False
     supported_message_types: ClassVar[str] = []
 
     def __init__(
@@ -175,7 +180,7 @@ class ChannelBase(ABC):
     def bot(self):
         if not self.experiment_session:
             raise ChannelException("Bot cannot be accessed without an experiment session")
-        return get_bot(self.experiment_session, experiment=self.experiment)
+        return get_bot(self.experiment_session, experiment=self.experiment, stream_tokens=self.stream_tokens_supported)
 
     def reset_bot(self):
         try:
@@ -323,7 +328,7 @@ class ChannelBase(ABC):
                     # status is ACTIVE
                     self.experiment_session.update_status(SessionStatus.ACTIVE)
 
-            enqueue_static_triggers.delay(self.experiment_session.id, StaticTriggerType.NEW_HUMAN_MESSAGE)
+            enqueue_static_trigger_event(self.experiment_session, StaticTriggerType.NEW_HUMAN_MESSAGE)
             response = self._handle_supported_message()
             return response
         except Exception as e:
@@ -441,6 +446,8 @@ class ChannelBase(ABC):
         return self.send_text_to_user(self._unsupported_message_type_response())
 
     def _reply_voice_message(self, text: str):
+        from apps.service_providers.speech_cache import speech_cache
+
         text, extracted_urls = strip_urls_and_emojis(text)
 
         voice_provider = self.experiment.voice_provider
@@ -451,9 +458,8 @@ class ChannelBase(ABC):
             voice_provider = self.bot.processor_experiment.voice_provider
             synthetic_voice = self.bot.processor_experiment.synthetic_voice
 
-        speech_service = voice_provider.get_speech_service()
         try:
-            synthetic_voice_audio = speech_service.synthesize_voice(text, synthetic_voice)
+            synthetic_voice_audio = speech_cache.synthesize_voice(voice_provider, synthetic_voice, text)
             self.send_voice_to_user(synthetic_voice_audio)
         except AudioSynthesizeException as e:
             logger.exception(e)
@@ -625,11 +631,14 @@ class WebChannel(ChannelBase):
     """Message Handler for the UI"""
 
     voice_replies_supported = False
+    stream_tokens_supported = True
     supported_message_types = [MESSAGE_TYPES.TEXT]
 
     def send_text_to_user(self, bot_message: str):
-        # Simply adding a new AI message to the chat history will cause it to be sent to the UI
-        pass
+        # Responses to user messages are delivered by `get_response_for_webchat_task`. Other messages
+        # e.g. scheduled messages, are pushed to any open chat windows.
+        if not self._is_user_message:
+            publish_session_event(self.experiment_session.id, SessionEvent.MESSAGE, {"content": bot_message})
 
     def _ensure_sessions_exists(self):
         if not self.experiment_session:
@@ -686,7 +695,10 @@ class TelegramChannel(ChannelBase):
         experiment_session: ExperimentSession | None = None,
     ):
         super().__init__(experiment, experiment_channel, experiment_session)
-        self.telegram_bot = TeleBot(self.experiment_channel.extra_data["bot_token"], threaded=False)
+        bot_token = self.experiment_channel.extra_data["bot_token"]
+        self.telegram_bot = client_pool.get(
+            "telegram", {"bot_token": bot_token}, lambda: TeleBot(bot_token, threaded=False)
+        )
 
     def send_voice_to_user(self, synthetic_voice: SynthesizedAudio):
         antiflood(
@@ -973,6 +985,6 @@ def _start_experiment_session(
             participant.update_memory(data={"timezone": timezone}, experiment=working_experiment)
 
     if participant.experimentsession_set.count() == 1:
-        enqueue_static_triggers.delay(session.id, StaticTriggerType.PARTICIPANT_JOINED_EXPERIMENT)
-    enqueue_static_triggers.delay(session.id, StaticTriggerType.CONVERSATION_START)
+        enqueue_static_trigger_event(session, StaticTriggerType.PARTICIPANT_JOINED_EXPERIMENT)
+    enqueue_static_trigger_event(session, StaticTriggerType.CONVERSATION_START)
     return session
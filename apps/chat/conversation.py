@@ -17,6 +17,7 @@ from langchain_core.prompts import (
 
 from apps.chat.models import Chat, ChatMessage, ChatMessageType
 from apps.pipelines.models import PipelineChatHistory, PipelineChatHistoryModes, PipelineChatMessages
+from apps.service_providers.llm_service.token_counters import get_token_counter
 from apps.utils.prompt import OcsPromptTemplate
 
 SUMMARY_TOO_LARGE_ERROR_MESSAGE = "Unable to compress chat history: existing summary too large"
@@ -27,6 +28,117 @@ MAX_UNCOMPRESSED_MESSAGES = 1000
 log = logging.getLogger("ocs.bots")
 
 
+def get_tokenizer_key(llm) -> str:
+    """Returns a key that identifies the tokenizer of the LLM. Token counts are only reusable between LLMs that share
+    the same key."""
+    model = getattr(llm, "tiktoken_model_name", None) or getattr(llm, "model_name", None) or getattr(llm, "model", None)
+    return f"{llm.__class__.__name__}:{model}"
+
+
+class MessageTokenCounter:
+    """Counts the tokens of individual history messages so that each message only needs to be tokenized once.
+
+    When a `model_class` is given, counts for messages that are stored in the DB (identified by the `id` in the
+    message's `additional_kwargs`) are read from and written to the `token_counts` field of the DB record. Call `save`
+    to persist counts that were computed during this run.
+
+    Counts are summed per message which may slightly overestimate the total for providers that add a fixed
+    overhead per request. System messages (summaries) are never stored since they can change.
+    """
+
+    def __init__(self, llm, model_class=None):
+        self.llm = llm
+        self.model_class = model_class
+        self.tokenizer_key = get_tokenizer_key(llm)
+        self.counter = get_token_counter(llm)
+        self._counts: dict[tuple[int, str], int] = {}
+        self._stored_counts: dict[int, dict] = {}
+        self._unsaved: set[tuple[int, str]] = set()
+        self._uncached: dict[int, tuple[object, int]] = {}
+
+    def load(self, messages: list):
+        """Load the stored token counts for the messages in a single query"""
+        if not self.model_class:
+            return
+
+        message_ids = {key[0] for key in map(self._get_cache_key, messages) if key} - self._stored_counts.keys()
+        if not message_ids:
+            return
+
+        stored_counts = self.model_class.objects.filter(id__in=message_ids).values_list("id", "token_counts")
+        for message_id, token_counts in stored_counts:
+            self._stored_counts[message_id] = token_counts
+            for message_type, count in token_counts.get(self.tokenizer_key, {}).items():
+                self._counts[(message_id, message_type)] = count
+
+    def count(self, message) -> int:
+        return self.count_each([message])[0]
+
+    def count_each(self, messages: list) -> list[int]:
+        """Returns the token count of each message. Messages that haven't been counted yet are counted in a single
+        batch."""
+        counts = [None] * len(messages)
+        missing = []
+        for i, message in enumerate(messages):
+            key = self._get_cache_key(message)
+            if key is None and id(message) in self._uncached:
+                counts[i] = self._uncached[id(message)][1]
+            elif key is not None and key in self._counts:
+                counts[i] = self._counts[key]
+            else:
+                missing.append(i)
+
+        if missing:
+            new_counts = self.counter.get_tokens_per_message([messages[i] for i in missing])
+            stable = self.counter.counts_are_stable
+            for i, count in zip(missing, new_counts, strict=True):
+                message = messages[i]
+                counts[i] = count
+                if not stable:
+                    # provisional counts are neither kept nor stored so that the messages are counted again
+                    continue
+                if key := self._get_cache_key(message):
+                    self._counts[key] = count
+                    self._unsaved.add(key)
+                else:
+                    # keep a reference to the message so that its `id()` can't be reused while this counter is alive
+                    self._uncached[id(message)] = (message, count)
+        return counts
+
+    def count_messages(self, messages: list) -> int:
+        return sum(self.count_each(messages))
+
+    def count_summary(self, summary: str) -> int:
+        """Summaries change between runs so their counts are only cached by content"""
+        return self.counter.get_tokens_from_messages([SystemMessage(content=summary)])
+
+    def save(self):
+        """Persist newly computed counts for messages that exist in the DB"""
+        if not self.model_class or not self._unsaved:
+            return
+
+        for message_id, message_type in self._unsaved:
+            if message_id in self._stored_counts:
+                counts = self._stored_counts[message_id].setdefault(self.tokenizer_key, {})
+                counts[message_type] = self._counts[(message_id, message_type)]
+
+        message_ids = {message_id for message_id, _ in self._unsaved if message_id in self._stored_counts}
+        self.model_class.objects.bulk_update(
+            [
+                self.model_class(id=message_id, token_counts=self._stored_counts[message_id])
+                for message_id in message_ids
+            ],
+            fields=["token_counts"],
+        )
+        self._unsaved.clear()
+
+    def _get_cache_key(self, message) -> tuple[int, str] | None:
+        if not self.model_class or not isinstance(message, BaseMessage) or message.type == ChatMessageType.SYSTEM:
+            return None
+        if message_id := message.additional_kwargs.get("id"):
+            return message_id, message.type
+
+
 class Conversation(ABC):
     @abstractmethod
     def predict(self, input: str) -> tuple[str, int, int]:
@@ -118,6 +230,7 @@ def compress_chat_history(
     history_mode: str = PipelineChatHistoryModes.SUMMARIZE,
 ) -> list[BaseMessage]:
     history_messages = chat.get_langchain_messages_until_summary()
+    token_counter = MessageTokenCounter(llm, ChatMessage)
     try:
         history, last_message, summary = _compress_chat_history(
             history=history_messages,
@@ -126,7 +239,9 @@ def compress_chat_history(
             input_messages=input_messages,
             keep_history_len=keep_history_len,
             history_mode=history_mode,
+            token_counter=token_counter,
         )
+        token_counter.save()
         if summary is not None:
             if last_message:
                 ChatMessage.objects.filter(id=last_message.additional_kwargs["id"]).update(summary=summary)
@@ -149,6 +264,7 @@ def compress_pipeline_chat_history(
     history_mode: str = None,
 ) -> list[BaseMessage]:
     history_messages = pipeline_chat_history.get_langchain_messages_until_summary()
+    token_counter = MessageTokenCounter(llm, PipelineChatMessages)
     try:
         history, last_message, summary = _compress_chat_history(
             history=history_messages,
@@ -157,7 +273,9 @@ def compress_pipeline_chat_history(
             input_messages=input_messages,
             keep_history_len=keep_history_len,
             history_mode=history_mode,
+            token_counter=token_counter,
         )
+        token_counter.save()
         if summary is not None:
             if last_message:
                 PipelineChatMessages.objects.filter(id=last_message.additional_kwargs["id"]).update(summary=summary)
@@ -179,6 +297,7 @@ def _compress_chat_history(
     input_messages: list,
     keep_history_len: int = 10,
     history_mode: str = PipelineChatHistoryModes.SUMMARIZE,
+    token_counter: MessageTokenCounter | None = None,
 ) -> tuple[list[BaseMessage], BaseMessage | None, str | None]:
     """Compresses the chat history to be less than max_token_limit tokens long. This will summarize the history
     if necessary and save the summary to the DB.
@@ -187,9 +306,11 @@ def _compress_chat_history(
         log.info("Skipping chat history compression")
         return history, None, None
 
+    token_counter = token_counter or MessageTokenCounter(llm)
+    token_counter.load(history)
     total_messages = history.copy()
     total_messages.extend(input_messages)
-    current_token_count = llm.get_num_tokens_from_messages(total_messages)
+    current_token_count = token_counter.count_messages(total_messages)
     if history_mode in [PipelineChatHistoryModes.SUMMARIZE, PipelineChatHistoryModes.TRUNCATE_TOKENS, None]:
         if current_token_count <= max_token_limit and len(total_messages) <= MAX_UNCOMPRESSED_MESSAGES:
             log.info("Skipping chat history compression: %s <= %s", current_token_count, max_token_limit)
@@ -208,28 +329,29 @@ def _compress_chat_history(
         keep_history_len,
     )
     history, last_message, summary = compress_chat_history_from_messages(
-        llm, history, keep_history_len, max_token_limit, input_messages, history_mode
+        llm, history, keep_history_len, max_token_limit, input_messages, history_mode, token_counter
     )
     return history, last_message, summary
 
 
-def truncate_tokens(history, max_token_limit, llm, input_message_tokens):
+def truncate_tokens(history, max_token_limit, llm, input_message_tokens, token_counter=None):
     """Removes old messages until the token count is below the max limit."""
-    pruned_memory = []
-    history_tokens = llm.get_num_tokens_from_messages(history)
-    while history and history_tokens + input_message_tokens > max_token_limit:
-        pruned_memory.append(history.pop(0))
-        history_tokens = llm.get_num_tokens_from_messages(history)
-    return history, pruned_memory
-
-
-def summarize_history(llm, history, max_token_limit, input_message_tokens, summary, input_messages, pruned_memory):
-    history_tokens = llm.get_num_tokens_from_messages(history)
-    summary_tokens = (
-        llm.get_num_tokens_from_messages([SystemMessage(content=summary)])
-        if summary
-        else INITIAL_SUMMARY_TOKENS_ESTIMATE
-    )
+    token_counter = token_counter or MessageTokenCounter(llm)
+    message_tokens = token_counter.count_each(history)
+    history_tokens = sum(message_tokens)
+    prune_count = 0
+    while prune_count < len(history) and history_tokens + input_message_tokens > max_token_limit:
+        history_tokens -= message_tokens[prune_count]
+        prune_count += 1
+    return history[prune_count:], history[:prune_count]
+
+
+def summarize_history(
+    llm, history, max_token_limit, input_message_tokens, summary, input_messages, pruned_memory, token_counter=None
+):
+    token_counter = token_counter or MessageTokenCounter(llm)
+    history_tokens = token_counter.count_messages(history)
+    summary_tokens = token_counter.count_summary(summary) if summary else INITIAL_SUMMARY_TOKENS_ESTIMATE
     first_pass_done = False  # Ensures at least one iteration
     while not first_pass_done or _tokens_exceeds_limit(
         history, token_count=(history_tokens + summary_tokens + input_message_tokens), limit=max_token_limit
@@ -245,10 +367,10 @@ def summarize_history(llm, history, max_token_limit, input_message_tokens, summa
 
             pruned_messages, history = history[:prune_count], history[prune_count:]
             pruned_memory.extend(pruned_messages)
-            history_tokens = llm.get_num_tokens_from_messages(history)
+            history_tokens -= token_counter.count_messages(pruned_messages)
         # Generate a new summary after pruning messages
         summary = _get_new_summary(llm, pruned_memory, summary, max_token_limit)
-        summary_tokens = llm.get_num_tokens_from_messages([SystemMessage(content=summary)])
+        summary_tokens = token_counter.count_summary(summary)
 
     return history, pruned_memory, summary
 
@@ -260,6 +382,7 @@ def compress_chat_history_from_messages(
     max_token_limit: int,
     input_messages: list,
     history_mode: str = PipelineChatHistoryModes.SUMMARIZE,
+    token_counter: MessageTokenCounter | None = None,
 ):
     """
     Handles chat history compression based on selected mode:
@@ -270,23 +393,24 @@ def compress_chat_history_from_messages(
     summary = history.pop(0).content if history and history[0].type == ChatMessageType.SYSTEM else None
     history, pruned_memory = history[-keep_history_len:], history[:-keep_history_len]
     latest_message = history[-1] if history else None
-    input_message_tokens = llm.get_num_tokens_from_messages(input_messages)
+    token_counter = token_counter or MessageTokenCounter(llm)
+    input_message_tokens = token_counter.count_messages(input_messages)
     if history_mode == PipelineChatHistoryModes.MAX_HISTORY_LENGTH:
         return history, latest_message, summary
     elif history_mode == PipelineChatHistoryModes.TRUNCATE_TOKENS:
-        history, pruned_memory = truncate_tokens(history, max_token_limit, llm, input_message_tokens)
+        history, pruned_memory = truncate_tokens(history, max_token_limit, llm, input_message_tokens, token_counter)
     elif history_mode == PipelineChatHistoryModes.SUMMARIZE or history_mode is None:
         history, pruned_memory, summary = summarize_history(
-            llm, history, max_token_limit, input_message_tokens, summary, input_messages, pruned_memory
+            llm, history, max_token_limit, input_message_tokens, summary, input_messages, pruned_memory, token_counter
         )
+        history_tokens = token_counter.count_messages(history)
+        summary_tokens = token_counter.count_summary(summary)
         log.info(
             "Compressed chat history to %s tokens (%s prompt + %s summary + %s history)",
-            input_message_tokens
-            + llm.get_num_tokens_from_messages(history)
-            + llm.get_num_tokens_from_messages([SystemMessage(content=summary)]),
+            input_message_tokens + history_tokens + summary_tokens,
             input_message_tokens,
-            llm.get_num_tokens_from_messages([SystemMessage(content=summary)]),
-            llm.get_num_tokens_from_messages(history),
+            summary_tokens,
+            history_tokens,
         )
     if history:
         last_message = history[0]
@@ -331,5 +455,5 @@ def _get_new_summary(llm, pruned_memory, summary, max_token_limit):
 def _get_summary_tokens_with_context(llm, summary, pruned_memory):
     new_lines = get_buffer_string(pruned_memory)
     context = {"summary": summary or "", "new_lines": new_lines}
-    tokens = llm.get_num_tokens_from_messages(SUMMARY_PROMPT.format_prompt(**context).to_messages())
+    tokens = get_token_counter(llm).get_tokens_from_messages(SUMMARY_PROMPT.format_prompt(**context).to_messages())
     return tokens, context
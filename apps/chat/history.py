@@ -0,0 +1,145 @@
+"""
+Bulk writes of chat messages and their system tags.
+
+Saving the human and AI messages of a turn one at a time takes an insert per message plus a `get_or_create` and
+an `add_tag` per system tag. Instead the messages are inserted together, the system tags are resolved from a
+per-process cache and the tagged items for all the messages are inserted together.
+"""
+
+import dataclasses
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+from functools import partial
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q
+
+from apps.annotations.models import CustomTaggedItem, Tag, TagCategories
+from apps.chat.models import ChatMessage, ChatMessageType
+
+logger = logging.getLogger("ocs.chat")
+
+
+@dataclasses.dataclass
+class HistoryMessage:
+    content: str
+    message_type: ChatMessageType
+    metadata: dict = dataclasses.field(default_factory=dict)
+    system_tags: list[tuple[str, TagCategories]] = dataclasses.field(default_factory=list)
+
+
+class SystemTagCache:
+    """Per-process LRU cache of system tag IDs keyed by the team, tag name and category.
+
+    System tags are created once for each bot and version and can't be edited or deleted by users, so their IDs
+    can be cached for the lifetime of the process. The IDs of new tags are only cached once the transaction that
+    created them has been committed.
+    """
+
+    def __init__(self, max_size=1024) -> None:
+        self.max_size = max_size
+        self.tag_ids: OrderedDict[tuple[int, str, str], int] = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get_tag_ids(self, team_id: int, tags: Iterable[tuple[str, str]]) -> dict[tuple[str, str], int]:
+        """Return the IDs of the system tags for the team, creating any that don't exist yet."""
+        tag_ids = {}
+        missing = set()
+        with self.lock:
+            for name, category in tags:
+                key = (team_id, name, category)
+                if key in self.tag_ids:
+                    self.tag_ids.move_to_end(key)
+                    tag_ids[(name, category)] = self.tag_ids[key]
+                else:
+                    missing.add((name, category))
+
+        if missing:
+            existing, created = self._load_tag_ids(team_id, missing)
+            self._add(team_id, existing)
+            if created:
+                # the tags won't exist if the transaction is rolled back
+                transaction.on_commit(partial(self._add, team_id, created))
+            tag_ids.update(existing)
+            tag_ids.update(created)
+        return tag_ids
+
+    def _load_tag_ids(
+        self, team_id: int, tags: set[tuple[str, str]]
+    ) -> tuple[dict[tuple[str, str], int], dict[tuple[str, str], int]]:
+        """Return the IDs of the existing tags and the IDs of the tags that had to be created"""
+        query = Q()
+        for name, category in tags:
+            query |= Q(name=name, category=category)
+        existing = Tag.objects.filter(query, team_id=team_id, is_system_tag=True).values_list("name", "category", "id")
+        existing_ids = {(name, category): tag_id for name, category, tag_id in existing}
+
+        created_ids = {}
+        for name, category in tags - existing_ids.keys():
+            logger.debug("Creating system tag '%s' for team %s", name, team_id)
+            tag, _ = Tag.objects.get_or_create(name=name, team_id=team_id, is_system_tag=True, category=category)
+            created_ids[(name, category)] = tag.id
+        return existing_ids, created_ids
+
+    def _add(self, team_id: int, tag_ids: dict[tuple[str, str], int]):
+        with self.lock:
+            for (name, category), tag_id in tag_ids.items():
+                self.tag_ids[(team_id, name, category)] = tag_id
+            while len(self.tag_ids) > self.max_size:
+                self.tag_ids.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.tag_ids.clear()
+
+
+system_tag_cache = SystemTagCache(max_size=settings.CHAT_SYSTEM_TAG_CACHE_SIZE)
+
+
+@transaction.atomic()
+def save_messages_to_history(session, messages: list[HistoryMessage]) -> list[ChatMessage]:
+    """Save the messages to the session's chat and tag them. Returns the created messages in the same order."""
+    if not messages:
+        return []
+
+    chat_messages = ChatMessage.objects.bulk_create(
+        [
+            ChatMessage(
+                chat=session.chat,
+                message_type=message.message_type.value,
+                content=message.content,
+                metadata=message.metadata,
+            )
+            for message in messages
+        ]
+    )
+
+    if any(message.system_tags for message in messages):
+        _add_system_tags(session.team_id, messages, chat_messages)
+
+    if any(message.message_type == ChatMessageType.HUMAN for message in messages):
+        # `bulk_create` doesn't call `save`, which usually keeps this up to date
+        session.update_last_human_message()
+    return chat_messages
+
+
+def _add_system_tags(team_id: int, messages: list[HistoryMessage], chat_messages: list[ChatMessage]):
+    tag_ids = system_tag_cache.get_tag_ids(team_id, {tag for message in messages for tag in message.system_tags})
+    content_type = ContentType.objects.get_for_model(ChatMessage)
+    CustomTaggedItem.objects.bulk_create(
+        [
+            CustomTaggedItem(
+                content_type=content_type,
+                object_id=chat_message.id,
+                tag_id=tag_ids[tag],
+                team_id=team_id,
+                user=None,
+            )
+            for message, chat_message in zip(messages, chat_messages, strict=True)
+            for tag in dict.fromkeys(message.system_tags)
+        ]
+    )
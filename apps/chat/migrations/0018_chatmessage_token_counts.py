@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2025-03-28 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0017_change_chatmessage_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='token_counts',
+            field=models.JSONField(default=dict, blank=True, help_text='Cached token counts keyed by tokenizer'),
+        ),
+    ]
@@ -103,6 +103,7 @@ class ChatMessage(BaseModel, TaggedModelMixin, UserCommentsMixin):
         null=True, blank=True, help_text="The summary of the conversation up to this point (not including this message)"
     )
     metadata = models.JSONField(default=dict)
+    token_counts = models.JSONField(default=dict, blank=True, help_text="Cached token counts keyed by tokenizer")
 
     class Meta:
         ordering = ["created_at"]
@@ -121,7 +122,20 @@ class ChatMessage(BaseModel, TaggedModelMixin, UserCommentsMixin):
     def save(self, *args, **kwargs):
         if self.is_summary:
             raise ValueError("Cannot save a summary message")
+        is_new = self._state.adding
         super().save(*args, **kwargs)
+        if self.message_type == ChatMessageType.HUMAN and (is_new or not kwargs.get("update_fields")):
+            self._update_session_last_human_message()
+
+    def _update_session_last_human_message(self):
+        """Keep the denormalized `last_human_message` of the chat's session up to date"""
+        from apps.experiments.models import ExperimentSession
+
+        ExperimentSession.objects.filter(chat_id=self.chat_id).filter(
+            Q(last_human_message_at__isnull=True)
+            | Q(last_human_message_at__lte=self.created_at)
+            | Q(last_human_message_id=self.id)
+        ).update(last_human_message_at=self.created_at, last_human_message_id=self.id)
 
     @property
     def trace_info(self):
@@ -208,10 +222,15 @@ class ChatMessage(BaseModel, TaggedModelMixin, UserCommentsMixin):
         self.add_tag(tag, team=self.chat.team, added_by=None)
 
     def add_version_tag(self, version_number: int, is_a_version: bool):
+        tag = self.get_version_tag_name(version_number, is_a_version)
+        self.add_system_tag(tag=tag, tag_category=TagCategories.EXPERIMENT_VERSION)
+
+    @staticmethod
+    def get_version_tag_name(version_number: int, is_a_version: bool) -> str:
         tag = f"v{version_number}"
         if not is_a_version:
             tag = f"{tag}-unreleased"
-        self.add_system_tag(tag=tag, tag_category=TagCategories.EXPERIMENT_VERSION)
+        return tag
 
     def add_rating(self, tag: str):
         tag, _ = Tag.objects.get_or_create(
@@ -0,0 +1,103 @@
+"""
+Push based delivery of chat events to the web UI.
+
+Workers publish events for a session on a Redis channel and the web process relays them to the browser as
+server-sent events. This replaces polling for the bot response and for out-of-band messages (e.g. scheduled
+messages) with a single long-lived connection per open chat.
+
+Each stream holds its connection for up to `STREAM_TIMEOUT` seconds, which ties up a thread when the web process is
+served by a WSGI server, so the stream is only used when `settings.CHAT_EVENT_STREAM_ENABLED` is set. Otherwise the
+chat UI polls.
+
+Events:
+
+    token: A chunk of the bot response as it is being generated: `{"token": "..."}`
+    response: The result of a `get_response_for_webchat_task`: `{"task_id": "...", "message_id": 1, ...}`
+    message: A message sent to the user outside the request / response cycle: `{"content": "..."}`
+
+Usage:
+
+    # in the worker
+    publish_session_event(session.id, SessionEvent.TOKEN, {"token": token})
+
+    # in the view
+    for event in iter_session_events(session.id):
+        ...
+"""
+
+import json
+import logging
+import time
+from collections.abc import Iterator
+
+from django.conf import settings
+
+logger = logging.getLogger("ocs.chat.streaming")
+
+# Maximum time to hold a connection open. Browsers reconnect automatically when the stream ends which keeps
+# connections from being pinned to a web worker indefinitely.
+STREAM_TIMEOUT = 60 * 5
+
+# Interval at which to yield a heartbeat so that proxies don't close the connection
+HEARTBEAT_INTERVAL = 15
+
+
+class SessionEvent:
+    TOKEN = "token"
+    RESPONSE = "response"
+    MESSAGE = "message"
+
+
+def get_session_channel(session_id: int) -> str:
+    return f"ocs:session_events:{session_id}"
+
+
+def publish_session_event(session_id: int, event: str, data: dict):
+    """Publish an event for the session. Errors are logged but not raised since streaming is best effort."""
+    if not settings.CHAT_EVENT_STREAM_ENABLED:
+        return
+
+    payload = json.dumps({"event": event, "data": data})
+    try:
+        _get_redis_connection().publish(get_session_channel(session_id), payload)
+    except Exception:
+        logger.exception("Unable to publish %s event for session %s", event, session_id)
+
+
+def iter_session_events(
+    session_id: int, timeout: float = STREAM_TIMEOUT, heartbeat_interval: float = HEARTBEAT_INTERVAL
+) -> Iterator[tuple[str, dict] | None]:
+    """Yield `(event, data)` tuples for events published to the session until `timeout` is reached.
+
+    `None` is yielded every `heartbeat_interval` seconds when no events have been received.
+    """
+    pubsub = _get_redis_connection().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(get_session_channel(session_id))
+    try:
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            message = pubsub.get_message(timeout=min(heartbeat_interval, remaining))
+            if not message:
+                yield None
+                continue
+
+            try:
+                payload = json.loads(message["data"])
+            except (TypeError, ValueError):
+                logger.warning("Invalid event received for session %s", session_id)
+                continue
+            yield payload["event"], payload["data"]
+    finally:
+        pubsub.close()
+
+
+def format_sse(event: str, data: str) -> str:
+    lines = [f"event: {event}"]
+    lines.extend(f"data: {line}" for line in data.splitlines() or [""])
+    return "\n".join(lines) + "\n\n"
+
+
+def _get_redis_connection():
+    from django_redis import get_redis_connection
+
+    return get_redis_connection("default")
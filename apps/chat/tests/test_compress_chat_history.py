@@ -11,6 +11,7 @@ from apps.chat.conversation import (
     _get_new_summary,
     _get_summary_tokens_with_context,
     compress_chat_history,
+    get_tokenizer_key,
     truncate_tokens,
 )
 from apps.chat.models import Chat, ChatMessage, ChatMessageType
@@ -270,3 +271,18 @@ def test_truncate_tokens():
     assert llm.get_num_tokens_from_messages(new_history) + input_message_tokens <= max_token_limit
     remaining_after_pruning = [{"content": "Another one"}, {"content": "Final message"}]
     assert new_history == remaining_after_pruning
+
+
+def test_token_counts_are_stored_and_reused(chat):
+    for i in range(5):
+        ChatMessage.objects.create(chat=chat, content=f"Hello {i}", message_type=ChatMessageType.HUMAN)
+
+    llm = FakeLlmSimpleTokenCount(responses=[])
+    compress_chat_history(chat, llm, 30, input_messages=[])
+    tokenizer_key = get_tokenizer_key(llm)
+    for message in ChatMessage.objects.filter(chat=chat):
+        assert message.token_counts == {tokenizer_key: {ChatMessageType.HUMAN: 3}}
+
+    with mock.patch.object(FakeLlmSimpleTokenCount, "get_num_tokens_from_messages") as get_num_tokens:
+        compress_chat_history(chat, llm, 30, input_messages=[])
+    get_num_tokens.assert_not_called()
@@ -0,0 +1,112 @@
+import pytest
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from apps.annotations.models import Tag, TagCategories
+from apps.chat.history import HistoryMessage, SystemTagCache, save_messages_to_history
+from apps.chat.models import ChatMessage, ChatMessageType
+from apps.service_providers.llm_service.history_managers import ExperimentHistoryManager
+from apps.utils.factories.experiment import ExperimentSessionFactory
+
+
+@pytest.fixture()
+def session():
+    return ExperimentSessionFactory()
+
+
+def _turn(human="hi", ai="hello"):
+    return [
+        HistoryMessage(content=human, message_type=ChatMessageType.HUMAN),
+        HistoryMessage(
+            content=ai,
+            message_type=ChatMessageType.AI,
+            metadata={"trace_id": "123"},
+            system_tags=[("bot1", TagCategories.BOT_RESPONSE), ("v1", TagCategories.EXPERIMENT_VERSION)],
+        ),
+    ]
+
+
+@pytest.mark.django_db()
+def test_save_messages_to_history(session):
+    human_message, ai_message = save_messages_to_history(session, _turn())
+
+    assert list(session.chat.messages.all()) == [human_message, ai_message]
+    assert ai_message.metadata == {"trace_id": "123"}
+    assert human_message.system_tags_names() == set()
+    assert ai_message.system_tags_names() == {
+        ("bot1", TagCategories.BOT_RESPONSE),
+        ("v1", TagCategories.EXPERIMENT_VERSION),
+    }
+
+    session.refresh_from_db()
+    assert session.last_human_message_id == human_message.id
+    assert session.last_human_message_at == human_message.created_at
+
+
+@pytest.mark.django_db()
+def test_tags_are_cached(session, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        save_messages_to_history(session, _turn())
+
+    with CaptureQueriesContext(connection) as queries:
+        save_messages_to_history(session, _turn())
+
+    statements = [query["sql"] for query in queries.captured_queries]
+    assert not [sql for sql in statements if 'FROM "annotations_tag"' in sql]
+    # one insert for the messages and one for the tagged items
+    assert len([sql for sql in statements if sql.startswith("INSERT")]) == 2
+    assert Tag.objects.filter(team=session.team, is_system_tag=True).count() == 2
+
+
+@pytest.mark.django_db()
+def test_system_tag_cache_is_per_team():
+    cache = SystemTagCache()
+    session1, session2 = ExperimentSessionFactory.create_batch(2)
+    tag = ("bot1", TagCategories.BOT_RESPONSE)
+
+    tag_id1 = cache.get_tag_ids(session1.team_id, [tag])[tag]
+    tag_id2 = cache.get_tag_ids(session2.team_id, [tag])[tag]
+    assert tag_id1 != tag_id2
+    assert Tag.objects.get(id=tag_id2).team_id == session2.team_id
+
+
+@pytest.mark.django_db()
+def test_new_tags_are_not_cached_if_rolled_back(session):
+    cache = SystemTagCache()
+    tag = ("bot1", TagCategories.BOT_RESPONSE)
+
+    @transaction.atomic()
+    def create_tag_and_roll_back():
+        cache.get_tag_ids(session.team_id, [tag])
+        raise ValueError("rollback")
+
+    with pytest.raises(ValueError, match="rollback"):
+        create_tag_and_roll_back()
+
+    assert not cache.tag_ids
+    tag_id = cache.get_tag_ids(session.team_id, [tag])[tag]
+    assert Tag.objects.filter(id=tag_id).exists()
+
+
+@pytest.mark.django_db()
+def test_experiment_history_manager_saves_turn(session):
+    manager = ExperimentHistoryManager(session=session, experiment=session.experiment)
+    manager.add_messages_to_history(
+        input="hi",
+        save_input_to_history=True,
+        input_message_metadata={},
+        output="hello",
+        save_output_to_history=True,
+        experiment_tag="bot1",
+        output_message_metadata={"openai_file_ids": []},
+    )
+
+    human_message, ai_message = ChatMessage.objects.filter(chat=session.chat)
+    assert manager.ai_message == ai_message
+    assert human_message.message_type == ChatMessageType.HUMAN
+    assert ai_message.metadata == {"openai_file_ids": []}
+    version_tag = ChatMessage.get_version_tag_name(session.experiment.version_number, session.experiment.is_a_version)
+    assert ai_message.system_tags_names() == {
+        ("bot1", TagCategories.BOT_RESPONSE),
+        (version_tag, TagCategories.EXPERIMENT_VERSION),
+    }
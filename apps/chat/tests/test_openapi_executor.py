@@ -1,10 +1,13 @@
+from unittest import mock
+
 import pytest
 from langchain_community.utilities.openapi import OpenAPISpec
 from langchain_core.messages import ToolMessage
 
-from apps.chat.agent.openapi_tool import openapi_spec_op_to_function_def
+from apps.chat.agent.openapi_tool import FunctionDefCache, openapi_spec_op_to_function_def
 from apps.chat.tests.test_openapi_tool import _make_openapi_schema
-from apps.service_providers.auth_service import anonymous_auth_service
+from apps.service_providers.auth_service import AuthService, BearerTokenAuthService, anonymous_auth_service
+from apps.service_providers.client_pool import ClientPool
 
 
 def test_openapi_tool_query_params(httpx_mock):
@@ -115,6 +118,50 @@ def test_openapi_tool_response_content_disposition_attachment(httpx_mock, filena
         assert result.artifact.name == "example.txt"
 
 
+def test_openapi_tool_reuses_http_client(httpx_mock):
+    spec = _make_openapi_schema({"parameters": []})
+    httpx_mock.add_response(url="https://example.com/test")
+    create_client = AuthService.create_http_client
+    with (
+        mock.patch("apps.service_providers.auth_service.main.client_pool", ClientPool()),
+        mock.patch.object(AuthService, "create_http_client", autospec=True, side_effect=create_client) as create,
+    ):
+        _test_tool_call(spec, {})
+        _test_tool_call(spec, {})
+    assert create.call_count == 1
+    assert len(httpx_mock.get_requests()) == 2
+
+
+def test_shared_http_client_does_not_keep_cookies(httpx_mock):
+    httpx_mock.add_response(url="https://example.com/login", headers={"Set-Cookie": "sessionid=123; Path=/"})
+    httpx_mock.add_response(url="https://example.com/test")
+    client = anonymous_auth_service.create_http_client()
+    client.get("https://example.com/login")
+    client.get("https://example.com/test")
+
+    assert not client.cookies
+    assert "cookie" not in httpx_mock.get_requests()[1].headers
+
+
+def test_http_clients_are_not_shared_between_credentials():
+    client1 = BearerTokenAuthService(token="token1").get_http_client()
+    assert BearerTokenAuthService(token="token1").get_http_client() is client1
+    assert BearerTokenAuthService(token="token2").get_http_client() is not client1
+
+
+def test_function_def_cache():
+    cache = FunctionDefCache(max_size=1)
+    spec = _make_openapi_schema({"parameters": []})
+    with mock.patch("apps.chat.agent.openapi_tool.openapi_spec_op_to_function_def") as build:
+        function_def = cache.get(spec)
+        assert cache.get(spec) is function_def
+        build.assert_called_once()
+
+        cache.get({**spec, "paths": {}})
+        cache.get(spec)
+        assert build.call_count == 2
+
+
 def _test_tool_call(spec_dict, call_args: dict, path=None):
     spec = OpenAPISpec.from_spec_dict(spec_dict)
     path = path or list(spec.paths)[0]
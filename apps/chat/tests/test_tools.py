@@ -17,6 +17,7 @@ from apps.chat.agent.tools import (
 )
 from apps.events.models import ScheduledMessage, TimePeriod
 from apps.experiments.models import AgentTools, Experiment
+from apps.service_providers.llm_service.prompt_context import ParticipantDataProxy
 from apps.utils.factories.events import EventActionFactory
 from apps.utils.factories.experiment import ExperimentSessionFactory
 from apps.utils.time import pretty_date
@@ -352,7 +353,9 @@ def test_create_schedule_message_experiment_does_not_exist():
 class TestUpdateParticipantDataTool:
     def _invoke_tool(self, session, **tool_kwargs):
         tool = UpdateParticipantDataTool(experiment_session=session)
-        return tool.action(**tool_kwargs)
+        response = tool.action(**tool_kwargs)
+        ParticipantDataProxy.end_turn(session)
+        return response
 
     @pytest.fixture()
     def session(self, db):
@@ -4,9 +4,16 @@ from unittest.mock import Mock, patch
 import pytest
 
 from apps.annotations.models import TagCategories
+from apps.chat.blueprints import TopicBotBlueprint, blueprint_cache
 from apps.chat.bots import TopicBot
 from apps.chat.models import ChatMessage, ChatMessageType
-from apps.experiments.models import ExperimentRoute, ExperimentRouteType, ExperimentSession, SafetyLayer
+from apps.experiments.models import (
+    ExperimentRoute,
+    ExperimentRouteType,
+    ExperimentSession,
+    SafetyLayer,
+    SafetyLayerModes,
+)
 from apps.service_providers.models import TraceProvider
 from apps.utils.factories.experiment import ExperimentFactory, ExperimentSessionFactory
 from apps.utils.langchain import build_fake_llm_service, mock_llm
@@ -123,3 +130,89 @@ def test_tracing_service_reentry():
         # reload the session from the DB
         session = ExperimentSession.objects.get(id=session.id)
         _run_bot_with_wrapped_service(session, "response2")
+
+
+@pytest.mark.django_db()
+@patch("apps.service_providers.llm_service.runnables.publish_session_event")
+def test_bot_streams_tokens_to_session(publish_session_event):
+    session = ExperimentSessionFactory()
+    bot = TopicBot(session, stream_tokens=True)
+    with mock_llm(responses=["Hello there"]):
+        response = bot.process_input("Hi")
+
+    streamed = "".join(call.args[2]["token"] for call in publish_session_event.call_args_list)
+    assert streamed == response == "Hello there"
+    assert all(call.args[0] == session.id for call in publish_session_event.call_args_list)
+
+
+@pytest.mark.django_db()
+@patch("apps.service_providers.llm_service.runnables.publish_session_event")
+def test_bot_does_not_stream_tokens_with_ai_safety_layer(publish_session_event):
+    session = ExperimentSessionFactory()
+    layer = SafetyLayer.objects.create(
+        prompt_text="Is this message safe?", team=session.experiment.team, messages_to_review="ai"
+    )
+    session.experiment.safety_layers.add(layer)
+    bot = TopicBot(session, stream_tokens=True)
+    with patch("apps.chat.bots.SafetyBot.is_safe", return_value=True), mock_llm(responses=["Hello there"]):
+        bot.process_input("Hi")
+
+    publish_session_event.assert_not_called()
+
+
+@pytest.mark.django_db()
+def test_blueprint_is_reused_for_published_versions(django_assert_num_queries):
+    session = ExperimentSessionFactory()
+    layer = SafetyLayer.objects.create(prompt_text="Is this message safe?", team=session.experiment.team)
+    session.experiment.safety_layers.add(layer)
+    version = session.experiment.create_new_version()
+    blueprint_cache.clear()
+
+    with patch.object(TopicBotBlueprint, "build", wraps=TopicBotBlueprint.build) as build:
+        bots = [TopicBot(session, experiment=version) for _ in range(2)]
+        assert build.call_count == 1
+
+        TopicBot(session)
+        assert build.call_count == 2
+
+    # the blueprint is shared but each bot gets its own model instances
+    assert bots[0].blueprint is bots[1].blueprint
+    assert bots[0].experiment is not bots[1].experiment
+    assert bots[0].experiment == version
+    assert bots[0].safety_layers[0] is not bots[1].safety_layers[0]
+    assert bots[0].safety_layers[0].working_version_id == layer.id
+    assert bots[0].blueprint.get_tool_config(version.id).tools_enabled == version.tools_enabled
+
+    # restoring the instances doesn't query the DB
+    with django_assert_num_queries(0):
+        experiment = bots[0].blueprint.experiment.restore()
+        assert experiment.llm_provider == version.llm_provider
+        assert experiment.team == version.team
+    assert bots[0].chain is not bots[1].chain
+
+
+@pytest.mark.django_db()
+@pytest.mark.parametrize("is_safe", [True, False])
+def test_speculative_safety_layers(is_safe):
+    session = ExperimentSessionFactory(experiment__safety_layer_mode=SafetyLayerModes.SPECULATIVE)
+    for _ in range(2):
+        layer = SafetyLayer.objects.create(prompt_text="Is this message safe?", team=session.experiment.team)
+        session.experiment.safety_layers.add(layer)
+
+    with (
+        patch("apps.chat.bots.SafetyBot.is_safe", return_value=is_safe) as is_safe_mock,
+        patch("apps.chat.bots.notify_users_of_violation"),
+        mock_llm(responses=["Speculative response"]),
+    ):
+        bot = TopicBot(session)
+        response = bot.process_input("Hi")
+
+    assert is_safe_mock.call_count == 2
+    ai_messages = list(session.chat.messages.filter(message_type=ChatMessageType.AI).values_list("content", flat=True))
+    assert session.chat.messages.filter(message_type=ChatMessageType.HUMAN).count() == 1
+    if is_safe:
+        assert response == "Speculative response"
+        assert ai_messages == ["Speculative response"]
+    else:
+        assert response == "Sorry, I can't answer that. Please try something else."
+        assert ai_messages == [response]
@@ -43,3 +43,11 @@ def _django_db_restore_serialized(request: pytest.FixtureRequest, django_db_keep
 @pytest.fixture(autouse=True, scope="session")
 def _set_env():
     os.environ["UNIT_TESTING"] = "True"
+
+
+@pytest.fixture(autouse=True)
+def _clear_pipeline_runnable_cache():
+    """Tests often modify pipeline nodes directly so we can't rely on the compiled graphs being invalidated"""
+    from apps.pipelines.graph import runnable_cache
+
+    runnable_cache.clear()
@@ -0,0 +1,71 @@
+# Generated by Django 5.1.2 on 2025-04-01 09:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def _populate_attempts(apps, schema_editor):
+    """Create the attempt counts for the last human message of each active session from the event logs"""
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    EventLog = apps.get_model('events', 'EventLog')
+    TimeoutTriggerAttempts = apps.get_model('events', 'TimeoutTriggerAttempts')
+
+    content_type = ContentType.objects.filter(app_label='events', model='timeouttrigger').first()
+    if not content_type:
+        return
+
+    counts = (
+        EventLog.objects.filter(
+            content_type=content_type,
+            session__ended_at__isnull=True,
+            chat_message_id=models.F("session__last_human_message_id"),
+        )
+        .values("object_id", "session_id", "chat_message_id")
+        .annotate(
+            success_count=models.Count("id", filter=models.Q(status="success")),
+            failure_count=models.Count("id", filter=models.Q(status="failure")),
+        )
+    )
+    TimeoutTriggerAttempts.objects.bulk_create(
+        (
+            TimeoutTriggerAttempts(
+                trigger_id=count["object_id"],
+                session_id=count["session_id"],
+                chat_message_id=count["chat_message_id"],
+                success_count=count["success_count"],
+                failure_count=count["failure_count"],
+            )
+            for count in counts.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0018_chatmessage_token_counts'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('events', '0020_scheduledmessage_cancelled_at_and_more'),
+        ('experiments', '0111_experimentsession_last_human_message'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimeoutTriggerAttempts',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('success_count', models.PositiveIntegerField(default=0)),
+                ('failure_count', models.PositiveIntegerField(default=0)),
+                ('chat_message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chat.chatmessage')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeout_trigger_attempts', to='experiments.experimentsession')),
+                ('trigger', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attempts', to='events.timeouttrigger')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('trigger', 'session'), name='unique_timeout_trigger_attempts')],
+            },
+        ),
+        migrations.RunPython(_populate_attempts, migrations.RunPython.noop, elidable=True),
+    ]
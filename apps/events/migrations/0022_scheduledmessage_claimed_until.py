@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2025-04-08 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0021_timeouttriggerattempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledmessage',
+            name='claimed_until',
+            field=models.DateTimeField(blank=True, help_text='The message is reserved for the task that fires it until this time', null=True),
+        ),
+    ]
@@ -1,19 +1,38 @@
 import logging
-from datetime import timedelta
+from datetime import datetime, timedelta
 from functools import cached_property
 
 import pytz
 from dateutil.relativedelta import relativedelta
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.db import models, transaction
-from django.db.models import F, Func, OuterRef, Q, Subquery, functions
+from django.db.models import (
+    Case,
+    DateTimeField,
+    DurationField,
+    Exists,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    Q,
+    Value,
+    When,
+    functions,
+)
 from django.utils import timezone
 
 from apps.chat.models import ChatMessage, ChatMessageType
 from apps.events import actions
 from apps.events.const import TOTAL_FAILURES
-from apps.experiments.models import Experiment, ExperimentSession, VersionsMixin, VersionsObjectManagerMixin
+from apps.experiments.models import (
+    Experiment,
+    ExperimentSession,
+    SessionStatus,
+    VersionsMixin,
+    VersionsObjectManagerMixin,
+)
 from apps.experiments.versioning import VersionDetails, VersionField
 from apps.teams.models import BaseTeamModel
 from apps.teams.utils import current_team
@@ -23,6 +42,8 @@ from apps.utils.time import pretty_date
 
 logger = logging.getLogger("ocs.events")
 
+STATIC_TRIGGER_TYPES_CACHE_TIMEOUT = 60 * 60 * 24
+
 ACTION_HANDLERS = {
     "end_conversation": actions.EndConversationAction,
     "log": actions.LogAction,
@@ -37,7 +58,42 @@ class StaticTriggerObjectManager(VersionsObjectManagerMixin, models.Manager):
     pass
 
 
-class TimeoutTriggerObjectManager(VersionsObjectManagerMixin, models.Manager):
+class TimeoutTriggerQuerySet(models.QuerySet):
+    def timed_out_sessions(self):
+        """Returns `(trigger_id, session_id)` pairs for all sessions where one of the triggers is due:
+        - The last human message was sent at a time earlier than the trigger time
+        - There have been fewer trigger attempts for the last human message than the total number defined by the
+          trigger, and fewer failures than the maximum
+        """
+        from apps.chat.tasks import STATUSES_FOR_COMPLETE_CHATS
+
+        active_statuses = [status for status in SessionStatus.values if status not in STATUSES_FOR_COMPLETE_CHATS]
+        trigger_time = ExpressionWrapper(
+            Value(timezone.now(), output_field=DateTimeField())
+            - ExpressionWrapper(F("delay") * timedelta(seconds=1), output_field=DurationField()),
+            output_field=DateTimeField(),
+        )
+        exhausted_attempts = TimeoutTriggerAttempts.objects.filter(
+            trigger_id=OuterRef("id"),
+            session_id=OuterRef("experiment__sessions__id"),
+            chat_message_id=OuterRef("experiment__sessions__last_human_message_id"),
+        ).filter(Q(success_count__gte=OuterRef("total_num_triggers")) | Q(failure_count__gte=TOTAL_FAILURES))
+
+        # All the session conditions must be in the same `filter` call so that they apply to the same join
+        return (
+            self.annotate(trigger_time=trigger_time)
+            .filter(
+                experiment__sessions__ended_at=None,
+                experiment__sessions__status__in=active_statuses,
+                experiment__sessions__last_human_message_at__lt=F("trigger_time"),
+            )
+            .annotate(attempts_exhausted=Exists(exhausted_attempts))
+            .filter(attempts_exhausted=False)
+            .values_list("id", "experiment__sessions__id")
+        )
+
+
+class TimeoutTriggerObjectManager(VersionsObjectManagerMixin, models.Manager.from_queryset(TimeoutTriggerQuerySet)):
     pass
 
 
@@ -88,6 +144,15 @@ class EventLog(BaseModel):
             models.Index(fields=["content_type", "object_id"]),
         ]
 
+    def save(self, *args, **kwargs):
+        is_new = self._state.adding
+        super().save(*args, **kwargs)
+        is_timeout_trigger = self.content_type_id == ContentType.objects.get_for_model(TimeoutTrigger).id
+        if is_new and is_timeout_trigger and self.chat_message_id:
+            TimeoutTriggerAttempts.record_attempt(
+                self.object_id, self.session_id, self.chat_message_id, self.status == EventLogStatusChoices.SUCCESS
+            )
+
 
 class StaticTriggerType(models.TextChoices):
     CONVERSATION_END = ("conversation_end", "The conversation ends")
@@ -119,6 +184,30 @@ class StaticTrigger(BaseModel, VersionsMixin):
     def trigger_type(self):
         return "StaticTrigger"
 
+    @staticmethod
+    def get_trigger_types(experiment_id: int) -> set[str]:
+        """Returns the types of the (non-archived) static triggers configured for the experiment. This is cached since
+        it is checked for every message and most experiments don't have any static triggers."""
+        cache_key = StaticTrigger._trigger_types_cache_key(experiment_id)
+        trigger_types = cache.get(cache_key)
+        if trigger_types is None:
+            trigger_types = list(
+                StaticTrigger.objects.filter(experiment_id=experiment_id).values_list("type", flat=True).distinct()
+            )
+            cache.set(cache_key, trigger_types, timeout=STATIC_TRIGGER_TYPES_CACHE_TIMEOUT)
+        return set(trigger_types)
+
+    @staticmethod
+    def invalidate_trigger_types_cache(experiment_id: int):
+        cache_key = StaticTrigger._trigger_types_cache_key(experiment_id)
+        cache.delete(cache_key)
+        # Clear it again once the change is visible to other connections in case it was repopulated in the meantime
+        transaction.on_commit(lambda: cache.delete(cache_key))
+
+    @staticmethod
+    def _trigger_types_cache_key(experiment_id: int) -> str:
+        return f"static_trigger_types:{experiment_id}"
+
     def fire(self, session):
         try:
             result = ACTION_HANDLERS[self.action.action_type]().invoke(session, self.action)
@@ -128,10 +217,15 @@ class StaticTrigger(BaseModel, VersionsMixin):
             logging.exception(e)
             self.event_logs.create(session=session, status=EventLogStatusChoices.FAILURE, log=str(e))
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        StaticTrigger.invalidate_trigger_types_cache(self.experiment_id)
+
     @transaction.atomic()
     def delete(self, *args, **kwargs):
         result = super().delete(*args, **kwargs)
         self.action.delete(*args, **kwargs)
+        StaticTrigger.invalidate_trigger_types_cache(self.experiment_id)
         return result
 
     @transaction.atomic()
@@ -195,75 +289,9 @@ class TimeoutTrigger(BaseModel, VersionsMixin):
         return "TimeoutTrigger"
 
     def timed_out_sessions(self):
-        """Finds all the timed out sessions where:
-        - The last human message was sent at a time earlier than the trigger time
-        - There have been fewer trigger attempts than the total number defined by the trigger
-        """
-        from apps.chat.tasks import STATUSES_FOR_COMPLETE_CHATS
-
-        trigger_time = timezone.now() - timedelta(seconds=self.delay)
-
-        last_human_message_created_at = (
-            ChatMessage.objects.filter(
-                chat__experiment_session=OuterRef("pk"),
-                message_type=ChatMessageType.HUMAN,
-            )
-            .order_by("-created_at")
-            .values("created_at")[:1]
-        )
-        last_human_message_id = (
-            ChatMessage.objects.filter(
-                chat__experiment_session=OuterRef("session_id"),
-                message_type=ChatMessageType.HUMAN,
-            )
-            .order_by("-created_at")
-            .values("id")[:1]
-        )
-        log_count_for_last_message = (
-            EventLog.objects.filter(
-                session=OuterRef("pk"),
-                chat_message_id=Subquery(last_human_message_id),
-                status=EventLogStatusChoices.SUCCESS,
-            )
-            .annotate(
-                count=Func(F("chat_message_id"), function="Count")
-            )  # We don't use Count here because otherwise Django wants to do a group_by, which messes up the subquery: https://stackoverflow.com/a/69031027
-            .values("count")
-        )
-        failure_count_for_last_message = (
-            EventLog.objects.filter(
-                session=OuterRef("pk"),
-                chat_message_id=Subquery(last_human_message_id),
-                status=EventLogStatusChoices.FAILURE,
-            )
-            .annotate(count=Func(F("chat_message_id"), function="Count"))
-            .values("count")
-        )
-
-        sessions = (
-            ExperimentSession.objects.filter(
-                experiment=self.experiment,
-                ended_at=None,
-            )
-            .exclude(status__in=STATUSES_FOR_COMPLETE_CHATS)
-            .annotate(
-                last_human_message_created_at=Subquery(last_human_message_created_at),
-                log_count=Subquery(log_count_for_last_message),
-                failure_count=Subquery(failure_count_for_last_message),
-            )
-            .filter(
-                last_human_message_created_at__lt=trigger_time,
-                last_human_message_created_at__isnull=False,
-            )  # The last message was received before the trigger time
-            .filter(
-                Q(log_count__lt=self.total_num_triggers) | Q(log_count__isnull=True)
-            )  # There were either no tries yet, or fewer tries than the required number for this message
-            .filter(
-                Q(failure_count__lt=TOTAL_FAILURES)
-                # There are still failures left
-            )
-        )
-        return sessions.select_related("experiment_channel", "experiment").all()
+        """Finds all the timed out sessions for this trigger. See `TimeoutTriggerQuerySet.timed_out_sessions`"""
+        session_ids = [session_id for _, session_id in TimeoutTrigger.objects.filter(id=self.id).timed_out_sessions()]
+        return ExperimentSession.objects.filter(id__in=session_ids).select_related("experiment_channel", "experiment")
 
     def fire(self, session) -> str | None:
         last_human_message = ChatMessage.objects.filter(
@@ -284,31 +312,17 @@ class TimeoutTrigger(BaseModel, VersionsMixin):
             )
 
         if not self._has_triggers_left(session, last_human_message):
-            from apps.events.tasks import enqueue_static_triggers
+            from apps.events.tasks import enqueue_static_trigger_event
 
-            enqueue_static_triggers.delay(session.id, StaticTriggerType.LAST_TIMEOUT)
+            enqueue_static_trigger_event(session, StaticTriggerType.LAST_TIMEOUT)
 
         return result
 
     def _has_triggers_left(self, session, message):
-        has_succeeded = (
-            self.event_logs.filter(
-                session=session,
-                chat_message=message,
-                status=EventLogStatusChoices.SUCCESS,
-            ).count()
-            >= self.total_num_triggers
-        )
-        failed = (
-            self.event_logs.filter(
-                session=session,
-                chat_message=message,
-                status=EventLogStatusChoices.FAILURE,
-            ).count()
-            >= TOTAL_FAILURES
-        )
-
-        return not (has_succeeded or failed)
+        attempts = TimeoutTriggerAttempts.objects.filter(trigger=self, session=session, chat_message=message).first()
+        if not attempts:
+            return True
+        return attempts.success_count < self.total_num_triggers and attempts.failure_count < TOTAL_FAILURES
 
     def get_fields_to_exclude(self):
         return super().get_fields_to_exclude() + ["action", "experiment", "event_logs"]
@@ -332,6 +346,44 @@ class TimeoutTrigger(BaseModel, VersionsMixin):
         )
 
 
+class TimeoutTriggerAttempts(BaseModel):
+    """Counts the attempts of a timeout trigger for the last human message of a session. The counts are reset when
+    a new human message is received."""
+
+    trigger = models.ForeignKey(TimeoutTrigger, on_delete=models.CASCADE, related_name="attempts")
+    session = models.ForeignKey(ExperimentSession, on_delete=models.CASCADE, related_name="timeout_trigger_attempts")
+    chat_message = models.ForeignKey(ChatMessage, on_delete=models.CASCADE, related_name="+")
+    success_count = models.PositiveIntegerField(default=0)
+    failure_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["trigger", "session"], name="unique_timeout_trigger_attempts"),
+        ]
+
+    @staticmethod
+    def record_attempt(trigger_id: int, session_id: int, chat_message_id: int, succeeded: bool):
+        counter, other = ("success_count", "failure_count") if succeeded else ("failure_count", "success_count")
+        attempts, created = TimeoutTriggerAttempts.objects.get_or_create(
+            trigger_id=trigger_id,
+            session_id=session_id,
+            defaults={"chat_message_id": chat_message_id, counter: 1},
+        )
+        if created:
+            return
+
+        # A single update so that concurrent attempts can't overwrite each other. The counts are reset if this is the
+        # first attempt for a new message.
+        same_message = Q(chat_message_id=chat_message_id)
+        TimeoutTriggerAttempts.objects.filter(id=attempts.id).update(
+            chat_message_id=chat_message_id,
+            **{
+                counter: Case(When(same_message, then=F(counter) + 1), default=Value(1)),
+                other: Case(When(same_message, then=F(other)), default=Value(0)),
+            },
+        )
+
+
 class ScheduledMessageManager(models.Manager):
     def get_messages_to_fire(self):
         return (
@@ -340,6 +392,26 @@ class ScheduledMessageManager(models.Manager):
             .order_by("next_trigger_date")
         )
 
+    def claim_messages_to_fire(self, batch_size: int, claim_timeout: int) -> tuple[list[tuple[int, int]], datetime]:
+        """Claim up to `batch_size` messages that are due and aren't already claimed.
+
+        Rows that are locked by another poller are skipped rather than waited for, so pollers can run concurrently
+        without claiming the same messages. Returns the `(id, team_id)` of the claimed messages and the time that
+        the claim expires, after which the messages can be claimed again.
+        """
+        claimed_until = timezone.now() + timedelta(seconds=claim_timeout)
+        with transaction.atomic():
+            claimed = list(
+                self.get_messages_to_fire()
+                .filter(Q(claimed_until=None) | Q(claimed_until__lt=functions.Now()))
+                .select_related(None)
+                .select_for_update(skip_locked=True)
+                .values_list("id", "team_id")[:batch_size]
+            )
+            if claimed:
+                self.filter(id__in=[message_id for message_id, _ in claimed]).update(claimed_until=claimed_until)
+        return claimed, claimed_until
+
 
 class TimePeriod(models.TextChoices):
     MINUTES = ("minutes", "Minutes")
@@ -368,6 +440,9 @@ class ScheduledMessage(BaseTeamModel):
 
     cancelled_at = models.DateTimeField(null=True, blank=True)
     cancelled_by = models.ForeignKey("users.CustomUser", on_delete=models.SET_NULL, null=True, blank=True)
+    claimed_until = models.DateTimeField(
+        null=True, blank=True, help_text="The message is reserved for the task that fires it until this time"
+    )
 
     objects = ScheduledMessageManager()
 
@@ -401,15 +476,15 @@ class ScheduledMessage(BaseTeamModel):
         inputs = [name, experiment_id, participant_id]
         return get_next_unique_id(ScheduledMessage, inputs, "external_id", length=5, model_instance=instance)
 
-    def safe_trigger(self):
+    def safe_trigger(self, experiment_session: ExperimentSession | None = None):
         """This wraps a call to the _trigger method in a try-catch block"""
         try:
-            self._trigger()
+            self._trigger(experiment_session)
         except Exception as e:
             logger.exception(f"An error occurred while trying to send scheduled message {self.id}. Error: {e}")
 
-    def _trigger(self):
-        experiment_session = self.participant.get_latest_session(experiment=self.experiment)
+    def _trigger(self, experiment_session: ExperimentSession | None = None):
+        experiment_session = experiment_session or self.participant.get_latest_session(experiment=self.experiment)
         if not experiment_session:
             # Schedules probably created by the API
             return
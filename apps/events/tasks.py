@@ -1,6 +1,13 @@
 import logging
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
 
+from celery import group
 from celery.app import shared_task
+from django.conf import settings
+from django.utils import timezone
 
 from apps.events.models import ScheduledMessage, StaticTrigger, TimeoutTrigger
 from apps.experiments.models import ExperimentSession
@@ -8,15 +15,100 @@ from apps.experiments.models import ExperimentSession
 logger = logging.getLogger("ocs.events")
 
 
+# Events for a session that happen within this many seconds of each other are processed by a single task
+STATIC_TRIGGER_BATCH_DELAY = 1
+
+# Expiry for the list of pending events. This prevents events from getting stuck if the task that processes them
+# is lost.
+PENDING_EVENTS_TIMEOUT = 60 * 5
+
+# Expiry for the marker that records that a task has been queued to process a session's pending events. If the task
+# is lost, the next event after the marker expires queues a new task.
+PENDING_EVENTS_SCHEDULED_TIMEOUT = 60
+
+# How long a scheduled message is reserved for the task that is firing it. This should be longer than it takes to
+# generate and send a message. If the task fails the message is released straight away to be retried.
+SCHEDULED_MESSAGE_FIRE_TIMEOUT = 60 * 10
+
+
+def enqueue_static_trigger_event(session: ExperimentSession, trigger_type: str):
+    """Queue the static triggers of `trigger_type` to be fired for the session.
+
+    Nothing is queued if the session's experiment doesn't have any triggers of this type. Events for the same session
+    are batched so that a burst of events (e.g. a new human message followed by the bot reply) results in a single
+    task.
+    """
+    if trigger_type not in StaticTrigger.get_trigger_types(session.experiment_id):
+        return
+
+    redis = _get_redis_connection()
+    key = _pending_events_key(session.id)
+    scheduled_key = _pending_events_scheduled_key(session.id)
+    try:
+        with redis.pipeline() as pipe:
+            pipe.rpush(key, str(trigger_type))
+            pipe.expire(key, PENDING_EVENTS_TIMEOUT)
+            pipe.set(scheduled_key, 1, nx=True, ex=PENDING_EVENTS_SCHEDULED_TIMEOUT)
+            _, _, should_schedule = pipe.execute()
+    except Exception:
+        logger.exception("Unable to batch static trigger event for session %s", session.id)
+        enqueue_static_triggers.delay(session.id, trigger_type)
+        return
+
+    # Only the event that set the marker needs to queue a task
+    if should_schedule:
+        try:
+            process_static_trigger_events.apply_async((session.id,), countdown=STATIC_TRIGGER_BATCH_DELAY)
+        except Exception:
+            # Clear the marker so that the next event queues the task instead
+            redis.delete(scheduled_key)
+            raise
+
+
+@shared_task(ignore_result=True)
+def process_static_trigger_events(session_id):
+    # Clearing the marker together with draining the events means that any later event queues a new task
+    with _get_redis_connection().pipeline() as pipe:
+        pipe.delete(_pending_events_scheduled_key(session_id))
+        pipe.lrange(_pending_events_key(session_id), 0, -1)
+        pipe.delete(_pending_events_key(session_id))
+        _, trigger_types, _ = pipe.execute()
+
+    if trigger_types:
+        session = ExperimentSession.objects.get(id=session_id)
+        _fire_static_triggers(session, [trigger_type.decode() for trigger_type in trigger_types])
+
+
 @shared_task(ignore_result=True)
 def enqueue_static_triggers(session_id, trigger_type):
     session = ExperimentSession.objects.get(id=session_id)
+    _fire_static_triggers(session, [trigger_type])
 
-    trigger_ids = StaticTrigger.objects.filter(experiment_id=session.experiment_id, type=trigger_type).values_list(
-        "id", flat=True
-    )
-    for trigger_id in trigger_ids:
-        fire_static_trigger.delay(trigger_id, session_id)
+
+def _fire_static_triggers(session: ExperimentSession, trigger_types: list[str]):
+    """Fire the session's static triggers for each event in `trigger_types`, in order"""
+    trigger_ids_by_type = defaultdict(list)
+    triggers = StaticTrigger.objects.filter(experiment_id=session.experiment_id, type__in=set(trigger_types))
+    for trigger_id, trigger_type in triggers.values_list("id", "type"):
+        trigger_ids_by_type[trigger_type].append(trigger_id)
+
+    for trigger_type in trigger_types:
+        for trigger_id in trigger_ids_by_type[trigger_type]:
+            fire_static_trigger.delay(trigger_id, session.id)
+
+
+def _pending_events_key(session_id: int) -> str:
+    return f"static_trigger_events:{session_id}"
+
+
+def _pending_events_scheduled_key(session_id: int) -> str:
+    return f"static_trigger_events:{session_id}:scheduled"
+
+
+def _get_redis_connection():
+    from django_redis import get_redis_connection
+
+    return get_redis_connection("default")
 
 
 @shared_task(ignore_result=True)
@@ -29,18 +121,27 @@ def fire_static_trigger(trigger_id, session_id):
 
 @shared_task(ignore_result=True)
 def enqueue_timed_out_events():
-    active_triggers = TimeoutTrigger.objects.all()
-    for trigger in active_triggers:
-        for session in trigger.timed_out_sessions():
-            if session.is_stale():
-                logger.warning(
-                    f"ExperimentChannel is pointing to experiment '{session.experiment.name}'"
-                    "whereas the current experiment session points to experiment"
-                    f"'{session.experiment.name}'"
-                )
-                continue
-            else:
-                fire_trigger.delay(trigger.id, session.id)
+    trigger_sessions = list(TimeoutTrigger.objects.timed_out_sessions())
+    if not trigger_sessions:
+        return
+
+    sessions = ExperimentSession.objects.select_related("experiment_channel__experiment", "experiment").in_bulk(
+        {session_id for _, session_id in trigger_sessions}
+    )
+    fire_tasks = []
+    for trigger_id, session_id in trigger_sessions:
+        session = sessions[session_id]
+        if session.is_stale():
+            logger.warning(
+                f"ExperimentChannel is pointing to experiment '{session.experiment_channel.experiment.name}'"
+                "whereas the current experiment session points to experiment"
+                f"'{session.experiment.name}'"
+            )
+            continue
+        fire_tasks.append(fire_trigger.s(trigger_id, session_id))
+
+    if fire_tasks:
+        group(fire_tasks).apply_async()
 
 
 @shared_task(ignore_result=True)
@@ -53,9 +154,84 @@ def fire_trigger(trigger_id, session_id):
 
 @shared_task(ignore_result=True)
 def poll_scheduled_messages():
-    """Polls scheduled messages and triggers those that are due. After triggering, it updates the database with the
-    new trigger details for each message."""
+    """Claims the scheduled messages that are due and queues a task to fire each one. Messages are claimed in
+    batches with `SELECT ... FOR UPDATE SKIP LOCKED` so that overlapping polls never queue the same message twice.
+
+    The tasks for each team are spread out to stay within the team's rate limit. This is only a best effort, the
+    limits are enforced by `fire_scheduled_message`.
+    """
+    team_counts = defaultdict(int)
+    while True:
+        claimed, claimed_until = ScheduledMessage.objects.claim_messages_to_fire(
+            batch_size=settings.SCHEDULED_MESSAGE_BATCH_SIZE, claim_timeout=settings.SCHEDULED_MESSAGE_CLAIM_TIMEOUT
+        )
+        if not claimed:
+            return
+
+        fire_tasks = []
+        for message_id, team_id in claimed:
+            countdown = team_counts[team_id] // settings.SCHEDULED_MESSAGE_TEAM_RATE_LIMIT
+            team_counts[team_id] += 1
+            fire_tasks.append(fire_scheduled_message.si(message_id, claimed_until.isoformat()).set(countdown=countdown))
+        group(fire_tasks).apply_async()
+        logger.info("Queued %s scheduled messages", len(fire_tasks))
+
+        if len(claimed) < settings.SCHEDULED_MESSAGE_BATCH_SIZE:
+            return
+
+
+@shared_task(bind=True, ignore_result=True, max_retries=None)
+def fire_scheduled_message(self, message_id: int, claimed_until: str):
+    """Fire a scheduled message that was claimed by `poll_scheduled_messages`.
+
+    The message is only fired if the claim is still valid, i.e. it hasn't already been fired and it hasn't been
+    claimed again by another poll. The message is retried later if the team or the session's messaging provider
+    is over its rate limit.
+    """
+    claimed_until = datetime.fromisoformat(claimed_until)
+    message = (
+        ScheduledMessage.objects.select_related("action", "experiment", "participant")
+        .filter(id=message_id, claimed_until=claimed_until)
+        .first()
+    )
+    if not message:
+        return
+
+    session = message.participant.get_latest_session(experiment=message.experiment)
+    rate_limits = [(f"team:{message.team_id}", settings.SCHEDULED_MESSAGE_TEAM_RATE_LIMIT)]
+    if session and session.experiment_channel and session.experiment_channel.messaging_provider_id:
+        provider_id = session.experiment_channel.messaging_provider_id
+        rate_limits.append((f"messaging_provider:{provider_id}", settings.SCHEDULED_MESSAGE_PROVIDER_RATE_LIMIT))
+    for key, limit in rate_limits:
+        if _is_rate_limited(key, limit):
+            raise self.retry(countdown=random.uniform(1, 3))
+
+    # Take over the claim so that the message can't be fired by a task queued by another poll
+    fire_claim = timezone.now() + timedelta(seconds=SCHEDULED_MESSAGE_FIRE_TIMEOUT)
+    claimed = ScheduledMessage.objects.filter(
+        id=message_id, claimed_until=claimed_until, is_complete=False, cancelled_at=None
+    ).update(claimed_until=fire_claim)
+    if not claimed:
+        return
+
+    message.claimed_until = None
+    try:
+        message.safe_trigger(session)
+    finally:
+        # Release the claim if the message wasn't saved so that it is retried by the next poll
+        ScheduledMessage.objects.filter(id=message_id, claimed_until=fire_claim).update(claimed_until=None)
+
 
-    messages = ScheduledMessage.objects.get_messages_to_fire()
-    for message in messages:
-        message.safe_trigger()
+def _is_rate_limited(key: str, limit: int) -> bool:
+    """Count a scheduled message against the limit for `key` in the current second. Returns True if the limit has
+    already been reached."""
+    window_key = f"scheduled_message_rate:{key}:{int(time.time())}"
+    try:
+        with _get_redis_connection().pipeline() as pipe:
+            pipe.incr(window_key)
+            pipe.expire(window_key, 10)
+            count, _ = pipe.execute()
+    except Exception:
+        logger.exception("Unable to check the scheduled message rate limit for %s", key)
+        return False
+    return count > limit
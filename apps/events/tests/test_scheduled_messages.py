@@ -3,12 +3,14 @@ from datetime import datetime
 from unittest.mock import patch
 
 import pytest
+from celery.exceptions import Retry
 from dateutil.relativedelta import relativedelta
+from django.test import override_settings
 from django.utils import timezone
 from freezegun import freeze_time
 
 from apps.events.models import EventActionType, ScheduledMessage, TimePeriod
-from apps.events.tasks import poll_scheduled_messages
+from apps.events.tasks import fire_scheduled_message, poll_scheduled_messages
 from apps.experiments.models import ExperimentRoute
 from apps.utils.factories.events import EventActionFactory, ScheduledMessageFactory
 from apps.utils.factories.experiment import ExperimentFactory, ExperimentSessionFactory
@@ -101,6 +103,7 @@ def test_get_messages_to_fire_cancelled():
 
 @pytest.mark.django_db()
 @pytest.mark.parametrize("period", ["minutes", "hours", "days", "weeks", "months"])
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
 @patch("apps.experiments.models.ExperimentSession.ad_hoc_bot_message")
 def test_poll_scheduled_messages(ad_hoc_bot_message, period):
     scheduled_message = None
@@ -183,6 +186,7 @@ def test_poll_scheduled_messages(ad_hoc_bot_message, period):
 
 
 @pytest.mark.django_db()
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
 @patch("apps.channels.forms.TelegramChannelForm._set_telegram_webhook")
 def test_error_when_sending_sending_message_to_a_user(_set_telegram_webhook, caplog):
     """This test makes sure that any error that happens when sending a message to a user does not affect other
@@ -214,6 +218,8 @@ def test_error_when_sending_sending_message_to_a_user(_set_telegram_webhook, cap
         assert caplog.records[0].msg == expected_msg
 
         assert sm.last_triggered_at is None
+        sm.refresh_from_db()
+        assert sm.claimed_until is None
 
 
 def _assert_next_trigger_date(message: ScheduledMessage, expected_date: datetime):
@@ -355,3 +361,89 @@ def test_schedule_trigger_for_versioned_routes():
     # Clear the `params` cached property on ScheduledMessage
     del sm.params
     assert sm._get_experiment_to_generate_response() == router.default_version
+
+
+def _due_scheduled_message():
+    session = ExperimentSessionFactory()
+    event_action, _ = _construct_event_action(time_period=TimePeriod.DAYS, experiment_id=session.experiment.id)
+    return ScheduledMessageFactory(
+        team=session.team,
+        participant=session.participant,
+        action=event_action,
+        experiment=session.experiment,
+        next_trigger_date=timezone.now() - relativedelta(minutes=1),
+    )
+
+
+@pytest.mark.django_db()
+def test_claimed_messages_are_not_claimed_again():
+    message = _due_scheduled_message()
+
+    claimed, claimed_until = ScheduledMessage.objects.claim_messages_to_fire(batch_size=10, claim_timeout=60)
+    assert claimed == [(message.id, message.team_id)]
+    message.refresh_from_db()
+    assert message.claimed_until == claimed_until
+
+    claimed, _ = ScheduledMessage.objects.claim_messages_to_fire(batch_size=10, claim_timeout=60)
+    assert claimed == []
+
+    # expired claims can be claimed again
+    ScheduledMessage.objects.filter(id=message.id).update(claimed_until=timezone.now() - relativedelta(seconds=1))
+    claimed, _ = ScheduledMessage.objects.claim_messages_to_fire(batch_size=10, claim_timeout=60)
+    assert claimed == [(message.id, message.team_id)]
+
+
+@pytest.mark.django_db()
+@patch("apps.events.tasks.fire_scheduled_message.si")
+@patch("apps.events.tasks.group")
+def test_poll_scheduled_messages_claims_in_batches(group, fire_task, settings):
+    settings.SCHEDULED_MESSAGE_BATCH_SIZE = 2
+    messages = [_due_scheduled_message() for _ in range(3)]
+
+    poll_scheduled_messages()
+
+    assert group.call_count == 2
+    assert sorted(call.args[0] for call in fire_task.call_args_list) == sorted(message.id for message in messages)
+
+
+@pytest.mark.django_db()
+@patch("apps.experiments.models.ExperimentSession.ad_hoc_bot_message")
+def test_fire_scheduled_message_only_fires_once(ad_hoc_bot_message):
+    message = _due_scheduled_message()
+    _, claimed_until = ScheduledMessage.objects.claim_messages_to_fire(batch_size=10, claim_timeout=60)
+
+    fire_scheduled_message(message.id, claimed_until.isoformat())
+    fire_scheduled_message(message.id, claimed_until.isoformat())
+
+    ad_hoc_bot_message.assert_called_once()
+    message.refresh_from_db()
+    assert message.total_triggers == 1
+    assert message.claimed_until is None
+
+
+@pytest.mark.django_db()
+@patch("apps.experiments.models.ExperimentSession.ad_hoc_bot_message")
+def test_fire_scheduled_message_with_stale_claim(ad_hoc_bot_message):
+    """A task queued by an earlier poll whose claim has since expired and been replaced does nothing"""
+    message = _due_scheduled_message()
+    _, stale_claim = ScheduledMessage.objects.claim_messages_to_fire(batch_size=10, claim_timeout=-1)
+    ScheduledMessage.objects.claim_messages_to_fire(batch_size=10, claim_timeout=60)
+
+    fire_scheduled_message(message.id, stale_claim.isoformat())
+    ad_hoc_bot_message.assert_not_called()
+
+
+@pytest.mark.django_db()
+@patch("apps.events.tasks._is_rate_limited", return_value=True)
+@patch("apps.experiments.models.ExperimentSession.ad_hoc_bot_message")
+def test_fire_scheduled_message_is_retried_when_rate_limited(ad_hoc_bot_message, _is_rate_limited):
+    message = _due_scheduled_message()
+    _, claimed_until = ScheduledMessage.objects.claim_messages_to_fire(batch_size=10, claim_timeout=60)
+
+    with patch.object(fire_scheduled_message, "retry", side_effect=Retry) as retry, pytest.raises(Retry):
+        fire_scheduled_message(message.id, claimed_until.isoformat())
+
+    retry.assert_called_once()
+    ad_hoc_bot_message.assert_not_called()
+    message.refresh_from_db()
+    assert message.claimed_until == claimed_until
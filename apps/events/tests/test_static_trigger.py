@@ -5,7 +5,7 @@ import pytest
 from django.test import override_settings
 from django.utils import timezone
 
-from apps.chat.models import Chat, ChatMessage, ChatMessageType
+from apps.chat.models import ChatMessage, ChatMessageType
 from apps.events.models import (
     EventAction,
     EventActionType,
@@ -13,6 +13,7 @@ from apps.events.models import (
     StaticTriggerType,
     TimeoutTrigger,
 )
+from apps.events.tasks import enqueue_static_trigger_event, process_static_trigger_events
 from apps.events.views import _delete_event_view
 from apps.utils.factories.experiment import (
     ExperimentFactory,
@@ -44,7 +45,7 @@ def test_end_conversation_fires_event(mock_fire_trigger, session):
 @pytest.mark.django_db()
 def test_last_timeout_can_end_conversation(session):
     fifteen_minutes_ago = timezone.now() - timedelta(minutes=15)
-    chat = Chat.objects.create(team=session.team)
+    chat = session.chat
     message = ChatMessage.objects.create(
         chat=chat,
         content="Hello",
@@ -52,8 +53,6 @@ def test_last_timeout_can_end_conversation(session):
     )
     message.created_at = fifteen_minutes_ago
     message.save()
-    session.chat = chat
-    session.save()
 
     timeout_trigger = TimeoutTrigger.objects.create(
         experiment=session.experiment,
@@ -97,3 +96,77 @@ def test_delete():
     )
     static_trigger.refresh_from_db()
     assert static_trigger.is_archived, "The static trigger should be archived"
+
+
+@pytest.mark.django_db()
+def test_trigger_types_cache_is_invalidated(session):
+    experiment = session.experiment
+    assert StaticTrigger.get_trigger_types(experiment.id) == set()
+
+    trigger = StaticTrigger.objects.create(
+        experiment=experiment,
+        action=EventAction.objects.create(action_type=EventActionType.LOG),
+        type=StaticTriggerType.NEW_HUMAN_MESSAGE,
+    )
+    assert StaticTrigger.get_trigger_types(experiment.id) == {StaticTriggerType.NEW_HUMAN_MESSAGE}
+
+    trigger.archive()
+    assert StaticTrigger.get_trigger_types(experiment.id) == set()
+
+
+@pytest.mark.django_db()
+@mock.patch("apps.events.tasks.process_static_trigger_events.apply_async")
+def test_event_not_queued_without_trigger(apply_async, session):
+    enqueue_static_trigger_event(session, StaticTriggerType.NEW_HUMAN_MESSAGE)
+    apply_async.assert_not_called()
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+@pytest.mark.django_db()
+@mock.patch("apps.events.tasks.fire_static_trigger.run")
+def test_events_are_batched(fire_static_trigger, session):
+    human_trigger = StaticTrigger.objects.create(
+        experiment=session.experiment,
+        action=EventAction.objects.create(action_type=EventActionType.LOG),
+        type=StaticTriggerType.NEW_HUMAN_MESSAGE,
+    )
+    bot_trigger = StaticTrigger.objects.create(
+        experiment=session.experiment,
+        action=EventAction.objects.create(action_type=EventActionType.LOG),
+        type=StaticTriggerType.NEW_BOT_MESSAGE,
+    )
+
+    with mock.patch("apps.events.tasks.process_static_trigger_events.apply_async") as apply_async:
+        enqueue_static_trigger_event(session, StaticTriggerType.NEW_HUMAN_MESSAGE)
+        enqueue_static_trigger_event(session, StaticTriggerType.NEW_BOT_MESSAGE)
+        enqueue_static_trigger_event(session, StaticTriggerType.CONVERSATION_END)
+
+    apply_async.assert_called_once()
+    process_static_trigger_events(session.id)
+    assert fire_static_trigger.call_args_list == [
+        mock.call(human_trigger.id, session.id),
+        mock.call(bot_trigger.id, session.id),
+    ]
+
+
+@pytest.mark.django_db()
+def test_events_are_rescheduled_when_task_is_not_queued(session):
+    StaticTrigger.objects.create(
+        experiment=session.experiment,
+        action=EventAction.objects.create(action_type=EventActionType.LOG),
+        type=StaticTriggerType.NEW_HUMAN_MESSAGE,
+    )
+
+    with mock.patch("apps.events.tasks.process_static_trigger_events.apply_async") as apply_async:
+        apply_async.side_effect = ConnectionError
+        with pytest.raises(ConnectionError):
+            enqueue_static_trigger_event(session, StaticTriggerType.NEW_HUMAN_MESSAGE)
+
+        apply_async.side_effect = None
+        enqueue_static_trigger_event(session, StaticTriggerType.NEW_HUMAN_MESSAGE)
+        assert apply_async.call_count == 2
+
+    # the events from both calls are still pending
+    with mock.patch("apps.events.tasks._fire_static_triggers") as fire_static_triggers:
+        process_static_trigger_events(session.id)
+    assert fire_static_triggers.call_args.args[1] == [StaticTriggerType.NEW_HUMAN_MESSAGE] * 2
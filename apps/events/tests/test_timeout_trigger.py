@@ -5,13 +5,14 @@ import pytest
 from django.test import override_settings
 from freezegun import freeze_time
 
-from apps.chat.models import Chat, ChatMessage, ChatMessageType
+from apps.chat.models import ChatMessage, ChatMessageType
 from apps.events.const import TOTAL_FAILURES
 from apps.events.models import (
     EventAction,
     EventActionType,
     EventLogStatusChoices,
     TimeoutTrigger,
+    TimeoutTriggerAttempts,
 )
 from apps.events.tasks import enqueue_timed_out_events
 from apps.events.views import _delete_event_view
@@ -49,15 +50,13 @@ def test_timed_out_sessions(session):
     )
 
     with freeze_time("2024-04-02") as frozen_time:
-        chat = Chat.objects.create(team=session.team)
+        chat = session.chat
         message = ChatMessage.objects.create(
             chat=chat,
             content="Hello",
             message_type=ChatMessageType.HUMAN,
         )
         message.save()
-        session.chat = chat
-        session.save()
 
         frozen_time.tick(delta=timedelta(minutes=15))
         timed_out_sessions = timeout_trigger.timed_out_sessions()
@@ -74,14 +73,12 @@ def test_non_timed_out_sessions(session):
         delay=10,  # 10 seconds
     )
     with freeze_time("2024-04-02") as frozen_time:
-        chat = Chat.objects.create(team=session.team)
+        chat = session.chat
         ChatMessage.objects.create(
             chat=chat,
             content="Hello",
             message_type=ChatMessageType.HUMAN,
         )
-        session.chat = chat
-        session.save()
 
         frozen_time.tick(delta=timedelta(seconds=5))
         timed_out_sessions = timeout_trigger.timed_out_sessions()
@@ -100,15 +97,13 @@ def test_timed_out_sessions_fired(mock_fire_trigger, session):
     )
 
     with freeze_time("2024-04-02") as frozen_time:
-        chat = Chat.objects.create(team=session.team)
+        chat = session.chat
         message = ChatMessage.objects.create(
             chat=chat,
             content="Hello",
             message_type=ChatMessageType.HUMAN,
         )
         message.save()
-        session.chat = chat
-        session.save()
 
         frozen_time.tick(delta=timedelta(minutes=15))
         timed_out_sessions = timeout_trigger.timed_out_sessions()
@@ -126,15 +121,13 @@ def test_trigger_count_reached(session):
         delay=10 * 60,  # 10 minutes
     )
     with freeze_time("2024-04-02") as frozen_time:
-        chat = Chat.objects.create(team=session.team)
+        chat = session.chat
         message = ChatMessage.objects.create(
             chat=chat,
             content="Hello",
             message_type=ChatMessageType.HUMAN,
         )
         message.save()
-        session.chat = chat
-        session.save()
         frozen_time.tick(delta=timedelta(minutes=11))
 
         timeout_trigger.event_logs.create(session=session, chat_message=message, status=EventLogStatusChoices.SUCCESS)
@@ -173,15 +166,13 @@ def test_failure_count_reached(session):
         delay=10 * 60,  # 10 minutes
     )
     with freeze_time("2024-04-02") as frozen_time:
-        chat = Chat.objects.create(team=session.team)
+        chat = session.chat
         message = ChatMessage.objects.create(
             chat=chat,
             content="Hello",
             message_type=ChatMessageType.HUMAN,
         )
         message.save()
-        session.chat = chat
-        session.save()
         frozen_time.tick(delta=timedelta(minutes=11))
         assert len(timeout_trigger.timed_out_sessions()) == 1
 
@@ -207,14 +198,12 @@ def test_failure_count_reached(session):
 
 @pytest.mark.django_db()
 def test_fire_trigger_increments_stats(session):
-    chat = Chat.objects.create(team=session.team)
+    chat = session.chat
     ChatMessage.objects.create(
         chat=chat,
         content="Hello",
         message_type=ChatMessageType.HUMAN,
     )
-    session.chat = chat
-    session.save()
     timeout_trigger = TimeoutTrigger.objects.create(
         experiment=session.experiment,
         action=EventAction.objects.create(action_type=EventActionType.LOG),
@@ -234,14 +223,12 @@ def test_fire_trigger_increments_stats(session):
 
 @pytest.mark.django_db()
 def test_new_human_message_resets_count(session):
-    chat = Chat.objects.create(team=session.team)
+    chat = session.chat
     first_message = ChatMessage.objects.create(
         chat=chat,
         content="Hello",
         message_type=ChatMessageType.HUMAN,
     )
-    session.chat = chat
-    session.save()
     timeout_trigger = TimeoutTrigger.objects.create(
         experiment=session.experiment,
         action=EventAction.objects.create(action_type=EventActionType.LOG),
@@ -294,15 +281,13 @@ def test_not_triggered_for_complete_chats(status, matches, session):
         delay=10 * 60,
     )
     with freeze_time("2024-04-02") as frozen_time:
-        chat = Chat.objects.create(team=session.team)
+        chat = session.chat
         message = ChatMessage.objects.create(
             chat=chat,
             content="Hello",
             message_type=ChatMessageType.HUMAN,
         )
         message.save()
-        session.chat = chat
-        session.save()
 
         frozen_time.tick(delta=timedelta(minutes=15))
         timed_out_sessions = timeout_trigger.timed_out_sessions()
@@ -321,15 +306,13 @@ def test_not_triggered_no_human_message(session):
         delay=10 * 60,
     )
     with freeze_time("2024-04-02") as frozen_time:
-        chat = Chat.objects.create(team=session.team)
+        chat = session.chat
         message = ChatMessage.objects.create(
             chat=chat,
             content="Hello",
             message_type=ChatMessageType.AI,
         )
         message.save()
-        session.chat = chat
-        session.save()
 
         frozen_time.tick(delta=timedelta(minutes=15))
         timed_out_sessions = timeout_trigger.timed_out_sessions()
@@ -354,3 +337,84 @@ def test_delete():
     )
     timeout_trigger.refresh_from_db()
     assert timeout_trigger.is_archived, "The timeout trigger should be archived"
+
+
+@pytest.mark.django_db()
+def test_session_last_human_message_is_maintained(session):
+    human_message = ChatMessage.objects.create(chat=session.chat, content="Hi", message_type=ChatMessageType.HUMAN)
+    ChatMessage.objects.create(chat=session.chat, content="Hello", message_type=ChatMessageType.AI)
+
+    session.refresh_from_db()
+    assert session.last_human_message_id == human_message.id
+    assert session.last_human_message_at == human_message.created_at
+
+    new_message = ChatMessage.objects.create(chat=session.chat, content="Hi", message_type=ChatMessageType.HUMAN)
+    session.refresh_from_db()
+    assert session.last_human_message_id == new_message.id
+
+
+@pytest.mark.django_db()
+def test_saving_session_keeps_last_human_message(session):
+    """Saving a session instance that was loaded before the last human message was added doesn't overwrite the
+    last human message fields"""
+    human_message = ChatMessage.objects.create(chat=session.chat, content="Hi", message_type=ChatMessageType.HUMAN)
+    assert session.last_human_message_id is None
+
+    session.update_status(SessionStatus.ACTIVE)
+    session.end()
+
+    session.refresh_from_db()
+    assert session.status == SessionStatus.PENDING_REVIEW
+    assert session.last_human_message_id == human_message.id
+    assert session.last_human_message_at == human_message.created_at
+
+
+@pytest.mark.django_db()
+def test_timed_out_sessions_across_triggers(experiment, channel):
+    sessions = ExperimentSessionFactory.create_batch(2, experiment=experiment, experiment_channel=channel)
+    short_trigger = TimeoutTrigger.objects.create(
+        experiment=experiment,
+        action=EventAction.objects.create(action_type=EventActionType.LOG),
+        delay=5 * 60,
+    )
+    long_trigger = TimeoutTrigger.objects.create(
+        experiment=experiment,
+        action=EventAction.objects.create(action_type=EventActionType.LOG),
+        delay=20 * 60,
+    )
+    with freeze_time("2024-04-02") as frozen_time:
+        for session in sessions:
+            ChatMessage.objects.create(chat=session.chat, content="Hello", message_type=ChatMessageType.HUMAN)
+        frozen_time.tick(delta=timedelta(minutes=10))
+        assert set(TimeoutTrigger.objects.timed_out_sessions()) == {
+            (short_trigger.id, sessions[0].id),
+            (short_trigger.id, sessions[1].id),
+        }
+
+        frozen_time.tick(delta=timedelta(minutes=15))
+        assert len(TimeoutTrigger.objects.timed_out_sessions()) == 4
+        assert set(long_trigger.timed_out_sessions()) == set(sessions)
+
+
+@pytest.mark.django_db()
+def test_record_attempt(session):
+    trigger = TimeoutTrigger.objects.create(
+        experiment=session.experiment,
+        action=EventAction.objects.create(action_type=EventActionType.LOG),
+        delay=10 * 60,
+    )
+    first, second = (
+        ChatMessage.objects.create(chat=session.chat, content=content, message_type=ChatMessageType.HUMAN)
+        for content in ["Hi", "Hello"]
+    )
+
+    TimeoutTriggerAttempts.record_attempt(trigger.id, session.id, first.id, succeeded=False)
+    TimeoutTriggerAttempts.record_attempt(trigger.id, session.id, first.id, succeeded=False)
+    TimeoutTriggerAttempts.record_attempt(trigger.id, session.id, first.id, succeeded=True)
+    attempts = TimeoutTriggerAttempts.objects.get(trigger=trigger, session=session)
+    assert (attempts.chat_message_id, attempts.success_count, attempts.failure_count) == (first.id, 1, 2)
+
+    # the counts are reset for a new message
+    TimeoutTriggerAttempts.record_attempt(trigger.id, session.id, second.id, succeeded=False)
+    attempts.refresh_from_db()
+    assert (attempts.chat_message_id, attempts.success_count, attempts.failure_count) == (second.id, 0, 1)
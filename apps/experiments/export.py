@@ -34,62 +34,100 @@ def get_filtered_sessions(request, experiment, query_params, include_api=False):
     return sessions_queryset
 
 
+EXPORT_HEADER = [
+    "Message ID",
+    "Message Date",
+    "Message Type",
+    "Message Content",
+    "Platform",
+    "Chat Tags",
+    "Chat Comments",
+    "Session ID",
+    "Session LLM",
+    "Experiment ID",
+    "Experiment Name",
+    "Participant Name",
+    "Participant Identifier",
+    "Participant Public ID",
+    "Message Tags",
+    "Message Comments",
+    "Trace ID",
+]
+
+# Number of sessions to load per query. Each chunk is loaded with all its messages so this bounds the memory used
+# by the export.
+EXPORT_CHUNK_SIZE = 100
+
+
 def filtered_export_to_csv(experiment, sessions_queryset):
     csv_in_memory = io.StringIO()
-    writer = csv.writer(csv_in_memory, delimiter=",", quotechar='"', quoting=csv.QUOTE_MINIMAL)
-
-    queryset = sessions_queryset.prefetch_related(
-        "chat",
-        "chat__messages",
-        "participant",
-        "experiment_channel",
-        "chat__tags",
-        "chat__messages__tags",
-        "chat__messages__comments",
-        "chat__messages__comments__user",
-    )
-    header = [
-        "Message ID",
-        "Message Date",
-        "Message Type",
-        "Message Content",
-        "Platform",
-        "Chat Tags",
-        "Chat Comments",
-        "Session ID",
-        "Session LLM",
-        "Experiment ID",
-        "Experiment Name",
-        "Participant Name",
-        "Participant Identifier",
-        "Participant Public ID",
-        "Message Tags",
-        "Message Comments",
-        "Trace ID",
-    ]
-    writer.writerow(header)
-
-    for session in queryset:
-        for message in session.chat.messages.all():
-            trace_id = message.trace_info.get("trace_id", "") if message.trace_info else ""
-            row = [
-                message.id,
-                message.created_at,
-                message.message_type,
-                message.content,
-                session.get_platform_name(),
-                _format_tags(message.chat.tags.all()),
-                _format_comments(message.chat.comments.all()),
-                session.external_id,
-                experiment.get_llm_provider_model_name(raises=False),
-                experiment.public_id,
-                experiment.name,
-                session.participant.name,
-                session.participant.identifier,
-                session.participant.public_id,
-                _format_tags(message.tags.all()),
-                _format_comments(message.comments.all()),
-                trace_id,
-            ]
-            writer.writerow(row)
+    write_export_csv(experiment, sessions_queryset, csv_in_memory)
     return csv_in_memory
+
+
+def write_export_csv(experiment, sessions_queryset, output, chunk_size=EXPORT_CHUNK_SIZE, progress_callback=None):
+    """Write the export for `sessions_queryset` to the `output` text stream one session at a time.
+
+    `progress_callback` is called with the number of sessions exported so far after each chunk of sessions.
+    """
+    writer = csv.writer(output, delimiter=",", quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    writer.writerow(EXPORT_HEADER)
+    llm_model_name = experiment.get_llm_provider_model_name(raises=False)
+    exported = 0
+    for sessions in _iter_session_chunks(sessions_queryset, chunk_size):
+        for session in sessions:
+            writer.writerows(_get_session_rows(experiment, session, llm_model_name))
+        exported += len(sessions)
+        if progress_callback:
+            progress_callback(exported)
+
+
+def _iter_session_chunks(sessions_queryset, chunk_size):
+    """Yield lists of sessions using keyset pagination on the session ID so that the cost of each query
+    stays the same regardless of how far through the export we are."""
+    queryset = (
+        sessions_queryset.order_by("id")
+        .select_related("chat", "participant", "experiment_channel")
+        .prefetch_related(
+            "chat__messages",
+            "chat__tags",
+            "chat__comments__user",
+            "chat__messages__tags",
+            "chat__messages__comments__user",
+        )
+    )
+    last_id = 0
+    while True:
+        sessions = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not sessions:
+            return
+        yield sessions
+        last_id = sessions[-1].id
+
+
+def _get_session_rows(experiment, session, llm_model_name):
+    # chat level columns are the same for each message
+    platform = session.get_platform_name()
+    chat_tags = _format_tags(session.chat.tags.all())
+    chat_comments = _format_comments(session.chat.comments.all())
+    for message in session.chat.messages.all():
+        trace_id = message.trace_info.get("trace_id", "") if message.trace_info else ""
+        yield [
+            message.id,
+            message.created_at,
+            message.message_type,
+            message.content,
+            platform,
+            chat_tags,
+            chat_comments,
+            session.external_id,
+            llm_model_name,
+            experiment.public_id,
+            experiment.name,
+            session.participant.name,
+            session.participant.identifier,
+            session.participant.public_id,
+            _format_tags(message.tags.all()),
+            _format_comments(message.comments.all()),
+            trace_id,
+        ]
@@ -13,6 +13,7 @@ from apps.experiments.models import (
     Experiment,
     ExperimentRoute,
     ExperimentRouteType,
+    SafetyLayerModes,
     Survey,
     SyntheticVoice,
 )
@@ -135,6 +136,7 @@ class ExperimentForm(forms.ModelForm):
             "prompt_text",
             "input_formatter",
             "safety_layers",
+            "safety_layer_mode",
             "conversational_consent_enabled",
             "source_material",
             "seed_message",
@@ -149,6 +151,7 @@ class ExperimentForm(forms.ModelForm):
             "echo_transcript",
             "use_processor_bot_voice",
             "trace_provider",
+            "trace_sample_rate",
             "participant_allowlist",
             "debug_mode_enabled",
             "citations_enabled",
@@ -196,6 +199,7 @@ class ExperimentForm(forms.ModelForm):
         self.fields["consent_form"].queryset = team.consentform_set.exclude(is_version=True)
         self.fields["synthetic_voice"].queryset = SyntheticVoice.get_for_team(team, exclude_services)
         self.fields["trace_provider"].queryset = team.traceprovider_set
+        self.fields["safety_layer_mode"].required = False
         initialize_form_for_custom_actions(team, self)
 
         # Alpine.js bindings
@@ -221,6 +225,9 @@ class ExperimentForm(forms.ModelForm):
     def clean_custom_action_operations(self):
         return clean_custom_action_operations(self)
 
+    def clean_safety_layer_mode(self):
+        return self.cleaned_data["safety_layer_mode"] or SafetyLayerModes.STRICT
+
     def clean(self):
         cleaned_data = super().clean()
 
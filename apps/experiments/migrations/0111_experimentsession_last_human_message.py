@@ -0,0 +1,43 @@
+# Generated by Django 5.1.2 on 2025-04-01 09:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def _populate_last_human_message(apps, schema_editor):
+    ExperimentSession = apps.get_model('experiments', 'ExperimentSession')
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    last_human_message = ChatMessage.objects.filter(
+        chat_id=models.OuterRef("chat_id"), message_type="human"
+    ).order_by("-created_at")
+    ExperimentSession.objects.filter(ended_at__isnull=True).update(
+        last_human_message_id=models.Subquery(last_human_message.values("id")[:1]),
+        last_human_message_at=models.Subquery(last_human_message.values("created_at")[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0018_chatmessage_token_counts'),
+        ('experiments', '0110_alter_participantdata_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experimentsession',
+            name='last_human_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='experimentsession',
+            name='last_human_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.chatmessage'),
+        ),
+        # Only active sessions are considered for timeouts so we don't need to populate ended sessions
+        migrations.RunPython(_populate_last_human_message, migrations.RunPython.noop, elidable=True),
+        migrations.AddIndex(
+            model_name='experimentsession',
+            index=models.Index(condition=models.Q(('ended_at__isnull', True)), fields=['experiment', 'last_human_message_at'], name='session_last_human_message_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2025-04-03 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('experiments', '0111_experimentsession_last_human_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experiment',
+            name='safety_layer_mode',
+            field=models.CharField(choices=[('strict', 'Strict'), ('speculative', 'Speculative')], default='strict', help_text="Strict: Safety layers check the user's message one after the other before the bot responds. Speculative: Safety layers run at the same time as each other and as the bot's response. The response is discarded if the user's message fails a safety layer.", max_length=32),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2025-04-07 09:41
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('experiments', '0112_experiment_safety_layer_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experiment',
+            name='trace_sample_rate',
+            field=models.FloatField(default=1.0, help_text='The fraction of sessions to trace, e.g. 0.05 traces 5% of sessions. Failed runs are always traced.', validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)]),
+        ),
+    ]
@@ -17,6 +17,7 @@ EXPERIMENT_FIELDS = [
     "conversational_consent_enabled",
     "team",
     "voice_response_behaviour",
+    "safety_layer_mode",
 ]
 
 SOURCE_MATERIAL_FIELDS = ["owner", "topic", "description", "material", "team"]
@@ -638,6 +638,11 @@ class VoiceResponseBehaviours(models.TextChoices):
     NEVER = "never", gettext("Never")
 
 
+class SafetyLayerModes(models.TextChoices):
+    STRICT = "strict", gettext("Strict")
+    SPECULATIVE = "speculative", gettext("Speculative")
+
+
 class AgentTools(models.TextChoices):
     RECURRING_REMINDER = "recurring-reminder", gettext("Recurring Reminder")
     ONE_OFF_REMINDER = "one-off-reminder", gettext("One-off Reminder")
@@ -704,6 +709,16 @@ class Experiment(BaseTeamModel, VersionsMixin, CustomActionOperationMixin):
         "E.g. 'Safe or unsafe? {input}'",
     )
     safety_layers = models.ManyToManyField(SafetyLayer, related_name="experiments", blank=True)
+    safety_layer_mode = models.CharField(
+        max_length=32,
+        choices=SafetyLayerModes.choices,
+        default=SafetyLayerModes.STRICT,
+        help_text=(
+            "Strict: Safety layers check the user's message one after the other before the bot responds. "
+            "Speculative: Safety layers run at the same time as each other and as the bot's response. The response is "
+            "discarded if the user's message fails a safety layer."
+        ),
+    )
 
     source_material = models.ForeignKey(
         SourceMaterial,
@@ -776,6 +791,11 @@ class Experiment(BaseTeamModel, VersionsMixin, CustomActionOperationMixin):
     trace_provider = models.ForeignKey(
         "service_providers.TraceProvider", on_delete=models.SET_NULL, null=True, blank=True
     )
+    trace_sample_rate = models.FloatField(
+        default=1.0,
+        validators=[MinValueValidator(0), MaxValueValidator(1)],
+        help_text="The fraction of sessions to trace, e.g. 0.05 traces 5% of sessions. Failed runs are always traced.",
+    )
     use_processor_bot_voice = models.BooleanField(default=False)
     participant_allowlist = ArrayField(models.CharField(max_length=128), default=list, blank=True)
 
@@ -903,7 +923,7 @@ class Experiment(BaseTeamModel, VersionsMixin, CustomActionOperationMixin):
     @property
     def trace_service(self):
         if self.trace_provider:
-            return self.trace_provider.get_service()
+            return self.trace_provider.get_service(sample_rate=self.trace_sample_rate)
 
     def get_api_url(self):
         if self.is_working_version:
@@ -978,8 +998,11 @@ class Experiment(BaseTeamModel, VersionsMixin, CustomActionOperationMixin):
         Archive the experiment and all versions in the case where this is the working version. The linked assistant and
         pipeline for the working version should not be archived.
         """
+        from apps.events.models import StaticTrigger
+
         super().archive()
         self.static_triggers.update(is_archived=True)
+        StaticTrigger.invalidate_trigger_types_cache(self.id)
 
         if self.is_working_version:
             self.delete_experiment_channels()
@@ -1090,6 +1113,11 @@ class Experiment(BaseTeamModel, VersionsMixin, CustomActionOperationMixin):
                     name="safety_layers",
                     queryset=self.safety_layers,
                 ),
+                VersionField(
+                    group_name="Safety",
+                    name="safety_layer_mode",
+                    raw_value=SafetyLayerModes(self.safety_layer_mode).label,
+                ),
                 VersionField(
                     group_name="Safety",
                     name="safety_violation_emails",
@@ -1163,6 +1191,7 @@ class Experiment(BaseTeamModel, VersionsMixin, CustomActionOperationMixin):
                     to_display=VersionFieldDisplayFormatters.format_pipeline,
                 ),
                 VersionField(group_name="Tracing", name="tracing_provider", raw_value=self.trace_provider),
+                VersionField(group_name="Tracing", name="trace_sample_rate", raw_value=self.trace_sample_rate),
                 # Triggers
                 VersionField(
                     group_name="Triggers",
@@ -1504,7 +1533,10 @@ class Participant(BaseTeamModel):
             for record in participant_data:
                 experiments.add(record.experiment_id)
                 record.data = record.data | data
-            ParticipantData.objects.bulk_update(participant_data, fields=["data"])
+                # `bulk_update` doesn't set `auto_now` fields. `ParticipantDataProxy` relies on `updated_at` to
+                # detect concurrent changes.
+                record.updated_at = timezone.now()
+            ParticipantData.objects.bulk_update(participant_data, fields=["data", "updated_at"])
 
         if experiment.id not in experiments:
             ParticipantData.objects.create(team=self.team, experiment=experiment, data=data, participant=self)
@@ -1611,9 +1643,26 @@ class ExperimentSession(BaseTeamModel):
         blank=True,
     )
     state = models.JSONField(default=dict)
+    # Denormalized from the chat messages to make finding timed out sessions cheap. This is maintained by
+    # `ChatMessage.save` so it isn't written when saving the session.
+    last_human_message_at = models.DateTimeField(null=True, blank=True)
+    last_human_message = models.ForeignKey(
+        ChatMessage, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+
+    # These are kept up to date with queryset updates when human messages are saved (see `ChatMessage.save`) so the
+    # values on an instance are likely to be stale
+    DENORMALIZED_FIELDS = ("last_human_message_at", "last_human_message")
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(
+                fields=["experiment", "last_human_message_at"],
+                name="session_last_human_message_idx",
+                condition=Q(ended_at__isnull=True),
+            ),
+        ]
 
     def __str__(self):
         return f"ExperimentSession(id={self.external_id})"
@@ -1624,8 +1673,26 @@ class ExperimentSession(BaseTeamModel):
         if not self.external_id:
             self.external_id = str(uuid.uuid4())
 
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            # don't overwrite the denormalized fields with stale values
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DENORMALIZED_FIELDS
+            ]
         super().save(*args, **kwargs)
 
+    def update_last_human_message(self):
+        """Recompute the denormalized last human message fields from the chat"""
+        last_human_message = (
+            self.chat.messages.filter(message_type=ChatMessageType.HUMAN).order_by("-created_at").first()
+        )
+        self.last_human_message = last_human_message
+        self.last_human_message_at = last_human_message.created_at if last_human_message else None
+        ExperimentSession.objects.filter(id=self.id).update(
+            last_human_message=last_human_message, last_human_message_at=self.last_human_message_at
+        )
+
     def has_display_messages(self) -> bool:
         return bool(self.get_messages_for_display())
 
@@ -1710,9 +1777,9 @@ class ExperimentSession(BaseTeamModel):
             self.save()
         if commit and propagate:
             from apps.events.models import StaticTriggerType
-            from apps.events.tasks import enqueue_static_triggers
+            from apps.events.tasks import enqueue_static_trigger_event
 
-            enqueue_static_triggers.delay(self.id, StaticTriggerType.CONVERSATION_END)
+            enqueue_static_trigger_event(self, StaticTriggerType.CONVERSATION_END)
 
     def ad_hoc_bot_message(self, instruction_prompt: str, fail_silently=True, use_experiment: Experiment | None = None):
         """Sends a bot message to this session. The bot message will be crafted using `instruction_prompt` and
@@ -1,8 +1,11 @@
+import gzip
+import io
 import logging
+import tempfile
 import time
 
 from celery.app import shared_task
-from django.core.files.base import ContentFile
+from django.core.files import File as DjangoFile
 from django.utils import timezone
 from field_audit.models import AuditAction
 from langchain_core.messages import AIMessage, HumanMessage
@@ -11,7 +14,8 @@ from taskbadger.celery import Task as TaskbadgerTask
 from apps.channels.datamodels import Attachment, BaseMessage
 from apps.chat.bots import create_conversation
 from apps.chat.channels import WebChannel
-from apps.experiments.export import filtered_export_to_csv, get_filtered_sessions
+from apps.chat.streaming import SessionEvent, publish_session_event
+from apps.experiments.export import get_filtered_sessions, write_export_csv
 from apps.experiments.models import Experiment, ExperimentSession, PromptBuilderHistory, SourceMaterial
 from apps.files.models import File
 from apps.service_providers.models import LlmProvider, LlmProviderModel
@@ -23,17 +27,40 @@ logger = logging.getLogger("ocs.experiments")
 
 
 @shared_task(bind=True, base=TaskbadgerTask)
-def async_export_chat(self, experiment_id: int, query_params: dict, include_api: bool) -> dict:
+def async_export_chat(self, experiment_id: int, query_params: dict, include_api: bool, compress: bool = False) -> dict:
     experiment = Experiment.objects.get(id=experiment_id)
     filtered_sessions = get_filtered_sessions(self.request, experiment, query_params, include_api)
-    csv_in_memory = filtered_export_to_csv(experiment, filtered_sessions)
+    total_sessions = filtered_sessions.count()
+
+    def _update_progress(exported_sessions):
+        if tb_task := self.taskbadger_task:
+            tb_task.safe_update(value=exported_sessions, value_max=total_sessions)
+
     filename = f"{experiment.name} Chat Export {timezone.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv"
-    file_obj = File.objects.create(
-        name=filename,
-        team=experiment.team,
-        content_type="text/csv",
-        file=ContentFile(csv_in_memory.getvalue().encode("utf-8"), name=filename),
-    )
+    content_type = "text/csv"
+    # Write the export to a temporary file on disk rather than holding it in memory
+    with tempfile.TemporaryFile() as export_file:
+        output = export_file
+        if compress:
+            filename = f"{filename}.gz"
+            content_type = "application/gzip"
+            output = gzip.GzipFile(filename="", mode="wb", fileobj=export_file)
+
+        text_output = io.TextIOWrapper(output, encoding="utf-8", newline="")
+        write_export_csv(experiment, filtered_sessions, text_output, progress_callback=_update_progress)
+        # flush the text buffer without closing the underlying file
+        text_output.detach()
+        if compress:
+            # writes the gzip trailer, `export_file` is left open
+            output.close()
+
+        export_file.seek(0)
+        file_obj = File.objects.create(
+            name=filename,
+            team=experiment.team,
+            content_type=content_type,
+            file=DjangoFile(export_file, name=filename),
+        )
     return {"file_id": file_obj.id}
 
 
@@ -81,6 +108,7 @@ def get_response_for_webchat_task(
         logger.exception(e)
         response["error"] = str(e)
 
+    publish_session_event(experiment_session_id, SessionEvent.RESPONSE, {"task_id": self.request.id, **response})
     return response
 
 
@@ -5,7 +5,7 @@ from unittest.mock import Mock, patch
 import pytest
 
 from apps.chat.models import ChatMessage, ChatMessageType
-from apps.experiments.export import filtered_export_to_csv
+from apps.experiments.export import filtered_export_to_csv, write_export_csv
 from apps.utils.factories.channels import ExperimentChannelFactory
 from apps.utils.factories.experiment import ExperimentFactory, ExperimentSessionFactory
 
@@ -116,15 +116,27 @@ def test_trace_id_export():
         ),
     ]
 
-    rows = list(
-        csv.reader(
-            io.StringIO(
-                filtered_export_to_csv(experiment, Mock(prefetch_related=Mock(return_value=[session]))).getvalue()
-            ),
-            delimiter=",",
-        )
-    )
+    with patch("apps.experiments.export._iter_session_chunks", return_value=[[session]]):
+        csv_in_memory = filtered_export_to_csv(experiment, Mock())
+    rows = list(csv.reader(io.StringIO(csv_in_memory.getvalue()), delimiter=","))
 
     assert "Trace ID" in rows[0], "Trace ID not in header"
     assert rows[1][-1] == "trace123", "Trace ID not exported correctly"
     assert rows[2][-1] == "", "Empty trace ID not handled correctly"
+
+
+@pytest.mark.django_db()
+def test_write_export_csv_in_chunks():
+    experiment = ExperimentFactory()
+    sessions = ExperimentSessionFactory.create_batch(3, experiment=experiment, team=experiment.team)
+    for session in sessions:
+        ChatMessage.objects.create(chat=session.chat, content="hi", message_type=ChatMessageType.HUMAN)
+
+    output = io.StringIO()
+    progress = []
+    write_export_csv(experiment, experiment.sessions.all(), output, chunk_size=2, progress_callback=progress.append)
+
+    rows = list(csv.reader(io.StringIO(output.getvalue())))
+    assert len(rows) == 4
+    assert [row[7] for row in rows[1:]] == [str(session.external_id) for session in sessions]
+    assert progress == [2, 3]
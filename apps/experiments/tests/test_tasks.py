@@ -1,3 +1,4 @@
+import gzip
 from unittest.mock import patch
 
 import pytest
@@ -36,3 +37,16 @@ def test_async_create_experiment_version_fails(create_new_version):
     assert experiment.versions.count() == 0
     experiment.refresh_from_db()
     assert experiment.create_version_task_id == ""
+
+
+@pytest.mark.django_db()
+def test_async_export_chat_compressed():
+    session = ExperimentSessionFactory()
+    session.chat.messages.create(message_type="human", content="Hello")
+    result = async_export_chat(session.experiment_id, {}, False, compress=True)
+    file = File.objects.get(id=result["file_id"])
+    assert file.name.endswith(".csv.gz")
+    with file.file.open("rb") as export_file:
+        rows = gzip.decompress(export_file.read()).decode("utf-8").splitlines()
+    assert len(rows) == 2
+    assert "Hello" in rows[1]
@@ -207,7 +207,7 @@ def test_form_fields():
 
 @pytest.mark.django_db()
 @pytest.mark.parametrize("is_user", [False, True])
-@mock.patch("apps.chat.channels.enqueue_static_triggers")
+@mock.patch("apps.chat.channels.enqueue_static_trigger_event")
 def test_new_participant_created_on_session_start(_trigger_mock, is_user):
     """For each new experiment session, a participant should be created and linked to the session"""
     identifier = "someone@example.com"
@@ -230,7 +230,7 @@ def test_new_participant_created_on_session_start(_trigger_mock, is_user):
 
 @pytest.mark.django_db()
 @pytest.mark.parametrize("is_user", [False, True])
-@mock.patch("apps.chat.channels.enqueue_static_triggers")
+@mock.patch("apps.chat.channels.enqueue_static_trigger_event")
 def test_participant_reused_within_team(_trigger_mock, is_user):
     """Within a team, the same external chat id (or participant identifier) should result in the participant being
     reused, and not result in a new participant being created
@@ -269,7 +269,7 @@ def test_participant_reused_within_team(_trigger_mock, is_user):
 
 @pytest.mark.django_db()
 @pytest.mark.parametrize("is_user", [False, True])
-@mock.patch("apps.chat.channels.enqueue_static_triggers")
+@mock.patch("apps.chat.channels.enqueue_static_trigger_event")
 def test_new_participant_created_for_different_teams(_trigger_mock, is_user):
     """A new participant should be created for each team when a user uses the same identifier"""
     experiment1 = ExperimentFactory(team=TeamWithUsersFactory())
@@ -313,7 +313,7 @@ def test_new_participant_created_for_different_teams(_trigger_mock, is_user):
 
 
 @pytest.mark.django_db()
-@mock.patch("apps.chat.channels.enqueue_static_triggers")
+@mock.patch("apps.chat.channels.enqueue_static_trigger_event")
 def test_participant_gets_user_when_they_signed_up(_trigger_mock, client):
     """When a non platform user starts a session, a participant without a user is created. When they then sign up
     and start another session, their participant user should be populated
@@ -349,7 +349,7 @@ def test_participant_gets_user_when_they_signed_up(_trigger_mock, client):
 
 
 @pytest.mark.django_db()
-@mock.patch("apps.chat.channels.enqueue_static_triggers")
+@mock.patch("apps.chat.channels.enqueue_static_trigger_event")
 def test_user_email_used_for_participant_identifier(_trigger_mock, client):
     """With the `capture_identifier` field enabled on the consent record, logged in users' consent form will
     not contain the `identifier` field, so we pass it as initial data to the form. This test simulates a logged
@@ -372,7 +372,7 @@ def test_user_email_used_for_participant_identifier(_trigger_mock, client):
 
 
 @pytest.mark.django_db()
-@mock.patch("apps.chat.channels.enqueue_static_triggers")
+@mock.patch("apps.chat.channels.enqueue_static_trigger_event")
 def test_timezone_saved_in_participant_data(_trigger_mock):
     """A participant's timezone data should be saved in all ParticipantData records"""
     experiment = ExperimentFactory(team=TeamWithUsersFactory())
@@ -397,7 +397,7 @@ def test_timezone_saved_in_participant_data(_trigger_mock):
 
 @pytest.mark.django_db()
 @pytest.mark.parametrize("version", [Experiment.DEFAULT_VERSION_NUMBER, 1])
-@mock.patch("apps.chat.channels.enqueue_static_triggers", mock.Mock())
+@mock.patch("apps.chat.channels.enqueue_static_trigger_event", mock.Mock())
 @mock.patch("apps.experiments.views.experiment.get_response_for_webchat_task.delay")
 def test_experiment_session_message_view_creates_files(delay_mock, version, experiment, client):
     task = mock.Mock()
@@ -471,7 +471,7 @@ def test_start_authed_web_session_with_version(version_number, client):
 @pytest.mark.django_db()
 class TestPublicSessions:
     @pytest.mark.parametrize("is_user", [False, True])
-    @mock.patch("apps.chat.channels.enqueue_static_triggers")
+    @mock.patch("apps.chat.channels.enqueue_static_trigger_event")
     def test_start_session_public_with_emtpy_identifier(self, _trigger_mock, is_user, client):
         """Identifiers can be empty if we choose not to capture it. In this case, use the logged in user's email or in
         the case where it's an external user, use a UUID as the identifier"""
@@ -97,6 +97,11 @@ urlpatterns = [
         views.get_message_response,
         name="get_message_response",
     ),
+    path(
+        "e/<uuid:experiment_id>/session/<str:session_id>/events/",
+        views.session_events,
+        name="session_events",
+    ),
     path(
         "e/<int:experiment_id>/session/<int:session_id>/poll_messages/",
         views.poll_messages,
@@ -42,6 +42,7 @@ from .experiment import (  # noqa: F401
     get_release_status_badge,
     poll_messages,
     send_invitation,
+    session_events,
     set_default_experiment,
     single_experiment_home,
     start_authed_web_session,
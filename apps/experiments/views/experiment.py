@@ -15,8 +15,16 @@ from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.core.exceptions import PermissionDenied, ValidationError
 from django.db import transaction
 from django.db.models import Case, Count, IntegerField, When
-from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, HttpResponseRedirect
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseForbidden,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, redirect, render
+from django.template.loader import render_to_string
 from django.template.response import TemplateResponse
 from django.urls import reverse
 from django.utils import timezone
@@ -39,6 +47,7 @@ from apps.channels.forms import ChannelForm
 from apps.channels.models import ChannelPlatform, ExperimentChannel
 from apps.chat.channels import WebChannel
 from apps.chat.models import ChatAttachment, ChatMessage, ChatMessageType
+from apps.chat.streaming import SessionEvent, format_sse, iter_session_events
 from apps.events.models import (
     EventLogStatusChoices,
     StaticTrigger,
@@ -767,10 +776,16 @@ def _experiment_session_message(request, version_number: int, embedded=False):
 
 @experiment_session_view()
 def get_message_response(request, team_slug: str, experiment_id: uuid.UUID, session_id: str, task_id: str):
-    experiment = request.experiment
-    session = request.experiment_session
-    last_message = ChatMessage.objects.filter(chat=session.chat).order_by("-created_at").first()
     progress = Progress(AsyncResult(task_id)).get_info()
+    return TemplateResponse(
+        request,
+        "experiments/chat/chat_message_response.html",
+        _get_message_response_context(request.experiment, request.experiment_session, task_id, progress),
+    )
+
+
+def _get_message_response_context(experiment, session, task_id: str, progress: dict) -> dict:
+    last_message = ChatMessage.objects.filter(chat=session.chat).order_by("-created_at").first()
     # don't render empty messages
     skip_render = progress["complete"] and progress["success"] and not progress["result"]
 
@@ -791,19 +806,56 @@ def get_message_response(request, team_slug: str, experiment_id: uuid.UUID, sess
     if isinstance(message, ChatMessage):
         attached_files = message.get_attached_files()
 
-    return TemplateResponse(
-        request,
-        "experiments/chat/chat_message_response.html",
-        {
-            "experiment": experiment,
-            "session": session,
-            "task_id": task_id,
-            "message_details": message_details,
-            "skip_render": skip_render,
-            "last_message_datetime": last_message and quote(last_message.created_at.isoformat()),
-            "attachments": attached_files,
-        },
-    )
+    return {
+        "experiment": experiment,
+        "session": session,
+        "task_id": task_id,
+        "message_details": message_details,
+        "skip_render": skip_render,
+        "last_message_datetime": last_message and quote(last_message.created_at.isoformat()),
+        "attachments": attached_files,
+    }
+
+
+@experiment_session_view()
+def session_events(request, team_slug: str, experiment_id: uuid.UUID, session_id: str):
+    """Stream bot responses and out-of-band messages for the session to the browser as server-sent events."""
+    if not settings.CHAT_EVENT_STREAM_ENABLED:
+        raise Http404()
+
+    experiment = request.experiment
+    session = request.experiment_session
+
+    def event_stream():
+        # reconnect quickly when the stream is closed by the server
+        yield "retry: 1000\n\n"
+        for event in iter_session_events(session.id):
+            if event is None:
+                yield ": heartbeat\n\n"
+                continue
+
+            event_type, data = event
+            if event_type == SessionEvent.TOKEN:
+                yield format_sse(event_type, json.dumps(data))
+            elif event_type == SessionEvent.RESPONSE:
+                progress = {"complete": True, "success": True, "result": data}
+                context = _get_message_response_context(experiment, session, data["task_id"], progress)
+                html = render_to_string("experiments/chat/chat_message_response.html", context, request=request)
+                yield format_sse(event_type, json.dumps({"task_id": data["task_id"], "html": html}))
+            elif event_type == SessionEvent.MESSAGE:
+                last_message = ChatMessage.objects.filter(chat=session.chat).order_by("-created_at").first()
+                context = {
+                    "messages": [data["content"]],
+                    "last_message_datetime": last_message and quote(last_message.created_at.isoformat()),
+                }
+                html = render_to_string("experiments/chat/system_message.html", context, request=request)
+                yield format_sse(event_type, json.dumps({"html": html}))
+
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # disable response buffering in nginx
+    response["X-Accel-Buffering"] = "no"
+    return response
 
 
 @team_required
@@ -1041,7 +1093,8 @@ def generate_chat_export(request, team_slug: str, experiment_id: str):
     parsed_url = urlparse(request.headers.get("HX-Current-URL"))
     query_params = parse_qs(parsed_url.query)
     include_api = request.POST.get("show-all") == "on"
-    task_id = async_export_chat.delay(experiment_id, query_params, include_api)
+    compress = request.POST.get("compress-export") == "on"
+    task_id = async_export_chat.delay(experiment_id, query_params, include_api, compress)
     return TemplateResponse(
         request, "experiments/components/exports.html", {"experiment": experiment, "task_id": task_id}
     )
@@ -1,8 +1,14 @@
-from collections import Counter, defaultdict
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
 from functools import cached_property, partial
 from typing import Self
 
 import pydantic
+from django.conf import settings
+from django.core.cache import cache
 from langgraph.graph import StateGraph
 from langgraph.graph.state import CompiledStateGraph
 from pydantic import Field
@@ -11,7 +17,10 @@ from pydantic_core import ValidationError
 from apps.pipelines.const import STANDARD_OUTPUT_NAME
 from apps.pipelines.exceptions import PipelineBuildError, PipelineNodeBuildError
 from apps.pipelines.models import Pipeline
-from apps.pipelines.nodes.nodes import EndNode, StartNode
+from apps.pipelines.nodes.base import PipelineNode
+from apps.pipelines.nodes.nodes import EndNode, MergeNode, StartNode
+
+logger = logging.getLogger("ocs.pipelines")
 
 
 class Node(pydantic.BaseModel):
@@ -90,6 +99,11 @@ class PipelineGraph(pydantic.BaseModel):
     def build_runnable_from_pipeline(cls, pipeline: Pipeline) -> CompiledStateGraph:
         return cls.build_from_pipeline(pipeline).build_runnable()
 
+    @classmethod
+    def get_cached_runnable(cls, pipeline: Pipeline) -> CompiledStateGraph:
+        """Return the compiled graph for the pipeline, building it only if it isn't already cached in this process"""
+        return runnable_cache.get(pipeline)
+
     @classmethod
     def build_from_pipeline(cls, pipeline: Pipeline) -> Self:
         node_data = [
@@ -107,7 +121,7 @@ class PipelineGraph(pydantic.BaseModel):
 
         self._validate_start_end_nodes()
         if not self.lenient_validation:
-            self._validate_no_parallel_nodes()
+            self._validate_parallel_branches()
         if self._check_for_cycles():
             raise PipelineBuildError("A cycle was detected")
 
@@ -126,22 +140,71 @@ class PipelineGraph(pydantic.BaseModel):
             raise PipelineBuildError(str(e))
         return compiled_graph
 
-    def _validate_no_parallel_nodes(self):
-        """This is a simple check to ensure that no two edges are connected to the same output
-        which serves as a proxy for parallel nodes."""
-        outgoing_edges = defaultdict(list)
-        for edge in self.edges:
-            outgoing_edges[edge.source].append(edge)
+    def _validate_parallel_branches(self):
+        """Edges from the same output of a node create parallel branches which langgraph runs concurrently.
+
+        Router outputs can only have one edge. Parallel branches must be joined by a Merge node, otherwise nodes
+        after the branches would be run once for each branch. Routers can't be used inside parallel branches since
+        the Merge node waits for all of its inputs and would never run if the router takes another path.
+        """
+        for edge in self.conditional_edges:
+            if self.nodes_by_id[edge.target].type == MergeNode.__name__:
+                raise PipelineBuildError(
+                    "Merge nodes can only join parallel branches", node_id=edge.target, edge_ids=[edge.id]
+                )
+
+        for source, edges in self.edges_by_source.items():
+            edges_by_handle = defaultdict(list)
+            for edge in edges:
+                edges_by_handle[edge.sourceHandle].append(edge)
+
+            for handle, handle_edges in edges_by_handle.items():
+                if len(handle_edges) < 2:
+                    continue
+                if handle_edges[0].is_conditional():
+                    raise PipelineBuildError(
+                        "Multiple edges connected to the same output",
+                        node_id=source,
+                        edge_ids=[edge.id for edge in handle_edges],
+                    )
+                self._validate_branches_are_merged([edge.target for edge in handle_edges])
 
-        for source, edges in outgoing_edges.items():
-            handles = Counter(edge.sourceHandle for edge in edges)
-            handle, count = handles.most_common(1)[0]
-            if count > 1:
-                edge_ids = [edge.id for edge in edges if edge.sourceHandle == handle]
+    def _validate_branches_are_merged(self, branch_targets: list[str]):
+        branches = [self._get_branch(target) for target in branch_targets]
+        for edge in self.conditional_edges:
+            in_branch = any(edge.source in branch for branch in branches)
+            if in_branch and self._reaches_merge_node(edge.target):
                 raise PipelineBuildError(
-                    "Multiple edges connected to the same output", node_id=source, edge_ids=edge_ids
+                    "Router nodes can't be used in parallel branches that are joined by a Merge node",
+                    node_id=edge.source,
                 )
 
+        for node in self.nodes:
+            if node.type == MergeNode.__name__:
+                continue
+            sources = {edge.source for edge in self.edges if edge.target == node.id}
+            for source_a, source_b in itertools.permutations(sources, 2):
+                if any(source_a in a and source_b in b for a, b in itertools.permutations(branches, 2)):
+                    raise PipelineBuildError("Parallel branches must be joined by a Merge node", node_id=node.id)
+
+    def _get_branch(self, node_id: str) -> set[str]:
+        """Return the IDs of the node and all the nodes that can be reached from it up to and including the Merge
+        nodes. Nodes after a Merge node are shared by all the branches that it joins so they aren't included."""
+        visited = set()
+        stack = [node_id]
+        while stack:
+            node_id = stack.pop()
+            if node_id not in visited:
+                visited.add(node_id)
+                if self.nodes_by_id[node_id].type != MergeNode.__name__:
+                    stack.extend(edge.target for edge in self.edges_by_source[node_id])
+        return visited
+
+    def _reaches_merge_node(self, node_id: str) -> bool:
+        return any(
+            self.nodes_by_id[branch_node].type == MergeNode.__name__ for branch_node in self._get_branch(node_id)
+        )
+
     def _check_for_cycles(self):
         """Detect cycles in a directed graph."""
         adjacency_list = defaultdict(list)
@@ -191,7 +254,9 @@ class PipelineGraph(pydantic.BaseModel):
         for node in nodes:
             try:
                 incoming_edges = [edge.source for edge in self.edges if edge.target == node.id]
-                state_graph.add_node(node.id, partial(node.pipeline_node_instance.process, node.id, incoming_edges))
+                state_graph.add_node(
+                    node.id, partial(_process_node, node.pipeline_node_instance, node.id, incoming_edges)
+                )
             except ValidationError as ex:
                 raise PipelineNodeBuildError(ex)
 
@@ -204,13 +269,22 @@ class PipelineGraph(pydantic.BaseModel):
                         continue
                     state_graph.add_conditional_edges(
                         edge.source,
-                        partial(node.pipeline_node_instance.process_conditional, node_id=edge.source),
+                        partial(_process_conditional_node, node.pipeline_node_instance, node_id=edge.source),
                         self.conditional_edge_map[edge.source],
                     )
                     seen_sources.add(edge.source)
-                else:
+                elif self.nodes_by_id[edge.target].type != MergeNode.__name__:
                     state_graph.add_edge(edge.source, edge.target)
 
+        reachable_ids = {node.id for node in reachable_nodes}
+        for node in reachable_nodes:
+            if node.type == MergeNode.__name__:
+                # Merge nodes wait for all of their inputs before running
+                sources = [
+                    edge.source for edge in self.edges if edge.target == node.id and edge.source in reachable_ids
+                ]
+                state_graph.add_edge(sources, node.id)
+
     def _validate_start_end_nodes(self):
         start_nodes = [node for node in self.nodes if node.type == StartNode.__name__]
         if len(start_nodes) != 1:
@@ -222,3 +296,72 @@ class PipelineGraph(pydantic.BaseModel):
             raise PipelineBuildError(
                 f"There should be exactly 1 {EndNode.model_config['json_schema_extra'].label} node"
             )
+
+
+def _process_node(node: PipelineNode, node_id: str, incoming_edges: list, state, config):
+    """Run the node on a copy of the node instance. Compiled graphs are shared between runs (see `RunnableCache`)
+    so per-run attributes such as `_config` must not be set on the shared instance."""
+    return node.model_copy().process(node_id, incoming_edges, state, config)
+
+
+def _process_conditional_node(node: PipelineNode, state, node_id: str | None = None) -> str:
+    return node.model_copy().process_conditional(state, node_id=node_id)
+
+
+class RunnableCache:
+    """Per-process LRU cache of compiled pipeline graphs keyed by the pipeline ID and version number.
+
+    Pipeline versions are immutable so their graphs can be reused until evicted. Working versions can be edited at any
+    time, so their key also includes a 'generation' token which is stored in the shared Django cache and changed
+    whenever the pipeline's nodes are updated (see `invalidate`). This ensures that edits made in one process are seen
+    by all other processes.
+    """
+
+    def __init__(self, max_size=128) -> None:
+        self.max_size = max_size
+        self.runnables: OrderedDict[tuple, CompiledStateGraph] = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get(self, pipeline: Pipeline) -> CompiledStateGraph:
+        key = self._get_key(pipeline)
+        with self.lock:
+            if key in self.runnables:
+                self.runnables.move_to_end(key)
+                return self.runnables[key]
+
+        logger.debug("Building runnable for pipeline %s (version %s)", pipeline.id, pipeline.version_number)
+        runnable = PipelineGraph.build_runnable_from_pipeline(pipeline)
+        with self.lock:
+            self._remove_pipeline(pipeline.id)
+            self.runnables[key] = runnable
+            while len(self.runnables) > self.max_size:
+                self.runnables.popitem(last=False)
+        return runnable
+
+    def invalidate(self, pipeline: Pipeline):
+        with self.lock:
+            self._remove_pipeline(pipeline.id)
+        if pipeline.working_version_id is None:
+            cache.set(self._generation_cache_key(pipeline.id), time.time_ns(), timeout=None)
+
+    def clear(self):
+        with self.lock:
+            self.runnables.clear()
+
+    def _remove_pipeline(self, pipeline_id: int):
+        """Remove any stale entries for the pipeline. A pipeline only ever has one valid entry since a new
+        version of a pipeline gets a new ID."""
+        for key in [key for key in self.runnables if key[0] == pipeline_id]:
+            self.runnables.pop(key)
+
+    def _get_key(self, pipeline: Pipeline) -> tuple:
+        if pipeline.working_version_id is not None:
+            return pipeline.id, pipeline.version_number, None
+        generation = cache.get(self._generation_cache_key(pipeline.id))
+        return pipeline.id, pipeline.version_number, generation
+
+    def _generation_cache_key(self, pipeline_id: int) -> str:
+        return f"pipeline_graph_generation:{pipeline_id}"
+
+
+runnable_cache = RunnableCache(max_size=settings.PIPELINE_RUNNABLE_CACHE_SIZE)
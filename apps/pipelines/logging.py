@@ -1,3 +1,5 @@
+import threading
+import time
 import uuid
 
 from langchain_core.callbacks import BaseCallbackHandler
@@ -76,7 +78,8 @@ class PipelineLoggingCallbackHandler(LoggingCallbackHandler):
         super().__init__(verbose)
 
     def _init_get_logger(self):
-        self.logger = get_logger(uuid.uuid4().hex, self.pipeline_run)
+        self.log_handler = LogHandler(self.pipeline_run)
+        self.logger = get_logger(uuid.uuid4().hex, self.log_handler)
 
     def on_chain_error(self, error, *args, **kwargs):
         from apps.pipelines.models import PipelineRunStatus
@@ -85,11 +88,11 @@ class PipelineLoggingCallbackHandler(LoggingCallbackHandler):
         super().on_chain_error(error, *args, **kwargs)
 
 
-def get_logger(name, pipeline_run) -> logger:
+def get_logger(name, handler: "MemLogHandler") -> logger:
     log = logger.bind(name=name)
     log.level("DEBUG")
     log.remove()
-    log.add(LogHandler(pipeline_run))
+    log.add(handler)
     return log
 
 
@@ -129,11 +132,34 @@ class MemLogHandler:
 
 
 class LogHandler(MemLogHandler):
-    def __init__(self, pipeline_run):
+    """Adds log entries to the pipeline run and saves them in batches.
+
+    Saving the run rewrites the whole log, so entries are only written to the DB once `flush_size` entries are
+    waiting or `flush_interval` seconds have passed since the last write. The remaining entries are written when the
+    run is saved at the end of `Pipeline.invoke`, which always happens (in a `finally` block) so no entries are lost
+    if the pipeline fails.
+    """
+
+    def __init__(self, pipeline_run, flush_size=25, flush_interval=5.0):
         super().__init__()
         self.pipeline_run = pipeline_run
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.lock = threading.RLock()
+        self.unsaved_count = 0
+        self.last_flush = time.monotonic()
 
     def _save(self, entry):
-        # Appending to a list is thread safe in python
-        self.pipeline_run.log["entries"].append(entry.model_dump())
-        self.pipeline_run.save()
+        with self.lock:
+            self.pipeline_run.log["entries"].append(entry.model_dump())
+            self.unsaved_count += 1
+            if self.unsaved_count >= self.flush_size or time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.unsaved_count:
+                return
+            self.pipeline_run.save(update_fields=["log", "updated_at"])
+            self.unsaved_count = 0
+            self.last_flush = time.monotonic()
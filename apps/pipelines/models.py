@@ -12,6 +12,8 @@ from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, System
 from langchain_core.runnables import RunnableConfig
 from pydantic import ConfigDict
 
+from apps.annotations.models import TagCategories
+from apps.chat.history import HistoryMessage, save_messages_to_history
 from apps.chat.models import ChatMessage, ChatMessageType
 from apps.custom_actions.form_utils import set_custom_actions
 from apps.custom_actions.mixins import CustomActionOperationMixin
@@ -23,6 +25,7 @@ from apps.pipelines.flow import Flow, FlowNode, FlowNodeData
 from apps.pipelines.logging import PipelineLoggingCallbackHandler
 from apps.pipelines.nodes.base import PipelineState
 from apps.pipelines.nodes.helpers import temporary_session
+from apps.service_providers.llm_service.prompt_context import ParticipantDataProxy
 from apps.teams.models import BaseTeamModel
 from apps.utils.models import BaseModel
 
@@ -121,6 +124,8 @@ class Pipeline(BaseTeamModel, VersionsMixin):
 
     def update_nodes_from_data(self) -> None:
         """Set the nodes on the pipeline from data coming from the frontend"""
+        from apps.pipelines.graph import runnable_cache
+
         nodes = [FlowNode(**node) for node in self.data["nodes"]]
         # Delete old nodes
         current_ids = set(self.node_ids)
@@ -150,6 +155,8 @@ class Pipeline(BaseTeamModel, VersionsMixin):
             )
             created_node.update_from_params()
 
+        runnable_cache.invalidate(self)
+
     def validate(self, full=True) -> dict:
         """Validate the pipeline nodes and return a dictionary of errors"""
         from apps.pipelines.graph import PipelineGraph
@@ -218,7 +225,7 @@ class Pipeline(BaseTeamModel, VersionsMixin):
         from apps.pipelines.graph import PipelineGraph
 
         with temporary_session(self.team, user_id) as session:
-            runnable = PipelineGraph.build_runnable_from_pipeline(self)
+            runnable = PipelineGraph.get_cached_runnable(self)
             input = PipelineState(messages=[input], experiment_session=session, pipeline_version=self.version_number)
             with patch_executor():
                 output = runnable.invoke(input, config={"max_concurrency": 1})
@@ -236,7 +243,7 @@ class Pipeline(BaseTeamModel, VersionsMixin):
         from apps.experiments.models import AgentTools
         from apps.pipelines.graph import PipelineGraph
 
-        runnable = PipelineGraph.build_runnable_from_pipeline(self)
+        runnable = PipelineGraph.get_cached_runnable(self)
         pipeline_run = self._create_pipeline_run(input, session)
         logging_callback = PipelineLoggingCallbackHandler(pipeline_run)
 
@@ -270,15 +277,18 @@ class Pipeline(BaseTeamModel, VersionsMixin):
                     input_metadata.update(trace_metadata)
                     output_metadata.update(trace_metadata)
 
-                if save_input_to_history:
-                    self._save_message_to_history(
-                        session, input["messages"][-1], ChatMessageType.HUMAN, metadata=input_metadata
-                    )
-                ai_message = self._save_message_to_history(
-                    session, output["messages"][-1], ChatMessageType.AI, metadata=output_metadata
+                ai_message = self._save_messages_to_history(
+                    session,
+                    input["messages"][-1] if save_input_to_history else None,
+                    output["messages"][-1],
+                    input_metadata=input_metadata,
+                    output_metadata=output_metadata,
                 )
                 output["ai_message_id"] = ai_message.id
         finally:
+            if session is not None:
+                # The end node saves participant data changes. This saves any changes made before an error.
+                ParticipantDataProxy.end_turn(session)
             if trace_service:
                 trace_service.end()
             if pipeline_run.status == PipelineRunStatus.ERROR:
@@ -301,16 +311,28 @@ class Pipeline(BaseTeamModel, VersionsMixin):
             session=session,
         )
 
-    def _save_message_to_history(
-        self, session: ExperimentSession, message: str, type_: ChatMessageType, metadata: dict
+    def _save_messages_to_history(
+        self,
+        session: ExperimentSession,
+        input: str | None,
+        output: str,
+        input_metadata: dict,
+        output_metadata: dict,
     ) -> ChatMessage:
-        chat_message = ChatMessage.objects.create(
-            chat=session.chat, message_type=type_.value, content=message, metadata=metadata
+        """Save the input (if given) and output messages to the chat history and return the AI message"""
+        messages = []
+        if input is not None:
+            messages.append(HistoryMessage(content=input, message_type=ChatMessageType.HUMAN, metadata=input_metadata))
+        version_tag = ChatMessage.get_version_tag_name(self.version_number, self.is_a_version)
+        messages.append(
+            HistoryMessage(
+                content=output,
+                message_type=ChatMessageType.AI,
+                metadata=output_metadata,
+                system_tags=[(version_tag, TagCategories.EXPERIMENT_VERSION)],
+            )
         )
-
-        if type_ == ChatMessageType.AI:
-            chat_message.add_version_tag(version_number=self.version_number, is_a_version=self.is_a_version)
-        return chat_message
+        return save_messages_to_history(session, messages)[-1]
 
     @transaction.atomic()
     def create_new_version(self, *args, **kwargs):
@@ -587,6 +609,7 @@ class PipelineChatMessages(BaseModel):
     human_message = models.TextField()
     ai_message = models.TextField()
     summary = models.TextField(null=True)  # noqa: DJ001
+    token_counts = models.JSONField(default=dict, blank=True, help_text="Cached token counts keyed by tokenizer")
 
     def __str__(self):
         if self.summary:
@@ -34,11 +34,8 @@ def add_messages(left: dict, right: dict):
 
 
 def add_temp_state_messages(left: dict, right: dict):
-    output = {**left}
-    try:
-        output["outputs"].update(right["outputs"])
-    except KeyError:
-        output["outputs"] = right.get("outputs", {})
+    # Don't update `left` in place since parallel branches may still be reading it
+    output = {**left, "outputs": {**left.get("outputs", {}), **right.get("outputs", {})}}
     for key, value in right.items():
         if key != "outputs":
             output[key] = value
@@ -54,7 +51,8 @@ def merge_dicts(left: dict, right: dict):
     for key, value in right.items():
         if key in output:
             if isinstance(output[key], list):
-                output[key] = list(set(output[key]) | set(value))
+                # preserve the order of the values so that the result is deterministic
+                output[key] = list(dict.fromkeys([*output[key], *value]))
             elif isinstance(output[key], bool):
                 output[key] = value
             else:
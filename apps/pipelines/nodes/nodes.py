@@ -1,31 +1,28 @@
-import datetime
+import functools
 import inspect
 import json
 import logging
-import random
 import time
 from typing import Annotated, Literal, Self
 
-import tiktoken
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
 from django.db.models import TextChoices
-from jinja2.sandbox import SandboxedEnvironment
 from langchain_core.messages import BaseMessage
 from langchain_core.prompts import MessagesPlaceholder, PromptTemplate
-from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+from langchain_core.runnables import RunnableConfig, RunnableLambda, RunnablePassthrough
+from langchain_core.runnables.config import get_executor_for_config
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from pydantic import BaseModel, BeforeValidator, Field, create_model, field_validator, model_validator
 from pydantic.config import ConfigDict
 from pydantic_core import PydanticCustomError
 from pydantic_core.core_schema import FieldValidationInfo
-from RestrictedPython import compile_restricted, safe_builtins, safe_globals
 
 from apps.assistants.models import OpenAiAssistant
 from apps.chat.agent.tools import get_node_tools
 from apps.chat.conversation import compress_chat_history, compress_pipeline_chat_history
-from apps.experiments.models import ExperimentSession, ParticipantData
+from apps.experiments.models import ExperimentSession
 from apps.pipelines.exceptions import PipelineNodeBuildError, PipelineNodeRunError
 from apps.pipelines.models import Node, PipelineChatHistory, PipelineChatHistoryModes, PipelineChatHistoryTypes
 from apps.pipelines.nodes.base import (
@@ -37,10 +34,13 @@ from apps.pipelines.nodes.base import (
     Widgets,
     deprecated_node,
 )
+from apps.pipelines.nodes.sandbox import compiled_code_cache, get_sandbox_globals
+from apps.pipelines.nodes.template_cache import template_cache
 from apps.pipelines.tasks import send_email_from_pipeline
 from apps.service_providers.exceptions import ServiceProviderConfigError
 from apps.service_providers.llm_service.adapters import AssistantAdapter, ChatAdapter
 from apps.service_providers.llm_service.history_managers import PipelineHistoryManager
+from apps.service_providers.llm_service.prompt_context import ParticipantDataProxy
 from apps.service_providers.llm_service.runnables import (
     AgentAssistantChat,
     AgentLLMChat,
@@ -48,6 +48,7 @@ from apps.service_providers.llm_service.runnables import (
     ChainOutput,
     SimpleLLMChat,
 )
+from apps.service_providers.llm_service.token_counters import OpenAITokenCounter, get_token_counter
 from apps.service_providers.models import LlmProviderModel
 from apps.utils.prompt import OcsPromptTemplate, PromptVars, validate_prompt_variables
 
@@ -68,35 +69,35 @@ class RenderTemplate(PipelineNode):
     )
 
     def _process(self, input, node_id: str, state: PipelineState, **kwargs) -> PipelineState:
-        env = SandboxedEnvironment()
         try:
+            template = template_cache.get(self.template_string)
             content = {
                 "input": input,
                 "temp_state": state.get("temp_state", {}),
             }
 
+            # Only load the participant context that the template uses since it requires DB queries
             if "experiment_session" in state and state["experiment_session"]:
                 exp_session = state["experiment_session"]
                 participant = getattr(exp_session, "participant", None)
                 if participant:
-                    content.update(
-                        {
-                            "participant_details": {
-                                "identifier": getattr(participant, "identifier", None),
-                                "platform": getattr(participant, "platform", None),
-                            },
-                            "participant_schedules": participant.get_schedules_for_experiment(
+                    content["participant_details"] = {
+                        "identifier": getattr(participant, "identifier", None),
+                        "platform": getattr(participant, "platform", None),
+                    }
+                    if "participant_schedules" in template.variables:
+                        content["participant_schedules"] = (
+                            participant.get_schedules_for_experiment(
                                 exp_session.experiment,
                                 as_dict=True,
                                 include_inactive=True,
                             )
-                            or [],
-                        }
-                    )
-                proxy = self.get_participant_data_proxy(state)
-                content["participant_data"] = proxy.get() or {}
+                            or []
+                        )
+                if "participant_data" in template.variables:
+                    proxy = self.get_participant_data_proxy(state)
+                    content["participant_data"] = proxy.get() or {}
 
-            template = env.from_string(self.template_string)
             output = template.render(content)
         except Exception as e:
             self.logger.error(f"Template rendering failed: {e}")
@@ -391,6 +392,35 @@ class EndNode(Passthrough):
     name: str = "end"
     model_config = ConfigDict(json_schema_extra=NodeSchema(label="End", flow_node_type="endNode"))
 
+    def _process(self, input, state: PipelineState, node_id: str) -> PipelineState:
+        if session := state.get("experiment_session"):
+            # Save the participant data changes made by the nodes in this run
+            ParticipantDataProxy.end_turn(session)
+        return super()._process(input, state, node_id)
+
+
+class MergeNode(PipelineNode):
+    """Joins the outputs of parallel branches once all of them have finished"""
+
+    model_config = ConfigDict(json_schema_extra=NodeSchema(label="Merge"))
+
+    separator: str = Field(
+        default="\n\n",
+        description="The text placed between the outputs of each branch",
+        json_schema_extra=UiSchema(widget=Widgets.expandable_text),
+    )
+
+    def process(
+        self, node_id: str, incoming_edges: list, state: PipelineState, config: RunnableConfig
+    ) -> PipelineState:
+        self._config = config
+        # The outputs are joined in the order of the incoming edges so that the result doesn't depend on which
+        # branch finished first
+        outputs = [state["outputs"][source]["message"] for source in incoming_edges if source in state["outputs"]]
+        output = self.separator.join(str(output) for output in outputs)
+        self.logger.debug(f"Merged the outputs of {len(outputs)} branches", output=output)
+        return PipelineState.from_node_output(node_name=self.name, node_id=node_id, output=output)
+
 
 @deprecated_node(message="Use the 'Router' node instead.")
 class BooleanNode(Passthrough):
@@ -522,6 +552,24 @@ class StaticRouterNode(RouterMixin, Passthrough):
         return self._get_keyword(result)
 
 
+class ExtractionModes(TextChoices):
+    SEQUENTIAL = "sequential", "Sequential"
+    CONCURRENT = "concurrent", "Concurrent"
+
+
+def merge_extracted_data(left, right):
+    """Merge the data extracted from two chunks of the input. Values from `right` take precedence except for `None`
+    values, which don't replace existing values. Lists are combined without duplicates."""
+    if isinstance(left, dict) and isinstance(right, dict):
+        merged = {**left}
+        for key, value in right.items():
+            merged[key] = merge_extracted_data(left[key], value) if key in left else value
+        return merged
+    if isinstance(left, list) and isinstance(right, list):
+        return left + [item for item in right if item not in left]
+    return left if right is None else right
+
+
 class ExtractStructuredDataNodeMixin:
     def _prompt_chain(self, reference_data):
         template = (
@@ -548,21 +596,43 @@ class ExtractStructuredDataNodeMixin:
         prompt_token_count = self._get_prompt_token_count(reference_data, json_schema)
         message_chunks = self.chunk_messages(input, prompt_token_count=prompt_token_count)
 
-        new_reference_data = reference_data
-        for idx, message_chunk in enumerate(message_chunks, start=1):
-            chain = self.extraction_chain(json_schema=json_schema, reference_data=new_reference_data)
-            output = chain.invoke(message_chunk, config=self._config)
-            self.logger.info(
-                f"Chunk {idx}",
-                input=f"\nReference data:\n{new_reference_data}\nChunk data:\n{message_chunk}\n\n",
-                output=f"\nExtracted data:\n{output}",
-            )
-            new_reference_data = self.update_reference_data(output, reference_data)
+        if self.extraction_mode == ExtractionModes.CONCURRENT and len(message_chunks) > 1:
+            new_reference_data = self._extract_concurrently(message_chunks, json_schema, reference_data)
+        else:
+            new_reference_data = reference_data
+            for idx, message_chunk in enumerate(message_chunks, start=1):
+                output = self._extract_chunk(idx, message_chunk, json_schema, new_reference_data)
+                new_reference_data = self.update_reference_data(output, reference_data)
 
         self.post_extraction_hook(new_reference_data, state)
         output = input if self.is_passthrough else json.dumps(new_reference_data)
         return PipelineState.from_node_output(node_name=self.name, node_id=node_id, output=output)
 
+    def _extract_concurrently(self, message_chunks: list[str], json_schema: dict, reference_data):
+        """Extract data from all the chunks at the same time using the same reference data and merge the results in
+        the order of the chunks"""
+        config = {**self._config, "max_concurrency": self.max_concurrency}
+        with get_executor_for_config(config) as executor:
+            outputs = list(
+                executor.map(
+                    lambda idx, message_chunk: self._extract_chunk(idx, message_chunk, json_schema, reference_data),
+                    range(1, len(message_chunks) + 1),
+                    message_chunks,
+                )
+            )
+        return self.update_reference_data(functools.reduce(merge_extracted_data, outputs), reference_data)
+
+    def _extract_chunk(self, idx: int, message_chunk: str, json_schema: dict, reference_data):
+        chain = self.extraction_chain(json_schema=json_schema, reference_data=reference_data)
+        start = time.perf_counter()
+        output = chain.invoke(message_chunk, config=self._config)
+        self.logger.info(
+            f"Chunk {idx} ({(time.perf_counter() - start) * 1000:.0f}ms)",
+            input=f"\nReference data:\n{reference_data}\nChunk data:\n{message_chunk}\n\n",
+            output=f"\nExtracted data:\n{output}",
+        )
+        return output
+
     def post_extraction_hook(self, output, state):
         pass
 
@@ -578,8 +648,8 @@ class ExtractStructuredDataNodeMixin:
         # If we invoke the chain with an empty input, we get the prompt without the conversation history, which
         # is what we want.
         output = prompt_chain.invoke(input="")
-        json_schema_tokens = llm.get_num_tokens(json.dumps(json_schema))
-        return llm.get_num_tokens(output.text) + json_schema_tokens
+        token_counter = get_token_counter(llm)
+        return sum(token_counter.get_tokens_from_texts([output.text, json.dumps(json_schema)]))
 
     def chunk_messages(self, input: str, prompt_token_count: int) -> list[str]:
         """Chunk messages using a splitter that considers the token count.
@@ -597,17 +667,12 @@ class ExtractStructuredDataNodeMixin:
         overlap_tokens = int(chunk_size_tokens * overlap_percentage)
         self.logger.debug(f"Chunksize in tokens: {chunk_size_tokens} with {overlap_tokens} tokens overlap")
 
-        try:
-            encoding = tiktoken.encoding_for_model(llm_provider_model.name)
-            encoding_name = encoding.name
-        except KeyError:
-            # The same encoder we use for llm.get_num_tokens_from_messages
-            encoding_name = "gpt2"
-
-        text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-            encoding_name=encoding_name,
+        # The splitter measures the same pieces of text many times while merging splits so counts are cached
+        token_counter = OpenAITokenCounter(llm_provider_model.name)
+        text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size_tokens,
             chunk_overlap=overlap_tokens,
+            length_function=token_counter.get_tokens_from_text,
         )
 
         return text_splitter.split_text(input)
@@ -672,6 +737,18 @@ class ExtractStructuredData(ExtractStructuredDataNodeMixin, LLMResponse, Structu
         description="A JSON object structure where the key is the name of the field and the value the description",
         json_schema_extra=UiSchema(widget=Widgets.expandable_text),
     )
+    extraction_mode: ExtractionModes = Field(
+        default=ExtractionModes.SEQUENTIAL,
+        description=(
+            "Sequential: long inputs are split into chunks which are processed one after the other, passing the data "
+            "extracted so far to the next chunk. Concurrent: chunks are processed at the same time and the results "
+            "are merged."
+        ),
+        json_schema_extra=UiSchema(enum_labels=ExtractionModes.labels),
+    )
+    max_concurrency: int = Field(
+        default=4, ge=1, le=10, description="The maximum number of chunks to process at the same time"
+    )
 
     @property
     def is_passthrough(self) -> bool:
@@ -693,6 +770,18 @@ class ExtractParticipantData(ExtractStructuredDataNodeMixin, LLMResponse, Struct
         description="A JSON object structure where the key is the name of the field and the value the description",
         json_schema_extra=UiSchema(widget=Widgets.expandable_text),
     )
+    extraction_mode: ExtractionModes = Field(
+        default=ExtractionModes.SEQUENTIAL,
+        description=(
+            "Sequential: long inputs are split into chunks which are processed one after the other, passing the data "
+            "extracted so far to the next chunk. Concurrent: chunks are processed at the same time and the results "
+            "are merged."
+        ),
+        json_schema_extra=UiSchema(enum_labels=ExtractionModes.labels),
+    )
+    max_concurrency: int = Field(
+        default=4, ge=1, le=10, description="The maximum number of chunks to process at the same time"
+    )
     key_name: str = ""
 
     @property
@@ -707,13 +796,7 @@ class ExtractParticipantData(ExtractStructuredDataNodeMixin, LLMResponse, Struct
         if not session:
             return {}
 
-        participant_data = (
-            ParticipantData.objects.for_experiment(session.experiment).filter(participant=session.participant).first()
-        )
-        if not participant_data:
-            return {}
-
-        data = participant_data.data
+        data = self.get_participant_data_proxy(state).get(include_global_data=False)
         if self.key_name:
             # string, list or dict
             return data.get(self.key_name, "")
@@ -735,19 +818,7 @@ class ExtractParticipantData(ExtractStructuredDataNodeMixin, LLMResponse, Struct
         if self.key_name:
             output = {self.key_name: output}
 
-        try:
-            participant_data = ParticipantData.objects.for_experiment(session.experiment).get(
-                participant=session.participant
-            )
-            participant_data.data = participant_data.data | output
-            participant_data.save()
-        except ParticipantData.DoesNotExist:
-            ParticipantData.objects.create(
-                participant=session.participant,
-                experiment=session.experiment,
-                team=session.team,
-                data=output,
-            )
+        self.get_participant_data_proxy(state).update(output)
 
 
 class AssistantNode(PipelineNode):
@@ -852,11 +923,7 @@ class CodeNode(PipelineNode):
         if not value:
             value = DEFAULT_FUNCTION
         try:
-            byte_code = compile_restricted(
-                value,
-                filename="<inline code>",
-                mode="exec",
-            )
+            byte_code = compiled_code_cache.get(value)
             custom_locals = {}
             try:
                 exec(byte_code, {}, custom_locals)
@@ -884,50 +951,32 @@ class CodeNode(PipelineNode):
 
     def _process(self, input: str, state: PipelineState, node_id: str) -> PipelineState:
         function_name = "main"
-        byte_code = compile_restricted(
-            self.code,
-            filename="<inline code>",
-            mode="exec",
-        )
+        byte_code = compiled_code_cache.get(self.code)
 
         custom_locals = {}
         custom_globals = self._get_custom_globals(state)
         kwargs = {"logger": self.logger}
+        start = time.perf_counter()
         try:
             exec(byte_code, custom_globals, custom_locals)
             result = str(custom_locals[function_name](input, **kwargs))
         except Exception as exc:
             raise PipelineNodeRunError(exc) from exc
+        finally:
+            self.logger.info(f"{self.name} code ran in {(time.perf_counter() - start) * 1000:.1f}ms")
         return PipelineState.from_node_output(node_name=self.name, node_id=node_id, output=result)
 
     def _get_custom_globals(self, state: PipelineState):
-        from RestrictedPython.Eval import (
-            default_guarded_getitem,
-            default_guarded_getiter,
-        )
-
-        custom_globals = safe_globals.copy()
-
         participant_data_proxy = self.get_participant_data_proxy(state)
-        custom_globals.update(
-            {
-                "__builtins__": self._get_custom_builtins(),
-                "json": json,
-                "datetime": datetime,
-                "time": time,
-                "_getitem_": default_guarded_getitem,
-                "_getiter_": default_guarded_getiter,
-                "_write_": lambda x: x,
-                "get_participant_data": participant_data_proxy.get,
-                "set_participant_data": participant_data_proxy.set,
-                "get_participant_schedules": participant_data_proxy.get_schedules,
-                "get_temp_state_key": self._get_temp_state_key(state),
-                "set_temp_state_key": self._set_temp_state_key(state),
-                "get_session_state_key": self._get_session_state_key(state["experiment_session"]),
-                "set_session_state_key": self._set_session_state_key(state["experiment_session"]),
-            }
+        return get_sandbox_globals(
+            get_participant_data=participant_data_proxy.get,
+            set_participant_data=participant_data_proxy.set,
+            get_participant_schedules=participant_data_proxy.get_schedules,
+            get_temp_state_key=self._get_temp_state_key(state),
+            set_temp_state_key=self._set_temp_state_key(state),
+            get_session_state_key=self._get_session_state_key(state["experiment_session"]),
+            set_session_state_key=self._set_session_state_key(state["experiment_session"]),
         )
-        return custom_globals
 
     def _get_session_state_key(self, session: ExperimentSession):
         def get_session_state_key(key_name: str):
@@ -955,33 +1004,3 @@ class CodeNode(PipelineNode):
             state["temp_state"][key_name] = value
 
         return set_temp_state_key
-
-    def _get_custom_builtins(self):
-        allowed_modules = {
-            "json",
-            "re",
-            "datetime",
-            "time",
-            "random",
-        }
-        custom_builtins = safe_builtins.copy()
-        custom_builtins.update(
-            {
-                "min": min,
-                "max": max,
-                "sum": sum,
-                "abs": abs,
-                "all": all,
-                "any": any,
-                "datetime": datetime,
-                "random": random,
-            }
-        )
-
-        def guarded_import(name, *args, **kwargs):
-            if name not in allowed_modules:
-                raise ImportError(f"Importing '{name}' is not allowed")
-            return __import__(name, *args, **kwargs)
-
-        custom_builtins["__import__"] = guarded_import
-        return custom_builtins
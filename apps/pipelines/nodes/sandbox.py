@@ -0,0 +1,99 @@
+"""
+Compilation and globals for running user code in the `CodeNode` sandbox.
+
+Compiling code with RestrictedPython is far more expensive than running a typical node, so compiled code is cached
+per process keyed by a hash of the code. The parts of the sandbox globals that don't depend on the pipeline state
+are built once when this module is imported.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from types import CodeType
+
+from django.conf import settings
+from RestrictedPython import compile_restricted, safe_builtins, safe_globals
+from RestrictedPython.Eval import default_guarded_getitem, default_guarded_getiter
+
+logger = logging.getLogger("ocs.pipelines")
+
+ALLOWED_MODULES = {
+    "json",
+    "re",
+    "datetime",
+    "time",
+    "random",
+}
+
+
+def _guarded_import(name, *args, **kwargs):
+    if name not in ALLOWED_MODULES:
+        raise ImportError(f"Importing '{name}' is not allowed")
+    return __import__(name, *args, **kwargs)
+
+
+SANDBOX_BUILTINS = {
+    **safe_builtins,
+    "min": min,
+    "max": max,
+    "sum": sum,
+    "abs": abs,
+    "all": all,
+    "any": any,
+    "datetime": datetime,
+    "random": random,
+    "__import__": _guarded_import,
+}
+
+SANDBOX_GLOBALS = {
+    **safe_globals,
+    "__builtins__": SANDBOX_BUILTINS,
+    "json": json,
+    "datetime": datetime,
+    "time": time,
+    "_getitem_": default_guarded_getitem,
+    "_getiter_": default_guarded_getiter,
+    "_write_": lambda x: x,
+}
+
+
+def get_sandbox_globals(**bindings) -> dict:
+    """Return a new globals dict for running sandboxed code with the `bindings` added to it."""
+    return {**SANDBOX_GLOBALS, **bindings}
+
+
+class CompiledCodeCache:
+    """Per-process LRU cache of code compiled with RestrictedPython, keyed by a hash of the code."""
+
+    def __init__(self, max_size=256) -> None:
+        self.max_size = max_size
+        self.compiled: OrderedDict[str, CodeType] = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get(self, code: str) -> CodeType:
+        """Return the compiled code. Raises `SyntaxError` if the code can't be compiled."""
+        key = hashlib.sha256(code.encode()).hexdigest()
+        with self.lock:
+            if key in self.compiled:
+                self.compiled.move_to_end(key)
+                return self.compiled[key]
+
+        logger.debug("Compiling code with key '%s'", key)
+        byte_code = compile_restricted(code, filename="<inline code>", mode="exec")
+        with self.lock:
+            self.compiled[key] = byte_code
+            while len(self.compiled) > self.max_size:
+                self.compiled.popitem(last=False)
+        return byte_code
+
+    def clear(self):
+        with self.lock:
+            self.compiled.clear()
+
+
+compiled_code_cache = CompiledCodeCache(max_size=settings.CODE_NODE_CACHE_SIZE)
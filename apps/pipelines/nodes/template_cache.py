@@ -0,0 +1,65 @@
+"""
+Per-process cache of compiled Jinja templates for `RenderTemplate` nodes.
+
+Templates are compiled once by a shared sandboxed environment and kept in an LRU cache keyed by a hash of the
+template string. The variables that a template references are found from its AST when it is compiled, so that
+nodes only load the context that the template uses.
+"""
+
+import dataclasses
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from jinja2 import Template, meta
+from jinja2.sandbox import SandboxedEnvironment
+
+logger = logging.getLogger("ocs.pipelines")
+
+
+@dataclasses.dataclass(frozen=True)
+class CompiledTemplate:
+    template: Template
+    variables: frozenset[str]
+
+    def render(self, context: dict) -> str:
+        return self.template.render(context)
+
+
+class TemplateCache:
+    """LRU cache of templates compiled by a shared `SandboxedEnvironment`."""
+
+    def __init__(self, max_size=256) -> None:
+        self.max_size = max_size
+        self.env = SandboxedEnvironment()
+        self.templates: OrderedDict[str, CompiledTemplate] = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get(self, template_string: str) -> CompiledTemplate:
+        """Return the compiled template. Raises `jinja2.TemplateSyntaxError` if the template is invalid."""
+        key = hashlib.sha256(template_string.encode()).hexdigest()
+        with self.lock:
+            if key in self.templates:
+                self.templates.move_to_end(key)
+                return self.templates[key]
+
+        logger.debug("Compiling template with key '%s'", key)
+        ast = self.env.parse(template_string)
+        compiled = CompiledTemplate(
+            template=self.env.from_string(ast),
+            variables=frozenset(meta.find_undeclared_variables(ast)),
+        )
+        with self.lock:
+            self.templates[key] = compiled
+            while len(self.templates) > self.max_size:
+                self.templates.popitem(last=False)
+        return compiled
+
+    def clear(self):
+        with self.lock:
+            self.templates.clear()
+
+
+template_cache = TemplateCache(max_size=settings.PIPELINE_TEMPLATE_CACHE_SIZE)
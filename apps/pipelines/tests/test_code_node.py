@@ -7,7 +7,10 @@ from apps.channels.datamodels import Attachment
 from apps.experiments.models import ExperimentSession, Participant, ParticipantData
 from apps.files.models import File
 from apps.pipelines.exceptions import PipelineNodeBuildError, PipelineNodeRunError
+from apps.pipelines.nodes import sandbox
 from apps.pipelines.nodes.base import PipelineState
+from apps.pipelines.nodes.sandbox import compiled_code_cache
+from apps.pipelines.nodes.template_cache import template_cache
 from apps.pipelines.tests.utils import (
     code_node,
     create_runnable,
@@ -527,3 +530,54 @@ def main(input, **kwargs):
 
     experiment_session.refresh_from_db()
     assert experiment_session.state["message_count"] == 2
+
+
+@django_db_with_data(available_apps=("apps.service_providers",))
+def test_code_is_compiled_once(pipeline):
+    code = "def main(input, **kwargs):\n\treturn input.upper()"
+    compiled_code_cache.clear()
+    nodes = [
+        start_node(),
+        code_node(code),
+        end_node(),
+    ]
+    logger = mock.Mock()
+    with (
+        mock.patch("apps.pipelines.nodes.base.PipelineNode.logger", logger),
+        mock.patch(
+            "apps.pipelines.nodes.sandbox.compile_restricted", wraps=sandbox.compile_restricted
+        ) as compile_restricted,
+    ):
+        runnable = create_runnable(pipeline, nodes)
+        for _ in range(3):
+            output = runnable.invoke(PipelineState(messages=["hi"], experiment_session=ExperimentSession()))
+            assert output["messages"][-1] == "HI"
+
+    compile_restricted.assert_called_once()
+    timing_logs = [call.args[0] for call in logger.info.call_args_list if "code ran in" in call.args[0]]
+    assert len(timing_logs) == 3
+
+
+@django_db_with_data(available_apps=("apps.service_providers",))
+@mock.patch("apps.pipelines.nodes.base.PipelineNode.logger", mock.Mock())
+@mock.patch("apps.experiments.models.Participant.get_schedules_for_experiment")
+@mock.patch("apps.pipelines.nodes.base.PipelineNode.get_participant_data_proxy")
+def test_render_template_only_loads_used_context(get_participant_data_proxy, get_schedules, pipeline):
+    experiment_session = ExperimentSessionFactory()
+    template_cache.clear()
+    state = PipelineState(experiment_session=experiment_session, messages=["Cycling"], outputs={})
+    nodes = [
+        start_node(),
+        render_template_node("input: {{input}}, participant_id: {{participant_details.identifier}}"),
+        end_node(),
+    ]
+    runnable = create_runnable(pipeline, nodes)
+    with mock.patch.object(template_cache.env, "parse", wraps=template_cache.env.parse) as parse:
+        for _ in range(2):
+            result = runnable.invoke(state)
+            identifier = experiment_session.participant.identifier
+            assert result["messages"][-1] == f"input: Cycling, participant_id: {identifier}"
+
+    parse.assert_called_once()
+    get_schedules.assert_not_called()
+    get_participant_data_proxy.assert_not_called()
@@ -6,6 +6,7 @@ import pytest
 from apps.channels.models import ExperimentChannel
 from apps.events.models import EventActionType
 from apps.experiments.models import Experiment, ExperimentSession, Participant
+from apps.pipelines.graph import PipelineGraph, RunnableCache
 from apps.pipelines.tests.utils import create_runnable, end_node, llm_response_with_prompt_node, start_node
 from apps.utils.factories.assistants import OpenAiAssistantFactory
 from apps.utils.factories.events import EventActionFactory, ExperimentFactory, StaticTriggerFactory
@@ -158,3 +159,35 @@ class TestPipeline:
         # Double check that the node didn't archive the assistant
         assistant.refresh_from_db()
         assert assistant.is_archived is False
+
+
+@pytest.mark.django_db()
+class TestRunnableCache:
+    @mock.patch("apps.pipelines.graph.PipelineGraph.build_runnable_from_pipeline")
+    def test_runnable_is_reused(self, build_runnable):
+        pipeline = PipelineFactory()
+        pipeline_version = pipeline.create_new_version()
+
+        assert PipelineGraph.get_cached_runnable(pipeline_version) is PipelineGraph.get_cached_runnable(
+            pipeline_version
+        )
+        assert PipelineGraph.get_cached_runnable(pipeline) is PipelineGraph.get_cached_runnable(pipeline)
+        assert build_runnable.call_count == 2
+
+    @mock.patch("apps.pipelines.graph.PipelineGraph.build_runnable_from_pipeline")
+    def test_updating_nodes_invalidates_working_version(self, build_runnable):
+        pipeline = PipelineFactory()
+        PipelineGraph.get_cached_runnable(pipeline)
+        pipeline.update_nodes_from_data()
+        PipelineGraph.get_cached_runnable(pipeline)
+        assert build_runnable.call_count == 2
+
+    @mock.patch("apps.pipelines.graph.PipelineGraph.build_runnable_from_pipeline")
+    def test_least_recently_used_runnable_is_evicted(self, build_runnable):
+        cache = RunnableCache(max_size=1)
+        pipeline1 = PipelineFactory()
+        pipeline2 = PipelineFactory()
+        cache.get(pipeline1)
+        cache.get(pipeline2)
+        cache.get(pipeline1)
+        assert build_runnable.call_count == 3
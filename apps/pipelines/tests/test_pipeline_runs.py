@@ -6,7 +6,7 @@ from langchain_core.runnables import RunnableLambda
 from apps.channels.datamodels import Attachment
 from apps.chat.models import ChatMessage, ChatMessageType
 from apps.experiments.models import ExperimentSession
-from apps.pipelines.models import LogEntry, Pipeline, PipelineRunStatus
+from apps.pipelines.models import LogEntry, Pipeline, PipelineRun, PipelineRunStatus
 from apps.pipelines.nodes.base import PipelineNode, PipelineState
 from apps.pipelines.nodes.nodes import StartNode
 from apps.service_providers.models import TraceProvider
@@ -189,3 +189,14 @@ def test_save_trace_metadata(pipeline: Pipeline, session: ExperimentSession):
     assert "trace_info" in human_message.metadata
     ai_message = session.chat.messages.filter(message_type=ChatMessageType.AI).first()
     assert "trace_info" in ai_message.metadata
+
+
+@django_db_transactional()
+def test_log_entries_are_saved_in_batches(pipeline: Pipeline, session: ExperimentSession):
+    with patch("apps.pipelines.models.PipelineRun.save", autospec=True, side_effect=PipelineRun.save) as save:
+        pipeline.invoke(PipelineState(messages=["foo"]), session)
+
+    run = pipeline.runs.first()
+    assert len(run.log["entries"]) == 8
+    # The run is saved when it is created and when it finishes instead of after every log entry
+    assert save.call_count == 2
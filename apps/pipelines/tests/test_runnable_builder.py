@@ -1,3 +1,5 @@
+import json
+import time
 from contextlib import contextmanager
 from unittest import mock
 from unittest.mock import Mock, patch
@@ -8,11 +10,12 @@ from django.test import override_settings
 from langchain_core.runnables import RunnableConfig
 
 from apps.channels.datamodels import Attachment
-from apps.experiments.models import ParticipantData
+from apps.experiments.models import ExperimentSession, ParticipantData
 from apps.pipelines.exceptions import PipelineBuildError, PipelineNodeBuildError
+from apps.pipelines.executor import patch_executor
 from apps.pipelines.logging import LoggingCallbackHandler
 from apps.pipelines.nodes.base import PipelineState, merge_dicts
-from apps.pipelines.nodes.nodes import EndNode, RouterNode, StartNode, StaticRouterNode
+from apps.pipelines.nodes.nodes import EndNode, RouterNode, StartNode, StaticRouterNode, merge_extracted_data
 from apps.pipelines.tests.utils import (
     assistant_node,
     boolean_node,
@@ -24,6 +27,7 @@ from apps.pipelines.tests.utils import (
     extract_structured_data_node,
     llm_response_node,
     llm_response_with_prompt_node,
+    merge_node,
     passthrough_node,
     render_template_node,
     router_node,
@@ -637,6 +641,64 @@ def test_extract_structured_data_with_chunking(provider, provider_model, pipelin
     assert extracted_data == '{"name": "james"}'
 
 
+@django_db_with_data(available_apps=("apps.service_providers", "apps.experiments"))
+@mock.patch("apps.pipelines.nodes.base.PipelineNode.logger", mock.Mock())
+def test_extract_structured_data_concurrently(provider, provider_model, pipeline):
+    session = ExperimentSessionFactory()
+    llm = FakeLlmSimpleTokenCount(
+        responses=[
+            {"name": "james", "drink": None},
+            {"name": None, "drink": "martini"},
+            {"name": None, "drink": None},
+        ]
+    )
+    service = build_fake_llm_service(responses=[], token_counts=[0], fake_llm=llm)
+    data_schema = '{"name": "the name of the user", "drink": "the user\'s favourite drink"}'
+    nodes = [
+        start_node(),
+        extract_structured_data_node(
+            str(provider.id), str(provider_model.id), data_schema, extraction_mode="concurrent", max_concurrency=2
+        ),
+        end_node(),
+    ]
+
+    with (
+        mock.patch("apps.service_providers.models.LlmProvider.get_llm_service", return_value=service),
+        mock.patch(
+            "apps.pipelines.nodes.nodes.ExtractStructuredData.chunk_messages",
+            return_value=["I am james", "I drink martinis", "shaken not stirred"],
+        ),
+        # run the chunks in order so that the fake LLM responses are predictable
+        patch_executor(),
+    ):
+        state = PipelineState(messages=["ai: hi user\nhuman: I am james"], experiment_session=session)
+        extracted_data = create_runnable(pipeline, nodes).invoke(state)["messages"][-1]
+
+    # every chunk is extracted with the original reference data
+    for messages in llm.get_call_messages():
+        assert "\nCurrent user data:\n\nConversation history:" in messages[0].text
+
+    assert json.loads(extracted_data) == {"name": "james", "drink": "martini"}
+
+
+@pytest.mark.parametrize(
+    ("left", "right", "expected"),
+    [
+        ({"name": "james"}, {"name": None}, {"name": "james"}),
+        ({"name": None}, {"name": "james"}, {"name": "james"}),
+        ({"name": "james"}, {"name": "bond"}, {"name": "bond"}),
+        (
+            {"pets": [{"name": "fido"}]},
+            {"pets": [{"name": "fido"}, {"name": "rex"}]},
+            {"pets": [{"name": "fido"}, {"name": "rex"}]},
+        ),
+        ({"name": "james"}, {"drink": "martini"}, {"name": "james", "drink": "martini"}),
+    ],
+)
+def test_merge_extracted_data(left, right, expected):
+    assert merge_extracted_data(left, right) == expected
+
+
 @django_db_with_data(available_apps=("apps.service_providers", "apps.experiments"))
 @mock.patch("apps.pipelines.nodes.base.PipelineNode.logger", mock.Mock())
 def test_extract_participant_data(provider, pipeline):
@@ -975,10 +1037,177 @@ def test_parallel_nodes(pipeline):
         },
     ]
 
-    with pytest.raises(PipelineBuildError, match="Multiple edges connected to the same output"):
+    with pytest.raises(PipelineBuildError, match="Parallel branches must be joined by a Merge node"):
         create_runnable(pipeline, nodes, edges, lenient=False)
 
 
+def _edge(source: dict, target: dict, source_handle: str | None = None) -> dict:
+    edge = {"id": f"{source['id']} -> {target['id']}", "source": source["id"], "target": target["id"]}
+    if source_handle:
+        edge["sourceHandle"] = source_handle
+    return edge
+
+
+@django_db_with_data(available_apps=("apps.service_providers",))
+@mock.patch("apps.pipelines.nodes.base.PipelineNode.logger", mock.Mock())
+def test_parallel_branches_are_merged(pipeline):
+    """
+    start -+-> template A ---------------> merge --> end
+           |                                 ^
+           +-> template B --> template C ----+
+    """
+    start = start_node()
+    template_a = render_template_node("A ({{ input }})")
+    template_b = render_template_node("B ({{ input }})")
+    template_c = render_template_node("C ({{ input }})")
+    merge = merge_node(separator=" | ")
+    end = end_node()
+    nodes = [start, template_a, template_b, template_c, merge, end]
+    edges = [
+        _edge(start, template_a),
+        _edge(start, template_b),
+        _edge(template_b, template_c),
+        _edge(template_a, merge),
+        _edge(template_c, merge),
+        _edge(merge, end),
+    ]
+
+    output = create_runnable(pipeline, nodes, edges).invoke(PipelineState(messages=["in"]))
+    assert output["messages"][-1] == "A (in) | C (B (in))"
+    # the end node only runs once
+    assert output["outputs"][end["id"]] == {"message": "A (in) | C (B (in))"}
+
+
+@django_db_with_data(available_apps=("apps.service_providers",))
+@mock.patch("apps.pipelines.nodes.base.PipelineNode.logger", mock.Mock())
+def test_parallel_branches_run_concurrently(pipeline):
+    code = "import time\ndef main(input, **kwargs):\n\ttime.sleep(0.5)\n\treturn input"
+    start = start_node()
+    branches = [code_node(code) for _ in range(3)]
+    merge = merge_node()
+    end = end_node()
+    nodes = [start, *branches, merge, end]
+    edges = [_edge(start, branch) for branch in branches]
+    edges += [_edge(branch, merge) for branch in branches]
+    edges.append(_edge(merge, end))
+
+    runnable = create_runnable(pipeline, nodes, edges)
+    start_time = time.monotonic()
+    runnable.invoke(PipelineState(messages=["in"], experiment_session=ExperimentSession()))
+    assert time.monotonic() - start_time < 1.2
+
+
+@django_db_with_data(available_apps=("apps.service_providers",))
+def test_parallel_branches_must_merge_before_end(pipeline):
+    """The end node would run twice since it is reached from both the merge node and the second branch
+
+    start -+-> passthrough 1 --> merge --> end
+           |                       ^        ^
+           +-> passthrough 2 ------+--------+
+    """
+    start = start_node()
+    passthrough_1 = passthrough_node()
+    passthrough_2 = passthrough_node()
+    merge = merge_node()
+    end = end_node()
+    nodes = [start, passthrough_1, passthrough_2, merge, end]
+    edges = [
+        _edge(start, passthrough_1),
+        _edge(start, passthrough_2),
+        _edge(passthrough_1, merge),
+        _edge(passthrough_2, merge),
+        _edge(merge, end),
+        _edge(passthrough_2, end),
+    ]
+
+    with pytest.raises(PipelineBuildError, match="Parallel branches must be joined by a Merge node"):
+        create_runnable(pipeline, nodes, edges)
+
+
+@django_db_with_data(available_apps=("apps.service_providers",))
+@mock.patch("apps.pipelines.nodes.base.PipelineNode.logger", mock.Mock())
+@pytest.mark.parametrize(("message", "expected"), [("hello", "X (hello | hello)"), ("bye", "Y (bye | bye)")])
+def test_router_after_merge(pipeline, message, expected):
+    """The router's outputs meet again at the end node, after the parallel branches have been merged
+
+    start -+-> passthrough 1 --> merge --> router -+-> template X --> end
+           |                       ^               |                  ^
+           +-> passthrough 2 ------+               +-> template Y ----+
+    """
+    start = start_node()
+    passthrough_1 = passthrough_node()
+    passthrough_2 = passthrough_node()
+    merge = merge_node(separator=" | ")
+    router = boolean_node(input_equals="hello | hello")
+    template_x = render_template_node("X ({{ input }})")
+    template_y = render_template_node("Y ({{ input }})")
+    end = end_node()
+    nodes = [start, passthrough_1, passthrough_2, merge, router, template_x, template_y, end]
+    edges = [
+        _edge(start, passthrough_1),
+        _edge(start, passthrough_2),
+        _edge(passthrough_1, merge),
+        _edge(passthrough_2, merge),
+        _edge(merge, router),
+        _edge(router, template_x, "output_0"),
+        _edge(router, template_y, "output_1"),
+        _edge(template_x, end),
+        _edge(template_y, end),
+    ]
+
+    output = create_runnable(pipeline, nodes, edges).invoke(PipelineState(messages=[message]))
+    assert output["messages"][-1] == expected
+
+
+@django_db_with_data(available_apps=("apps.service_providers",))
+def test_router_cannot_be_used_in_merged_branch(pipeline):
+    """The merge node would never run if the router takes output 1
+
+    start -+-> passthrough -------------------> merge --> end
+           |                                      ^        ^
+           +-> router -+-> template --------------+        |
+                       |                                   |
+                       +-----------------------------------+
+    """
+    start = start_node()
+    passthrough = passthrough_node()
+    router = boolean_node()
+    template = render_template_node("{{ input }}")
+    merge = merge_node()
+    end = end_node()
+    nodes = [start, passthrough, router, template, merge, end]
+    edges = [
+        _edge(start, passthrough),
+        _edge(start, router),
+        _edge(passthrough, merge),
+        _edge(router, template, "output_0"),
+        _edge(router, end, "output_1"),
+        _edge(template, merge),
+        _edge(merge, end),
+    ]
+
+    with pytest.raises(PipelineBuildError, match="Router nodes can't be used in parallel branches"):
+        create_runnable(pipeline, nodes, edges)
+
+
+@django_db_with_data(available_apps=("apps.service_providers",))
+def test_merge_node_cannot_follow_router_outputs(pipeline):
+    start = start_node()
+    router = boolean_node()
+    merge = merge_node()
+    end = end_node()
+    nodes = [start, router, merge, end]
+    edges = [
+        _edge(start, router),
+        _edge(router, merge, "output_0"),
+        _edge(router, end, "output_1"),
+        _edge(merge, end),
+    ]
+
+    with pytest.raises(PipelineBuildError, match="Merge nodes can only join parallel branches"):
+        create_runnable(pipeline, nodes, edges)
+
+
 @django_db_with_data(available_apps=("apps.service_providers",))
 def test_multiple_valid_inputs(pipeline):
     """This tests the case where a node has multiple valid inputs to make sure it selects the correct one.
@@ -124,6 +124,17 @@ def passthrough_node():
     }
 
 
+def merge_node(separator: str | None = None):
+    params = {"name": "merge"}
+    if separator is not None:
+        params["separator"] = separator
+    return {
+        "id": str(uuid4()),
+        "type": nodes.MergeNode.__name__,
+        "params": params,
+    }
+
+
 def boolean_node(input_equals="hello"):
     return {
         "id": str(uuid4()),
@@ -184,7 +195,7 @@ def extract_participant_data_node(provider_id: str, provider_model_id: str, data
     }
 
 
-def extract_structured_data_node(provider_id: str, provider_model_id: str, data_schema: str):
+def extract_structured_data_node(provider_id: str, provider_model_id: str, data_schema: str, **kwargs):
     return {
         "id": str(uuid4()),
         "type": nodes.ExtractStructuredData.__name__,
@@ -193,6 +204,7 @@ def extract_structured_data_node(provider_id: str, provider_model_id: str, data_
             "llm_provider_id": provider_id,
             "llm_provider_model_id": provider_model_id,
             "data_schema": data_schema,
+            **kwargs,
         },
     }
 
@@ -6,7 +6,15 @@ from apps.assistants.models import OpenAiAssistant
 from apps.experiments.models import Experiment
 from apps.pipelines.models import Node
 
-from .models import LlmProvider, LlmProviderModel, MessagingProvider, TraceProvider, VoiceProvider
+from .models import (
+    LlmProvider,
+    LlmProviderModel,
+    MessagingProvider,
+    SpeechCacheEntry,
+    SpeechCacheStats,
+    TraceProvider,
+    VoiceProvider,
+)
 
 
 @admin.register(LlmProvider)
@@ -68,6 +76,23 @@ class VoiceProviderAdmin(admin.ModelAdmin):
     list_filter = ("team", "type")
 
 
+@admin.register(SpeechCacheEntry)
+class SpeechCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ("key", "team", "voice_provider", "format", "size", "hit_count", "last_used_at")
+    list_filter = ("team",)
+    readonly_fields = ("key", "voice_provider", "file", "format", "duration", "size", "hit_count", "last_used_at")
+
+
+@admin.register(SpeechCacheStats)
+class SpeechCacheStatsAdmin(admin.ModelAdmin):
+    list_display = ("team", "hits", "misses", "hit_rate")
+    readonly_fields = ("team", "hits", "misses")
+
+    @admin.display(description="Hit rate")
+    def hit_rate(self, obj):
+        return f"{obj.hit_rate:.0%}"
+
+
 @admin.register(MessagingProvider)
 class MessagingProviderAdmin(admin.ModelAdmin):
     list_display = ("name", "team", "type")
@@ -1,3 +1,4 @@
+from http.cookiejar import CookieJar, DefaultCookiePolicy
 from typing import Any
 
 import httpx
@@ -5,20 +6,37 @@ import pydantic
 import tenacity
 
 from apps.service_providers.auth_service.schemes import CommCareAuth, HeaderAuth
+from apps.service_providers.client_pool import client_pool
 
 
 class AuthService(pydantic.BaseModel):
     def get_http_client(self) -> httpx.Client:
+        """Return a client from the shared pool so that connections are kept alive between requests.
+
+        Clients are shared by all auth services with the same type and credentials (including the anonymous auth
+        service used by every team) so they don't keep cookies between requests. They must not be closed by the
+        caller."""
+        return client_pool.get("httpx", self._get_pool_config(), self.create_http_client, close=httpx.Client.close)
+
+    def create_http_client(self) -> httpx.Client:
         kwargs = {
             **self._get_http_client_kwargs(),
             "timeout": 10,
             "limits": httpx.Limits(max_keepalive_connections=5, max_connections=10),
+            # reject all cookies so that they can't leak between the users of a shared client
+            "cookies": CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
         }
         return httpx.Client(**kwargs)
 
     def _get_http_client_kwargs(self) -> dict:
         return {}
 
+    def _get_pool_config(self) -> dict:
+        config = {
+            name: value.get_secret_value() if isinstance(value, pydantic.SecretStr) else value for name, value in self
+        }
+        return {"auth_service": type(self).__name__, **config}
+
     def call_with_retries(self, func, *args, **kwargs) -> Any:
         controller = self.get_retry_controller()
         if controller:
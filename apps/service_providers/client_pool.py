@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections.abc import Callable
+from threading import RLock
+from typing import Any, TypeVar
+
+logger = logging.getLogger("ocs.client_pool")
+
+T = TypeVar("T")
+
+
+class ClientPool:
+    """Shares long-lived API clients between service instances so that connections (TLS sessions, HTTP keep-alive)
+    are reused across messages in a worker.
+
+    Clients are keyed by the client type and a hash of the config used to create them. A background thread removes
+    clients that haven't been used for `stale_timeout` seconds, as well as the least recently used clients when there
+    are more than `max_clients`. This is modelled on the langfuse `ClientManager`.
+
+    Removed clients are not closed since they may still be in use by a caller that got them from the pool earlier.
+    They are cleaned up when they are garbage collected. Clients are only closed by `clear`.
+
+    Usage:
+
+        client = client_pool.get("twilio", {"account_sid": sid, "auth_token": token}, lambda: Client(sid, token))
+    """
+
+    def __init__(self, stale_timeout=300, prune_interval=60, max_clients=50) -> None:
+        self.clients: dict[str, tuple[float, Any, Callable | None]] = {}
+        self.stale_timeout = stale_timeout
+        self.max_clients = max_clients
+        self.prune_interval = prune_interval
+        self.lock = RLock()
+        self._start_prune_thread()
+
+    def get(self, client_type: str, config: dict, factory: Callable[[], T], close: Callable[[T], Any] = None) -> T:
+        """Return the pooled client for the config or create one with `factory`.
+
+        Args:
+            client_type: Identifies the kind of client. Clients with the same config but different types are
+                kept separately.
+            config: The values used to create the client. Only a hash of the config is stored.
+            factory: Creates a new client.
+            close: Called with the client when the pool is cleared or if it isn't added to the pool because another
+                thread created a client with the same config first.
+        """
+        key = self._get_key(client_type, config)
+        with self.lock:
+            if key in self.clients:
+                _, client, close = self.clients[key]
+                self.clients[key] = (time.time(), client, close)
+                return client
+
+        # Create the client without holding the lock since creating some clients makes network requests
+        logger.debug("Creating new %s client with key '%s'", client_type, key)
+        new_client = factory()
+        with self.lock:
+            if key in self.clients:
+                # Another thread created a client with the same key in the meantime
+                _, client, existing_close = self.clients[key]
+                self.clients[key] = (time.time(), client, existing_close)
+            else:
+                client = new_client
+                self.clients[key] = (time.time(), client, close)
+
+        if client is not new_client and close:
+            try:
+                close(new_client)
+            except Exception:
+                logger.exception("Error closing client with key '%s'", key)
+        return client
+
+    def _get_key(self, client_type: str, config: dict) -> str:
+        serialized = json.dumps(config, sort_keys=True, default=str)
+        return f"{client_type}:{hashlib.sha256(serialized.encode()).hexdigest()}"
+
+    def _start_prune_thread(self):
+        self._prune_thread = threading.Thread(target=self._prune_worker, daemon=True)
+        self._prune_thread.start()
+
+    def _prune_worker(self):
+        while True:
+            time.sleep(self.prune_interval)
+            self._prune_stale()
+
+    def _prune_stale(self):
+        if not self.clients:
+            return
+
+        with self.lock:
+            now = time.time()
+            stale_keys = [key for key, (timestamp, *_) in self.clients.items() if now - timestamp > self.stale_timeout]
+            for key in stale_keys:
+                logger.debug("Pruning old client with key '%s'", key)
+                self.clients.pop(key)
+
+            if len(self.clients) > self.max_clients:
+                # remove the oldest clients until we are below the max
+                sorted_keys = sorted(self.clients, key=lambda key: self.clients[key][0])
+                keys_to_remove = sorted_keys[: len(self.clients) - self.max_clients]
+                logger.debug("Pruned %d clients above max limit", len(keys_to_remove))
+                for key in keys_to_remove:
+                    self.clients.pop(key)
+
+    def clear(self):
+        """Remove and close all clients. This should only be used when none of the clients are in use."""
+        with self.lock:
+            clients = list(self.clients.items())
+            self.clients.clear()
+        for key, (_, client, close) in clients:
+            if close:
+                try:
+                    close(client)
+                except Exception:
+                    logger.exception("Error closing client with key '%s'", key)
+
+
+client_pool = ClientPool()
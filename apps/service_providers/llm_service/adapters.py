@@ -19,7 +19,7 @@ from langchain_core.prompts import PromptTemplate, get_template_variables
 from langchain_core.tools import BaseTool
 
 from apps.assistants.models import OpenAiAssistant, ToolResources
-from apps.chat.agent.tools import get_assistant_tools, get_tools
+from apps.chat.agent.tools import ToolConfig, get_assistant_tools, get_tools
 from apps.chat.models import Chat
 from apps.experiments.models import Experiment, ExperimentSession
 from apps.files.models import File
@@ -88,7 +88,9 @@ class ChatAdapter(BaseAdapter):
         self.save_message_metadata_only = save_message_metadata_only
 
     @classmethod
-    def for_experiment(cls, experiment: Experiment, session: ExperimentSession) -> Self:
+    def for_experiment(
+        cls, experiment: Experiment, session: ExperimentSession, tool_config: ToolConfig | None = None
+    ) -> Self:
         return cls(
             session=session,
             provider_model_name=experiment.get_llm_provider_model_name(),
@@ -96,7 +98,7 @@ class ChatAdapter(BaseAdapter):
             temperature=experiment.temperature,
             prompt_text=experiment.prompt_text,
             max_token_limit=experiment.max_token_limit,
-            tools=get_tools(session, experiment=experiment),
+            tools=get_tools(session, experiment=experiment, tool_config=tool_config),
             disabled_tools=None,  # not supported for simple experiments
             input_formatter=experiment.input_formatter,
             source_material_id=experiment.source_material_id,
@@ -136,12 +138,6 @@ class ChatAdapter(BaseAdapter):
     def get_prompt(self):
         return self.prompt_text
 
-    def check_cancellation(self):
-        self.session.chat.refresh_from_db(fields=["metadata"])
-        # temporary mechanism to cancel the chat
-        # TODO: change this to something specific to the current chat message
-        return self.session.chat.metadata.get("cancelled", False)
-
 
 class AssistantAdapter(BaseAdapter):
     def __init__(
@@ -152,6 +148,7 @@ class AssistantAdapter(BaseAdapter):
         input_formatter: str | None = None,
         save_message_metadata_only: bool = False,
         disabled_tools: set[str] = None,
+        tool_config: ToolConfig | None = None,
     ):
         self.session = session
         self.assistant = assistant
@@ -163,18 +160,21 @@ class AssistantAdapter(BaseAdapter):
         self.provider_model_name = assistant.llm_provider_model.name
         self.team = session.team
 
-        self.tools = get_assistant_tools(assistant, experiment_session=session)
+        self.tools = get_assistant_tools(assistant, experiment_session=session, tool_config=tool_config)
         self.disabled_tools = disabled_tools
         self.template_context = PromptTemplateContext(session, source_material_id=None)
 
     @classmethod
-    def for_experiment(cls, experiment: Experiment, session: ExperimentSession) -> Self:
+    def for_experiment(
+        cls, experiment: Experiment, session: ExperimentSession, tool_config: ToolConfig | None = None
+    ) -> Self:
         return cls(
             session=session,
             assistant=experiment.assistant,
             citations_enabled=experiment.citations_enabled,
             input_formatter=experiment.input_formatter,
             disabled_tools=None,  # not supported for simple experiments
+            tool_config=tool_config,
         )
 
     @classmethod
@@ -5,8 +5,9 @@ from typing import Self
 
 from langchain_core.language_models.chat_models import BaseChatModel
 
-from apps.annotations.models import Tag, TagCategories
+from apps.annotations.models import TagCategories
 from apps.chat.conversation import compress_chat_history, compress_pipeline_chat_history
+from apps.chat.history import HistoryMessage, save_messages_to_history
 from apps.chat.models import ChatMessage, ChatMessageType
 from apps.experiments.models import Experiment, ExperimentSession
 from apps.pipelines.models import PipelineChatHistory, PipelineChatHistoryTypes
@@ -90,16 +91,15 @@ class ExperimentHistoryManager(BaseHistoryManager):
         experiment_tag: str,
         output_message_metadata: dict,
     ):
+        messages = []
         if save_input_to_history:
-            self.save_message_to_history(input, type_=ChatMessageType.HUMAN, message_metadata=input_message_metadata)
+            messages.append(self._make_history_message(input, ChatMessageType.HUMAN, input_message_metadata))
 
         if output is not None and save_output_to_history:
-            self.save_message_to_history(
-                output,
-                type_=ChatMessageType.AI,
-                message_metadata=output_message_metadata,
-                experiment_tag=experiment_tag,
+            messages.append(
+                self._make_history_message(output, ChatMessageType.AI, output_message_metadata, experiment_tag)
             )
+        self.save_messages_to_history(messages)
 
     def save_message_to_history(
         self,
@@ -113,31 +113,35 @@ class ExperimentHistoryManager(BaseHistoryManager):
         chat message metadata.
         Example resource_file_mapping: {"resource1": ["file1", "file2"], "resource2": ["file3", "file4"]}
         """
-        metadata = self.get_trace_metadata()
-        metadata = metadata | (message_metadata or {})
-        chat_message = ChatMessage.objects.create(
-            chat=self.session.chat,
-            message_type=type_.value,
-            content=message,
-            metadata=metadata,
+        [chat_message] = self.save_messages_to_history(
+            [self._make_history_message(message, type_, message_metadata, experiment_tag)]
         )
+        return chat_message
 
-        if experiment_tag:
-            tag, _ = Tag.objects.get_or_create(
-                name=experiment_tag,
-                team=self.session.team,
-                is_system_tag=True,
-                category=TagCategories.BOT_RESPONSE,
-            )
-            chat_message.add_tag(tag, team=self.session.team, added_by=None)
+    def save_messages_to_history(self, messages: list[HistoryMessage]) -> list[ChatMessage]:
+        """Save the messages in bulk. See `apps.chat.history`."""
+        chat_messages = save_messages_to_history(self.session, messages)
+        for message, chat_message in zip(messages, chat_messages, strict=True):
+            if message.message_type == ChatMessageType.AI:
+                self.ai_message = chat_message
+        return chat_messages
 
+    def _make_history_message(
+        self,
+        message: str,
+        type_: ChatMessageType,
+        message_metadata: dict | None = None,
+        experiment_tag: str | None = None,
+    ) -> HistoryMessage:
+        system_tags = []
+        if experiment_tag:
+            system_tags.append((experiment_tag, TagCategories.BOT_RESPONSE))
         if type_ == ChatMessageType.AI:
-            self.ai_message = chat_message
-            chat_message.add_version_tag(
-                version_number=self.experiment_version_number, is_a_version=self.experiment_is_a_version
-            )
+            version_tag = ChatMessage.get_version_tag_name(self.experiment_version_number, self.experiment_is_a_version)
+            system_tags.append((version_tag, TagCategories.EXPERIMENT_VERSION))
 
-        return chat_message
+        metadata = self.get_trace_metadata() | (message_metadata or {})
+        return HistoryMessage(content=message, message_type=type_, metadata=metadata, system_tags=system_tags)
 
     def get_trace_metadata(self) -> dict:
         if self.trace_service:
@@ -31,6 +31,13 @@ class OpenAIAssistantRunnable(BrokenOpenAIAssistantRunnable):
     # and updated so that the thread API gets an `attachments` key instead of the previous `file_ids` key.
     # TODO: Here's a PR that tries to fix it in LangChain: https://github.com/langchain-ai/langchain/pull/21484
 
+    cancellation_event: Any = None
+    """Optional `threading.Event`. When set, the active run will be cancelled. See `apps.chat.cancellation`."""
+
+    token_callback: Any = None
+    """Optional callable. When set, runs are streamed and the callable is called with each chunk of the response
+    text as it is generated. Otherwise the run is polled until it completes."""
+
     def invoke(self, input: dict, config: RunnableConfig | None = None):
         config = ensure_config(config)
         callback_manager = CallbackManager.configure(
@@ -43,7 +50,7 @@ class OpenAIAssistantRunnable(BrokenOpenAIAssistantRunnable):
             # Being run within AgentExecutor and there are tool outputs to submit.
             if self.as_agent and input.get("intermediate_steps"):
                 tool_outputs = self._parse_intermediate_steps(input["intermediate_steps"])
-                run = self.client.beta.threads.runs.submit_tool_outputs(**tool_outputs)
+                run = self._run(self.client.beta.threads.runs.submit_tool_outputs, **tool_outputs)
             # Starting a new thread and a new run.
             elif "thread_id" not in input:
                 thread = {
@@ -57,22 +64,22 @@ class OpenAIAssistantRunnable(BrokenOpenAIAssistantRunnable):
                     ],
                     "metadata": input.get("thread_metadata"),
                 }
-                run = self._create_thread_and_run(input, thread)
-            # Starting a new run in an existing thread.
+                run = self._run(self._create_thread_and_run, input, thread)
+            # Starting a new run in an existing thread. The input message is added to the thread when the run is
+            # created, after any `additional_messages`.
             elif "run_id" not in input:
-                _ = self.client.beta.threads.messages.create(
-                    input["thread_id"],
-                    content=input["content"],
-                    role="user",
-                    attachments=input.get("attachments", {}),
-                    metadata=input.get("message_metadata"),
-                )
-                run = self._create_run(input)
+                message = {
+                    "role": "user",
+                    "content": input["content"],
+                    "attachments": input.get("attachments", {}),
+                    "metadata": input.get("message_metadata"),
+                }
+                additional_messages = [*input.get("additional_messages", []), message]
+                run = self._run(self._create_run, {**input, "additional_messages": additional_messages})
             # Submitting tool outputs to an existing run, outside the AgentExecutor
             # framework.
             else:
-                run = self.client.beta.threads.runs.submit_tool_outputs(**input)
-            run = self._wait_for_run(run.id, run.thread_id)
+                run = self._run(self.client.beta.threads.runs.submit_tool_outputs, **input)
         except BaseException as e:
             run_manager.on_chain_error(e)
             raise e
@@ -85,13 +92,68 @@ class OpenAIAssistantRunnable(BrokenOpenAIAssistantRunnable):
             run_manager.on_chain_end(response)
             return response
 
+    def _create_run(self, input: dict, **kwargs) -> Any:
+        run_params = ("instructions", "model", "tools", "run_metadata", "additional_messages")
+        params = {k: v for k, v in input.items() if k in run_params}
+        return self.client.beta.threads.runs.create(
+            input["thread_id"], assistant_id=self.assistant_id, **params, **kwargs
+        )
+
+    def _create_thread_and_run(self, input: dict, thread: dict, **kwargs) -> Any:
+        params = {k: v for k, v in input.items() if k in ("instructions", "model", "tools", "run_metadata")}
+        return self.client.beta.threads.create_and_run(
+            assistant_id=self.assistant_id, thread=thread, **params, **kwargs
+        )
+
+    def _run(self, create_run, *args, **kwargs) -> Any:
+        """Start a run with `create_run` and return it once it is no longer in progress."""
+        if self.token_callback is None:
+            run = create_run(*args, **kwargs)
+            return self._wait_for_run(run.id, run.thread_id)
+
+        with create_run(*args, **kwargs, stream=True) as stream:
+            run = self._consume_stream(stream)
+        if run is None:
+            raise ValueError("Run stream ended without returning a run")
+        if run.status in ("in_progress", "queued"):
+            # The stream was stopped early because the run was cancelled or the connection was closed
+            return self._wait_for_run(run.id, run.thread_id)
+        return run
+
+    def _consume_stream(self, stream) -> Any:
+        """Forward text deltas to `token_callback` and return the last run received from the stream."""
+        run = None
+        for event in stream:
+            if event.event == "error":
+                raise ValueError(f"Error streaming run: {event.data.message}")
+            elif event.event == "thread.message.delta":
+                for content in event.data.delta.content or []:
+                    if content.type == "text" and content.text and content.text.value:
+                        self.token_callback(content.text.value)
+            elif getattr(event.data, "object", None) == "thread.run":
+                run = event.data
+
+            if run and self.cancellation_event is not None and self.cancellation_event.is_set():
+                # `_wait_for_run` cancels the run
+                break
+        return run
+
     def _wait_for_run(self, run_id: str, thread_id: str, progress_states=("in_progress", "queued")) -> Any:
-        in_progress = True
-        while in_progress:
+        cancel_requested = False
+        while True:
             run = self.client.beta.threads.runs.retrieve(run_id, thread_id=thread_id)
-            in_progress = run.status in progress_states
-            if in_progress:
+            if run.status not in progress_states:
+                break
+
+            if self.cancellation_event is None or cancel_requested:
                 sleep(self.check_every_ms / 1000)
+            elif self.cancellation_event.is_set():
+                self.client.beta.threads.runs.cancel(run_id, thread_id=thread_id)
+                cancel_requested = True
+                # don't wait for the cancellation to complete
+                progress_states = tuple(state for state in progress_states if state != "cancelling")
+            else:
+                self.cancellation_event.wait(self.check_every_ms / 1000)
         return run
 
 
@@ -1,3 +1,5 @@
+import copy
+import threading
 from typing import Any, Self
 
 from django.utils import timezone
@@ -6,6 +8,18 @@ from apps.channels.models import ChannelPlatform
 from apps.experiments.models import ParticipantData
 from apps.utils.time import pretty_date
 
+# The shared proxy for a turn is stored on the session instance
+SHARED_PROXY_ATTR = "_participant_data_proxy"
+
+# Number of times to re-apply changes to participant data that was updated concurrently before giving up
+MAX_FLUSH_ATTEMPTS = 3
+
+_shared_proxy_lock = threading.Lock()
+
+
+class ParticipantDataConflict(Exception):
+    pass
+
 
 class PromptTemplateContext:
     def __init__(self, session, source_material_id: int = None, collection_id: int = None):
@@ -13,7 +27,7 @@ class PromptTemplateContext:
         self.source_material_id = source_material_id
         self.collection_id = collection_id
         self.context_cache = {}
-        self.participant_data_proxy = ParticipantDataProxy(self.session)
+        self.participant_data_proxy = ParticipantDataProxy.for_session(self.session)
 
     @property
     def factories(self):
@@ -164,37 +178,116 @@ EMPTY = SafeAccessWrapper(None)
 
 
 class ParticipantDataProxy:
-    """Allows multiple access without needing to re-fetch from the DB"""
+    """Allows multiple access without needing to re-fetch from the DB.
 
-    def __init__(self, experiment_session):
+    Everything that runs during a turn should use the proxy returned by `for_session` so that the participant data
+    is only loaded and decrypted once. Changes made through that proxy are kept in memory and saved by `end_turn`.
+    Proxies created directly save changes straight away.
+    """
+
+    def __init__(self, experiment_session, write_behind=False):
         self.session = experiment_session
+        self.write_behind = write_behind
         self._participant_data = None
+        self._loaded_data = None
+        self._global_data = None
         self._scheduled_messages = None
+        self._has_changes = False
+        self.lock = threading.RLock()
 
     @classmethod
     def from_state(cls, pipeline_state) -> Self:
         # using `.get` here for the sake of tests. In practice the session should always be present
-        return cls(pipeline_state.get("experiment_session"))
+        session = pipeline_state.get("experiment_session")
+        if session is None:
+            return cls(session)
+        return cls.for_session(session)
+
+    @classmethod
+    def for_session(cls, experiment_session) -> Self:
+        """Return the proxy that is shared by everything that runs during the session's current turn"""
+        with _shared_proxy_lock:
+            proxy = experiment_session.__dict__.get(SHARED_PROXY_ATTR)
+            if proxy is None:
+                proxy = cls(experiment_session, write_behind=True)
+                experiment_session.__dict__[SHARED_PROXY_ATTR] = proxy
+            return proxy
+
+    @classmethod
+    def end_turn(cls, experiment_session):
+        """Save the changes made through the session's shared proxy and discard it so that the next turn loads the
+        latest data"""
+        with _shared_proxy_lock:
+            proxy = experiment_session.__dict__.pop(SHARED_PROXY_ATTR, None)
+        if proxy:
+            proxy.flush()
 
     def _get_db_object(self):
-        if not self._participant_data:
-            self._participant_data, _ = ParticipantData.objects.get_or_create(
-                participant_id=self.session.participant_id,
-                experiment_id=self.session.experiment_id,
-                team_id=self.session.team_id,
-            )
-        return self._participant_data
+        with self.lock:
+            if not self._participant_data:
+                self._participant_data, _ = ParticipantData.objects.get_or_create(
+                    participant_id=self.session.participant_id,
+                    experiment_id=self.session.experiment_id,
+                    team_id=self.session.team_id,
+                )
+                self._loaded_data = copy.deepcopy(self._participant_data.data)
+            return self._participant_data
+
+    def _get_global_data(self):
+        if self._global_data is None:
+            self._global_data = self.session.participant.global_data
+        return self._global_data
 
-    def get(self):
+    def get(self, include_global_data=True):
         data = self._get_db_object().data
-        return self.session.participant.global_data | data
+        if not include_global_data:
+            return data
+        return self._get_global_data() | data
 
     def set(self, data):
         if not isinstance(data, dict):
             raise ValueError("Data must be a dictionary")
-        participant_data = self._get_db_object()
-        participant_data.data = data
-        participant_data.save(update_fields=["data"])
+        with self.lock:
+            self._get_db_object().data = data
+            self._has_changes = True
+        if not self.write_behind:
+            self.flush()
+
+    def update(self, data: dict):
+        """Merge `data` into the participant data"""
+        with self.lock:
+            self.set(self._get_db_object().data | data)
+
+    def flush(self):
+        """Save any changes to the participant data.
+
+        The record's `updated_at` is used to detect writes made elsewhere since the data was loaded. If there were any,
+        the keys that were changed through this proxy are applied to the latest data instead of overwriting it.
+        """
+        with self.lock:
+            if not self._has_changes:
+                return
+
+            participant_data = self._participant_data
+            data = participant_data.data
+            for _attempt in range(MAX_FLUSH_ATTEMPTS):
+                updated_at = timezone.now()
+                updated = ParticipantData.objects.filter(
+                    id=participant_data.id, updated_at=participant_data.updated_at
+                ).update(data=data, updated_at=updated_at)
+                if updated:
+                    break
+
+                latest = ParticipantData.objects.only("data", "updated_at").get(id=participant_data.id)
+                data = _apply_changes(latest.data, self._loaded_data, participant_data.data)
+                participant_data.updated_at = latest.updated_at
+            else:
+                raise ParticipantDataConflict(f"Unable to save participant data {participant_data.id}")
+
+            participant_data.data = data
+            participant_data.updated_at = updated_at
+            self._loaded_data = copy.deepcopy(data)
+            self._has_changes = False
 
         self.session.participant.update_name_from_data(data)
 
@@ -226,3 +319,14 @@ class ParticipantDataProxy:
         """Returns the participant's timezone"""
         participant_data = self._get_db_object()
         return participant_data.data.get("timezone")
+
+
+def _apply_changes(latest: dict, original: dict, changed: dict) -> dict:
+    """Apply the top level keys that differ between `original` and `changed` to `latest`"""
+    data = latest.copy()
+    for key in original.keys() - changed.keys():
+        data.pop(key, None)
+    for key, value in changed.items():
+        if key not in original or original[key] != value:
+            data[key] = value
+    return data
@@ -4,6 +4,7 @@ import time
 from typing import TYPE_CHECKING, Any, Literal
 
 import openai
+from django.core.cache import cache
 from django.db import transaction
 from langchain.agents import AgentExecutor, create_tool_calling_agent
 from langchain.agents.openai_assistant.base import OpenAIAssistantFinish
@@ -22,6 +23,8 @@ from langchain_core.runnables.config import merge_configs
 from pydantic import ConfigDict
 
 from apps.chat.agent.openapi_tool import ToolArtifact
+from apps.chat.cancellation import cancellation_manager
+from apps.chat.streaming import SessionEvent, publish_session_event
 from apps.experiments.models import Experiment, ExperimentSession
 from apps.files.models import File
 from apps.service_providers.llm_service.adapters import AssistantAdapter, ChatAdapter
@@ -31,10 +34,18 @@ from apps.utils.prompt import OcsPromptTemplate
 
 if TYPE_CHECKING:
     from apps.channels.datamodels import Attachment
+    from apps.chat.agent.tools import ToolConfig
 
 logger = logging.getLogger("ocs.runnables")
 
 
+# The maximum number of messages that can be added to a thread when creating it
+MAX_THREAD_MESSAGES = 32
+
+# Time to cache the names of cited files that are only available from OpenAI
+CITED_FILE_NAME_CACHE_TIMEOUT = 60 * 60 * 24
+
+
 class GenerationError(Exception):
     pass
 
@@ -45,14 +56,20 @@ class GenerationCancelled(Exception):
 
 
 def create_experiment_runnable(
-    experiment: Experiment, session: ExperimentSession, disable_tools: bool = False, trace_service: Any = None
+    experiment: Experiment,
+    session: ExperimentSession,
+    disable_tools: bool = False,
+    trace_service: Any = None,
+    tool_config: "ToolConfig | None" = None,
 ):
-    """Create an experiment runnable based on the experiment configuration."""
+    """Create an experiment runnable based on the experiment configuration. `tool_config` is loaded from the
+    experiment (or its assistant) if it isn't given."""
 
     if assistant := experiment.assistant:
         history_manager = ExperimentHistoryManager.for_assistant(session=session, experiment=experiment)
-        assistant_adapter = AssistantAdapter.for_experiment(experiment, session)
-        if assistant.tools_enabled and not disable_tools:
+        assistant_adapter = AssistantAdapter.for_experiment(experiment, session, tool_config=tool_config)
+        tools_enabled = tool_config.tools_enabled if tool_config else assistant.tools_enabled
+        if tools_enabled and not disable_tools:
             runnable = AgentAssistantChat(adapter=assistant_adapter, history_manager=history_manager)
         else:
             runnable = AssistantChat(adapter=assistant_adapter, history_manager=history_manager)
@@ -72,8 +89,9 @@ def create_experiment_runnable(
         trace_service=trace_service,
     )
 
-    chat_adapter = ChatAdapter.for_experiment(experiment=experiment, session=session)
-    if experiment.tools_enabled and not disable_tools:
+    chat_adapter = ChatAdapter.for_experiment(experiment=experiment, session=session, tool_config=tool_config)
+    tools_enabled = tool_config.tools_enabled if tool_config else experiment.tools_enabled
+    if tools_enabled and not disable_tools:
         runnable = AgentLLMChat(adapter=chat_adapter, history_manager=history_manager)
     else:
         runnable = SimpleLLMChat(adapter=chat_adapter, history_manager=history_manager)
@@ -110,8 +128,6 @@ class LLMChat(RunnableSerializable[str, ChainOutput]):
     experiment: Experiment | None = None
     history: list[BaseMessage] = []
     cancelled: bool = False
-    last_cancel_check: float | None = None
-    check_every_ms: int = 1000
     input_key: str = "input"
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
@@ -129,6 +145,8 @@ class LLMChat(RunnableSerializable[str, ChainOutput]):
         save_input_to_history = configurable.get("save_input_to_history", True)
         save_output_to_history = configurable.get("save_output_to_history", True)
         experiment_tag = configurable.get("experiment_tag")
+        # Called before saving to history to decide whether the messages should be kept (see `TopicBot`)
+        should_save_to_history = configurable.get("should_save_to_history")
 
         try:
             if include_conversation_history:
@@ -140,6 +158,8 @@ class LLMChat(RunnableSerializable[str, ChainOutput]):
             if self.cancelled:
                 raise GenerationCancelled(result)
         finally:
+            if should_save_to_history and not should_save_to_history():
+                save_input_to_history = save_output_to_history = False
             self.history_manager.add_messages_to_history(
                 input=input,
                 save_input_to_history=save_input_to_history,
@@ -160,28 +180,21 @@ class LLMChat(RunnableSerializable[str, ChainOutput]):
 
         output = ""
         context = self._get_input_chain_context()
-        for token in chain.stream({**self._get_input(input), **context}, config):
-            output += self._parse_output(token)
-            if self._chat_is_cancelled():
-                return output
+        stream_to_session = config.get("configurable", {}).get("stream_to_session", False)
+        with cancellation_manager.track(self.adapter.session.chat_id) as cancelled:
+            for token in chain.stream({**self._get_input(input), **context}, config):
+                parsed_token = self._parse_output(token)
+                output += parsed_token
+                if stream_to_session and parsed_token:
+                    publish_session_event(self.adapter.session.id, SessionEvent.TOKEN, {"token": parsed_token})
+                if cancelled.is_set():
+                    self.cancelled = True
+                    return output
         return output
 
     def _parse_output(self, output):
         return output
 
-    def _chat_is_cancelled(self):
-        if self.cancelled:
-            return True
-
-        if self.last_cancel_check and self.check_every_ms:
-            if self.last_cancel_check + self.check_every_ms > time.time():
-                return False
-
-        self.last_cancel_check = time.time()
-
-        self.cancelled = self.adapter.check_cancellation()
-        return self.cancelled
-
     def _build_chain(self) -> Runnable[dict[str, Any], Any]:
         raise NotImplementedError
 
@@ -274,10 +287,12 @@ class AssistantChat(RunnableSerializable[dict, ChainOutput]):
                 "attachments": message_attachments,
             } | self._extra_input_configs()
 
-            current_thread_id = self._sync_messages_to_thread(self.adapter.thread_id)
+            current_thread_id, messages_to_sync = self._sync_messages_to_thread(self.adapter.thread_id)
 
             if current_thread_id:
                 input_dict["thread_id"] = current_thread_id
+            if messages_to_sync:
+                input_dict["additional_messages"] = messages_to_sync
             input_dict["instructions"] = self.adapter.get_assistant_instructions()
             thread_id, run_id = self._get_response_with_retries(merged_config, input_dict, current_thread_id)
             ai_message, annotation_file_ids = self._get_output_with_annotations(thread_id, run_id)
@@ -298,28 +313,33 @@ class AssistantChat(RunnableSerializable[dict, ChainOutput]):
             )
         return ChainOutput(output=ai_message, prompt_tokens=0, completion_tokens=0)
 
-    def _sync_messages_to_thread(self, current_thread_id):
-        """Sync any messages that need to be sent to the thread. Create a new thread if necessary
-        and return the thread ID.
+    def _sync_messages_to_thread(self, current_thread_id) -> tuple[str | None, list[dict]]:
+        """Sync any messages that need to be sent to the thread. Create a new thread if necessary.
 
         This is necessary in multi-bot setups if some of the bots are assistants but not all.
-        """
 
-        def _sync_messages_to_existing_thread(thread_id, messages):
-            for message in messages_to_sync:
-                self.adapter.assistant_client.beta.threads.messages.create(current_thread_id, **message)
+        To avoid an API call per message, messages are added when the thread is created or are returned so that
+        they can be added to the thread along with the input message when the run is created.
 
-        if messages_to_sync := self.adapter.get_messages_to_sync_to_thread():
-            if current_thread_id:
-                _sync_messages_to_existing_thread(current_thread_id, messages_to_sync)
-            else:
-                # There is a 32 message limit when creating a new thread
-                first, rest = messages_to_sync[:32], messages_to_sync[32:]
-                thread = self.adapter.assistant_client.beta.threads.create(messages=first)
-                current_thread_id = thread.id
-                _sync_messages_to_existing_thread(current_thread_id, rest)
-                self.adapter.update_thread_id(current_thread_id)
-        return current_thread_id
+        Returns the thread ID and the messages to add when creating the run.
+        """
+        messages_to_sync = self.adapter.get_messages_to_sync_to_thread()
+        if not messages_to_sync:
+            return current_thread_id, []
+
+        client = self.adapter.assistant_client
+        if not current_thread_id:
+            first, messages_to_sync = messages_to_sync[:MAX_THREAD_MESSAGES], messages_to_sync[MAX_THREAD_MESSAGES:]
+            thread = client.beta.threads.create(messages=first)
+            current_thread_id = thread.id
+            self.adapter.update_thread_id(current_thread_id)
+
+        # Leave room for the input message in the messages added with the run
+        batch_size = MAX_THREAD_MESSAGES - 1
+        overflow, messages_to_sync = messages_to_sync[:-batch_size], messages_to_sync[-batch_size:]
+        for message in overflow:
+            client.beta.threads.messages.create(current_thread_id, **message)
+        return current_thread_id, messages_to_sync
 
     @transaction.atomic()
     def _get_output_with_annotations(self, thread_id, run_id) -> tuple[str, list[str]]:
@@ -352,6 +372,19 @@ class AssistantChat(RunnableSerializable[dict, ChainOutput]):
         output_message = ""
 
         message = messages_list[0]
+        cited_file_ids = {
+            annotation.file_citation.file_id
+            for message_content in message.content
+            if message_content.type == "text"
+            for annotation in message_content.text.annotations
+            if annotation.type == "file_citation"
+        }
+        cited_files = self._get_file_links_for_citations(
+            file_ids=cited_file_ids,
+            assistant_file_ids=assistant_file_ids,
+            allow_assistant_file_downloads=self.adapter.allow_assistant_file_downloads,
+        )
+
         for message_content in message.content:
             if message_content.type == "image_file":
                 if created_file := self._create_image_file_from_image_message(client, message_content.image_file):
@@ -372,11 +405,7 @@ class AssistantChat(RunnableSerializable[dict, ChainOutput]):
                     if annotation.type == "file_citation":
                         file_citation = annotation.file_citation
                         file_id = file_citation.file_id
-                        file_name, file_link = self._get_file_link_for_citation(
-                            file_id=file_id,
-                            assistant_file_ids=assistant_file_ids,
-                            allow_assistant_file_downloads=self.adapter.allow_assistant_file_downloads,
-                        )
+                        file_name, file_link = cited_files[file_id]
 
                         # Original citation text example:【6:0†source】
                         if self.adapter.citations_enabled:
@@ -443,41 +472,73 @@ class AssistantChat(RunnableSerializable[dict, ChainOutput]):
         except Exception as ex:
             logger.exception(ex)
 
-    def _get_file_link_for_citation(
-        self, file_id: str, assistant_file_ids: list[str], allow_assistant_file_downloads: bool
-    ) -> tuple[str, str | None]:
-        """Returns a file name and a link constructor for `file_id`. If `file_id` is a member of
-        `forbidden_file_ids`, the link will be empty to prevent unauthorized access.
+    def _get_file_links_for_citations(
+        self, file_ids: set[str], assistant_file_ids: list[str], allow_assistant_file_downloads: bool
+    ) -> dict[str, tuple[str, str | None]]:
+        """Returns a mapping of each of `file_ids` to a file name and a link constructor. If the file is an
+        assistant file and `allow_assistant_file_downloads` is False, the link will be empty to prevent
+        unauthorized access.
+
+        Files are looked up with a single query. The names of files that are missing from the DB are fetched from
+        OpenAI and cached.
         """
-        file_link = ""
+        if not file_ids:
+            return {}
 
         team = self.adapter.session.team
-        link_prefix = "assistant_file" if file_id in assistant_file_ids else "file"
-        owner_id = self.adapter.assistant.id if file_id in assistant_file_ids else self.adapter.session.id
+        files = {}
+        for file in File.objects.filter(external_id__in=file_ids, team_id=team.id).order_by("id"):
+            if file.external_id in files:
+                logger.error(
+                    "Multiple files with the same external ID", extra={"file_id": file.external_id, "team": team.slug}
+                )
+            else:
+                files[file.external_id] = file
 
-        try:
-            file = File.objects.get(external_id=file_id, team_id=team.id)
-            file_link = f"{link_prefix}:{team.slug}:{owner_id}:{file.id}"
-            file_name = file.name
-        except File.MultipleObjectsReturned:
-            logger.error("Multiple files with the same external ID", extra={"file_id": file_id, "team": team.slug})
-            file = File.objects.filter(external_id=file_id, team_id=team.id).first()
-            file_link = f"{link_prefix}:{team.slug}:{owner_id}:{file.id}"
-            file_name = file.name
-        except File.DoesNotExist:
-            client = self.adapter.assistant_client
+        remote_file_names = self._get_remote_file_names(file_ids - files.keys())
+        file_links = {}
+        for file_id in file_ids:
+            if file_id in assistant_file_ids:
+                link_prefix, owner_id = "assistant_file", self.adapter.assistant.id
+            else:
+                link_prefix, owner_id = "file", self.adapter.session.id
+
+            if file := files.get(file_id):
+                file_name, file_link = file.name, f"{link_prefix}:{team.slug}:{owner_id}:{file.id}"
+            else:
+                file_name, file_link = remote_file_names[file_id], ""
+
+            if not allow_assistant_file_downloads and file_id in assistant_file_ids:
+                # Don't allow downloading assistant level files
+                file_link = None
+            file_links[file_id] = (file_name, file_link)
+        return file_links
+
+    def _get_remote_file_names(self, file_ids: set[str]) -> dict[str, str]:
+        """Fetch the names of files from OpenAI. Names are cached since the files can't be renamed."""
+        if not file_ids:
+            return {}
+
+        team_id = self.adapter.session.team_id
+        cache_keys = {file_id: f"openai_file_name:{team_id}:{file_id}" for file_id in file_ids}
+        cached = cache.get_many(cache_keys.values())
+
+        file_names = {}
+        to_cache = {}
+        client = self.adapter.assistant_client
+        for file_id, cache_key in cache_keys.items():
+            if cache_key in cached:
+                file_names[file_id] = cached[cache_key]
+                continue
             try:
-                openai_file = client.files.retrieve(file_id=file_id)
-                file_name = openai_file.filename
+                file_names[file_id] = to_cache[cache_key] = client.files.retrieve(file_id=file_id).filename
             except Exception as e:
                 logger.error(f"Failed to retrieve file {file_id} from OpenAI: {e}")
-                file_name = "Unknown File"
-
-        if not allow_assistant_file_downloads and file_id in assistant_file_ids:
-            # Don't allow downloading assistant level files
-            return file_name, None
+                file_names[file_id] = "Unknown File"
 
-        return file_name, file_link
+        if to_cache:
+            cache.set_many(to_cache, timeout=CITED_FILE_NAME_CACHE_TIMEOUT)
+        return file_names
 
     def _upload_tool_resource_files(self, attachments: list["Attachment"] | None = None) -> dict[str, list[str]]:
         """Uploads the files in `attachments` to OpenAI
@@ -509,19 +570,27 @@ class AssistantChat(RunnableSerializable[dict, ChainOutput]):
     def _get_response_with_retries(self, config, input_dict, thread_id) -> tuple[str, str]:
         assistant_runnable = self.adapter.get_openai_assistant()
 
-        for i in range(3):
-            error = None
-            try:
-                return self._get_response(assistant_runnable, input_dict, config)
-            except openai.BadRequestError as e:
-                error = e
-                self._handle_api_error(thread_id, assistant_runnable, e)
-            except ValueError as e:
-                error = e
-                if re.search(r"cancelling|cancelled", str(e)):
-                    raise GenerationCancelled(ChainOutput(output="", prompt_tokens=0, completion_tokens=0))
+        with cancellation_manager.track(self.adapter.session.chat_id) as cancelled:
+            # The assistant runnable will cancel the run if the event is set while waiting for the run to complete
+            assistant_runnable.cancellation_event = cancelled
+            if config.get("configurable", {}).get("stream_to_session", False):
+                assistant_runnable.token_callback = self._publish_token
+            for i in range(3):
+                error = None
+                try:
+                    return self._get_response(assistant_runnable, input_dict, config)
+                except openai.BadRequestError as e:
+                    error = e
+                    self._handle_api_error(thread_id, assistant_runnable, e)
+                except ValueError as e:
+                    error = e
+                    if re.search(r"cancelling|cancelled", str(e)):
+                        raise GenerationCancelled(ChainOutput(output="", prompt_tokens=0, completion_tokens=0))
         raise GenerationError("Failed to get response after 3 retries") from error
 
+    def _publish_token(self, token: str):
+        publish_session_event(self.adapter.session.id, SessionEvent.TOKEN, {"token": token})
+
     def _handle_api_error(self, thread_id: str, assistant_runnable: OpenAIAssistantRunnable, exc):
         """Handle OpenAI API errors.
         This should either raise an exception or return if the error was handled and the run should be retried.
@@ -1,26 +1,148 @@
 import dataclasses
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from functools import cached_property, lru_cache, partial
 
-import google.generativeai as genai
 import tiktoken
 from anthropic._tokenizers import sync_get_tokenizer
-from google.generativeai import GenerativeModel
-from langchain_core.messages import get_buffer_string
+from google.ai.generativelanguage import Content, GenerativeServiceClient, Part
+from langchain_core.messages import BaseMessage, get_buffer_string
 from langchain_core.outputs import LLMResult
 
+logger = logging.getLogger("ocs.token_counters")
+
+# Maximum number of token counts to keep in the per-process cache
+TOKEN_COUNT_CACHE_SIZE = 10_000
+
+# OpenAI adds 3 tokens per message and 3 tokens to prime the reply
+# https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+OPENAI_TOKENS_PER_MESSAGE = 3
+OPENAI_TOKENS_PER_REPLY = 3
+OPENAI_MESSAGE_ROLES = {"human": "user", "ai": "assistant", "system": "system", "tool": "tool"}
+
+# Text used to calibrate local estimates against a provider's remote token counting
+CALIBRATION_TEXT = (
+    "The quick brown fox jumps over the lazy dog. Hello, how can I help you today? "
+    "Please summarize the conversation so far, including any questions that were asked and the answers given. "
+    "Numbers like 3.14159 and 2024-04-02, URLs like https://example.com/path?query=1 and punctuation (e.g. ;:!?) "
+    "are tokenized differently by different models."
+)
+
+# Time in seconds to wait before trying to calibrate a model again after calibration failed
+CALIBRATION_RETRY_INTERVAL = 60
+
+
+class TokenCountCache:
+    """A thread safe LRU cache of token counts keyed by tokenizer and a hash of the text"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.counts: OrderedDict[tuple[str, bytes], int] = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get_or_count(self, tokenizer_key: str, texts: list[str], count_texts: Callable[[list[str]], list[int]]):
+        """Returns the token counts for `texts`. Only the texts that aren't cached are passed to `count_texts`."""
+        keys = [(tokenizer_key, self._hash(text)) for text in texts]
+        counts = [None] * len(texts)
+        missing = []
+        with self.lock:
+            for i, key in enumerate(keys):
+                if (count := self.counts.get(key)) is not None:
+                    self.counts.move_to_end(key)
+                    counts[i] = count
+                else:
+                    missing.append(i)
+
+        if missing:
+            new_counts = count_texts([texts[i] for i in missing])
+            with self.lock:
+                for i, count in zip(missing, new_counts, strict=True):
+                    counts[i] = count
+                    self.counts[keys[i]] = count
+                while len(self.counts) > self.max_size:
+                    self.counts.popitem(last=False)
+        return counts
+
+    def clear(self):
+        with self.lock:
+            self.counts.clear()
+
+    def _hash(self, text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+token_count_cache = TokenCountCache(max_size=TOKEN_COUNT_CACHE_SIZE)
+
+
+@lru_cache
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """Returns the tiktoken encoding for the model. Encodings are cached for the lifetime of the process."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # fallback to gpt-4 if the model is not available for encoding
+        return tiktoken.encoding_for_model("gpt-4")
+
+
+@lru_cache
+def _get_anthropic_tokenizer():
+    return sync_get_tokenizer()
+
 
 class TokenCounter:
+    @property
+    def counts_are_stable(self) -> bool:
+        """False if the counts from the last call are provisional and shouldn't be stored, e.g. a Gemini estimate
+        made before the model was calibrated"""
+        return True
+
     def get_tokens_from_response(self, response: LLMResult) -> None | tuple[int, int]:
         return None
 
     def get_tokens_from_text(self, text) -> int:
         raise NotImplementedError()
 
+    def get_tokens_from_texts(self, texts: list[str]) -> list[int]:
+        """Batch version of `get_tokens_from_text`"""
+        return [self.get_tokens_from_text(text) for text in texts]
+
     def get_tokens_from_messages(self, messages) -> int:
-        return sum([self.get_tokens_from_text(get_buffer_string([m])) for m in messages])
+        return sum(self.get_tokens_per_message(messages))
+
+    def get_tokens_per_message(self, messages: list[BaseMessage]) -> list[int]:
+        """Returns the token count of each message when counted on its own"""
+        return self.get_tokens_from_texts([get_buffer_string([m]) for m in messages])
+
+
+class CachedTokenCounter(TokenCounter):
+    """Base class for token counters that can count text locally. Counts are cached by the hash of the text and
+    texts are counted in batches.
+
+    Subclasses must implement `tokenizer_key` and `_count_texts`.
+    """
+
+    @property
+    def tokenizer_key(self) -> str:
+        """Identifies the tokenizer. Counts are shared between counters with the same key."""
+        raise NotImplementedError()
+
+    def get_tokens_from_text(self, text) -> int:
+        return self.get_tokens_from_texts([text])[0]
+
+    def get_tokens_from_texts(self, texts: list[str]) -> list[int]:
+        return token_count_cache.get_or_count(self.tokenizer_key, texts, self._count_texts)
+
+    def _count_texts(self, texts: list[str]) -> list[int]:
+        raise NotImplementedError()
 
 
 @dataclasses.dataclass
-class OpenAITokenCounter(TokenCounter):
+class OpenAITokenCounter(CachedTokenCounter):
     model: str
 
     def get_tokens_from_response(self, response: LLMResult) -> None | tuple[int, int]:
@@ -36,22 +158,31 @@ class OpenAITokenCounter(TokenCounter):
 
         return prompt_tokens, completion_tokens
 
-    def get_tokens_from_text(self, text) -> int:
-        if not text:
-            return 0
-        encoding_model = self._get_encoding_model()
-        return len(encoding_model.encode(text))
+    def get_tokens_per_message(self, messages: list[BaseMessage]) -> list[int]:
+        """Count each message the same way as `ChatOpenAI.get_num_tokens_from_messages` counts a single message.
+        Message names and tool calls aren't included in the count."""
+        texts = []
+        for message in messages:
+            texts.extend([OPENAI_MESSAGE_ROLES.get(message.type, message.type), _get_message_text(message)])
+        counts = self.get_tokens_from_texts(texts)
+        overhead = OPENAI_TOKENS_PER_MESSAGE + OPENAI_TOKENS_PER_REPLY
+        return [overhead + counts[i] + counts[i + 1] for i in range(0, len(counts), 2)]
 
-    def _get_encoding_model(self) -> tiktoken.Encoding:
-        try:
-            return tiktoken.encoding_for_model(self.model)
-        except KeyError:
-            # fallback to gpt-4 if the model is not available for encoding
-            model = "gpt-4"
-            return tiktoken.get_encoding(model)
+    @property
+    def tokenizer_key(self) -> str:
+        return f"tiktoken:{self._encoding.name}"
+
+    @cached_property
+    def _encoding(self) -> tiktoken.Encoding:
+        return get_encoding(self.model)
 
+    def _count_texts(self, texts: list[str]) -> list[int]:
+        return [len(tokens) for tokens in self._encoding.encode_ordinary_batch(texts)]
+
+
+class AnthropicTokenCounter(CachedTokenCounter):
+    tokenizer_key = "anthropic"
 
-class AnthropicTokenCounter(TokenCounter):
     def get_tokens_from_response(self, response: LLMResult) -> None | tuple[int, int]:
         if response.llm_output is None:
             return None
@@ -65,24 +196,27 @@ class AnthropicTokenCounter(TokenCounter):
 
         return input_tokens, output_tokens
 
-    def get_tokens_from_text(self, text) -> int:
-        tokenizer = sync_get_tokenizer()
-        encoded_text = tokenizer.encode(text)
-        return len(encoded_text.ids)
+    def _count_texts(self, texts: list[str]) -> list[int]:
+        return [len(encoding.ids) for encoding in _get_anthropic_tokenizer().encode_batch(texts)]
 
 
 @dataclasses.dataclass
-class GeminiTokenCounter(TokenCounter):
+class GeminiTokenCounter(CachedTokenCounter):
+    """Gemini can only count tokens exactly with a network call so text is counted with a local estimate.
+
+    The estimate is the `cl100k_base` token count scaled by the ratio between the Gemini and `cl100k_base` token
+    counts for `CALIBRATION_TEXT`. The ratio is calculated once per model per process. Until a model has been
+    calibrated the ratio is 1 and the estimates aren't cached or stored.
+    """
+
     model: str
     google_api_key: str
+    _calibrated: bool = dataclasses.field(default=False, init=False, repr=False, compare=False)
 
     def __post_init__(self):
         if not self.google_api_key:
             raise ValueError("KEY not found!")
 
-        self.client = genai.Client(api_key=self.google_api_key)
-        self.model = GenerativeModel(self.model)
-
     def get_tokens_from_response(self, response: LLMResult) -> None | tuple[int, int]:
         if response.llm_output is None:
             return None
@@ -95,20 +229,126 @@ class GeminiTokenCounter(TokenCounter):
 
         return input_tokens, output_tokens
 
-    def get_tokens_from_text(self, text: str) -> int:
-        if not text:
-            return 0
+    @property
+    def tokenizer_key(self) -> str:
+        return f"gemini:{self.model}"
+
+    @property
+    def counts_are_stable(self) -> bool:
+        return self._calibrated
 
-        response = self.client.count_tokens(model=self.model, contents=text)
-        return response.total_tokens
+    def get_tokens_from_texts(self, texts: list[str]) -> list[int]:
+        ratio = _get_gemini_calibration_ratio(self.model, self.google_api_key)
+        self._calibrated = ratio is not None
+        if ratio is None:
+            return self._estimate(texts, ratio=1.0)
+        return token_count_cache.get_or_count(self.tokenizer_key, texts, partial(self._estimate, ratio=ratio))
 
     def get_tokens_from_messages(self, messages) -> int:
-        total_tokens = 0
+        texts = []
         for message in messages:
-            if isinstance(message, dict) and "content" in message:
-                total_tokens += self.get_tokens_from_text(message["content"])
+            if isinstance(message, BaseMessage):
+                texts.append(get_buffer_string([message]))
+            elif isinstance(message, dict) and "content" in message:
+                texts.append(message["content"])
             elif isinstance(message, str):
-                total_tokens += self.get_tokens_from_text(message)
+                texts.append(message)
             else:
-                print("Warning: Unsupported message format.")
-        return total_tokens
+                logger.warning("Unsupported message format: %s", type(message))
+        return sum(self.get_tokens_from_texts(texts))
+
+    def _estimate(self, texts: list[str], ratio: float) -> list[int]:
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return [math.ceil(len(tokens) * ratio) for tokens in encoding.encode_ordinary_batch(texts)]
+
+
+class CalibrationRatios:
+    """Thread safe store of calibration ratios keyed by model. Only successful calibrations are kept. After a
+    failure the model isn't calibrated again for `CALIBRATION_RETRY_INTERVAL` seconds and `get` returns `None`."""
+
+    def __init__(self) -> None:
+        self.ratios: dict[str, float] = {}
+        self.retry_at: dict[str, float] = {}
+        self.lock = threading.RLock()
+
+    def get(self, model: str, calibrate: Callable[[], float]) -> float | None:
+        with self.lock:
+            if (ratio := self.ratios.get(model)) is not None:
+                return ratio
+            if time.monotonic() < self.retry_at.get(model, 0):
+                return None
+
+        try:
+            ratio = calibrate()
+        except Exception:
+            logger.exception("Unable to calibrate the token estimate for %s", model)
+            with self.lock:
+                self.retry_at[model] = time.monotonic() + CALIBRATION_RETRY_INTERVAL
+            return None
+
+        with self.lock:
+            self.ratios[model] = ratio
+            self.retry_at.pop(model, None)
+        return ratio
+
+    def clear(self):
+        with self.lock:
+            self.ratios.clear()
+            self.retry_at.clear()
+
+
+gemini_calibration_ratios = CalibrationRatios()
+
+
+def _get_gemini_calibration_ratio(model: str, google_api_key: str) -> float | None:
+    """Returns the calibration ratio for the model or `None` if the model couldn't be calibrated"""
+
+    def calibrate():
+        # A client per call rather than `genai.configure`, which sets the API key for every Gemini call in the process
+        client = GenerativeServiceClient(client_options={"api_key": google_api_key})
+        model_name = model if model.startswith("models/") else f"models/{model}"
+        response = client.count_tokens(model=model_name, contents=[Content(parts=[Part(text=CALIBRATION_TEXT)])])
+        local_count = len(tiktoken.get_encoding("cl100k_base").encode_ordinary(CALIBRATION_TEXT))
+        return response.total_tokens / local_count
+
+    return gemini_calibration_ratios.get(model, calibrate)
+
+
+class LlmTokenCounter(TokenCounter):
+    """Uses the token counting methods of the LLM. This is used for LLMs that don't have a dedicated counter."""
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    def get_tokens_from_text(self, text) -> int:
+        return self.llm.get_num_tokens(text)
+
+    def get_tokens_per_message(self, messages: list[BaseMessage]) -> list[int]:
+        return [self.llm.get_num_tokens_from_messages([message]) for message in messages]
+
+
+def get_token_counter(llm) -> TokenCounter:
+    """Returns the token counter to use for counting tokens locally for the given chat model"""
+    from langchain_anthropic import ChatAnthropic
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from langchain_openai.chat_models.base import BaseChatOpenAI
+
+    if isinstance(llm, BaseChatOpenAI):
+        return OpenAITokenCounter(llm.tiktoken_model_name or llm.model_name)
+    if isinstance(llm, ChatAnthropic):
+        return AnthropicTokenCounter()
+    if isinstance(llm, ChatGoogleGenerativeAI) and llm.google_api_key:
+        return GeminiTokenCounter(llm.model, llm.google_api_key.get_secret_value())
+    return LlmTokenCounter(llm)
+
+
+def _get_message_text(message: BaseMessage) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    parts = []
+    for part in message.content:
+        if isinstance(part, str):
+            parts.append(part)
+        elif isinstance(part, dict) and part.get("type") == "text":
+            parts.append(part.get("text", ""))
+    return "".join(parts)
@@ -0,0 +1,54 @@
+import random
+import string
+import timeit
+
+from django.core.management import BaseCommand
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_openai import ChatOpenAI
+
+from apps.service_providers.llm_service.token_counters import OpenAITokenCounter, token_count_cache
+
+
+class Command(BaseCommand):
+    help = "Compare counting history tokens with the LLM against the cached batch token counter"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", default="gpt-4o-mini")
+        parser.add_argument("--messages", type=int, default=200, help="The number of messages in the history")
+        parser.add_argument("--words", type=int, default=60, help="The number of words per message")
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, model, messages, words, repeat, **options):
+        history = [(HumanMessage if i % 2 == 0 else AIMessage)(content=_random_text(words)) for i in range(messages)]
+        llm = ChatOpenAI(model=model, api_key="benchmark")
+        counter = OpenAITokenCounter(model)
+
+        expected = sum(llm.get_num_tokens_from_messages([message]) for message in history)
+        actual = counter.get_tokens_from_messages(history)
+        if expected != actual:
+            self.stderr.write(f"Token counts differ: {expected} (llm) != {actual} (counter)")
+
+        def count_with_llm():
+            return [llm.get_num_tokens_from_messages([message]) for message in history]
+
+        def count_with_counter_uncached():
+            token_count_cache.clear()
+            return counter.get_tokens_per_message(history)
+
+        def count_with_counter():
+            return counter.get_tokens_per_message(history)
+
+        self.stdout.write(f"Counting {messages} messages of {words} words ({actual} tokens), best of {repeat}:")
+        baseline = None
+        for label, func in [
+            ("llm.get_num_tokens_from_messages", count_with_llm),
+            ("token counter (cold cache)", count_with_counter_uncached),
+            ("token counter (warm cache)", count_with_counter),
+        ]:
+            duration = min(timeit.repeat(func, number=1, repeat=repeat))
+            baseline = baseline or duration
+            self.stdout.write(f"  {label:<36} {duration * 1000:8.2f}ms ({baseline / duration:.1f}x)")
+
+
+def _random_text(words: int) -> str:
+    return " ".join("".join(random.choices(string.ascii_lowercase, k=random.randint(2, 10))) for _ in range(words))
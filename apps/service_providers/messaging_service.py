@@ -21,6 +21,7 @@ from apps.channels import audio
 from apps.channels.datamodels import TurnWhatsappMessage, TwilioMessage
 from apps.channels.models import ChannelPlatform
 from apps.chat.channels import MESSAGE_TYPES
+from apps.service_providers.client_pool import client_pool
 from apps.service_providers.exceptions import ServiceProviderConfigError
 from apps.service_providers.speech_service import SynthesizedAudio
 
@@ -72,22 +73,31 @@ class TwilioService(MessagingService):
 
     @property
     def client(self) -> Client:
-        return Client(self.account_sid, self.auth_token)
+        return client_pool.get(
+            "twilio",
+            {"account_sid": self.account_sid, "auth_token": self.auth_token},
+            lambda: Client(self.account_sid, self.auth_token),
+        )
 
     @property
     def s3_client(self):
-        return boto3.client(
+        config = {
+            "aws_access_key_id": settings.AWS_ACCESS_KEY_ID,
+            "aws_secret_access_key": settings.AWS_SECRET_ACCESS_KEY,
+            "region_name": settings.AWS_S3_REGION,
+        }
+        return client_pool.get(
             "s3",
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION,
-            config=Config(signature_version="s3v4"),
+            config,
+            lambda: boto3.client("s3", **config, config=Config(signature_version="s3v4")),
+            close=lambda client: client.close(),
         )
 
     def _upload_audio_file(self, synthetic_voice: SynthesizedAudio):
         file_path = f"{uuid.uuid4()}.mp3"
         audio_bytes = synthetic_voice.get_audio_bytes(format="mp3")
-        self.s3_client.upload_fileobj(
+        s3_client = self.s3_client
+        s3_client.upload_fileobj(
             BytesIO(audio_bytes),
             settings.WHATSAPP_S3_AUDIO_BUCKET,
             file_path,
@@ -99,7 +109,7 @@ class TwilioService(MessagingService):
                 "ContentType": "audio/mpeg",
             },
         )
-        return self.s3_client.generate_presigned_url(
+        return s3_client.generate_presigned_url(
             "get_object",
             Params={
                 "Bucket": settings.WHATSAPP_S3_AUDIO_BUCKET,
@@ -110,8 +120,9 @@ class TwilioService(MessagingService):
 
     def send_text_message(self, message: str, from_: str, to: str, platform: ChannelPlatform, **kwargs):
         prefix = self.TWILIO_CHANNEL_PREFIXES[platform]
+        client = self.client
         for message_text in smart_split(message, chars_per_string=self.MESSAGE_CHARACTER_LIMIT):
-            self.client.messages.create(from_=f"{prefix}:{from_}", body=message_text, to=f"{prefix}:{to}")
+            client.messages.create(from_=f"{prefix}:{from_}", body=message_text, to=f"{prefix}:{to}")
 
     def send_voice_message(
         self, synthetic_voice: SynthesizedAudio, from_: str, to: str, platform: ChannelPlatform, **kwargs
@@ -150,7 +161,7 @@ class TurnIOService(MessagingService):
 
     @property
     def client(self) -> TurnClient:
-        return TurnClient(token=self.auth_token)
+        return client_pool.get("turnio", {"auth_token": self.auth_token}, lambda: TurnClient(token=self.auth_token))
 
     def send_text_message(self, message: str, from_: str, to: str, platform: ChannelPlatform, **kwargs):
         self.client.messages.send_text(to, message)
@@ -160,8 +171,9 @@ class TurnIOService(MessagingService):
     ):
         # OGG must use the opus codec: https://whatsapp.turn.io/docs/api/media#uploading-media
         voice_audio_bytes = synthetic_voice.get_audio_bytes(format="ogg", codec="libopus")
-        media_id = self.client.media.upload_media(voice_audio_bytes, content_type="audio/ogg")
-        self.client.messages.send_audio(whatsapp_id=to, media_id=media_id)
+        client = self.client
+        media_id = client.media.upload_media(voice_audio_bytes, content_type="audio/ogg")
+        client.messages.send_audio(whatsapp_id=to, media_id=media_id)
 
     def get_message_audio(self, message: TurnWhatsappMessage) -> BytesIO:
         response = self.client.media.get_media(message.media_id)
@@ -181,6 +193,11 @@ class SureAdhereService(MessagingService):
     base_url: str
     auth_url: str
 
+    @property
+    def session(self) -> requests.Session:
+        config = {"client_id": self.client_id, "base_url": self.base_url, "auth_url": self.auth_url}
+        return client_pool.get("sureadhere", config, requests.Session, close=lambda session: session.close())
+
     def get_access_token(self):
         auth_data = {
             "grant_type": "client_credentials",
@@ -188,7 +205,7 @@ class SureAdhereService(MessagingService):
             "client_secret": self.client_secret,
             "scope": self.client_scope,
         }
-        response = requests.post(self.auth_url, data=auth_data)
+        response = self.session.post(self.auth_url, data=auth_data)
         response.raise_for_status()
         return response.json()["access_token"]
 
@@ -197,7 +214,7 @@ class SureAdhereService(MessagingService):
         send_msg_url = urljoin(self.base_url, "/treatment/external/send-msg")
         headers = {"Content-Type": "application/json", "Authorization": f"Bearer {access_token}"}
         data = {"patient_Id": to, "message_Body": message}
-        response = requests.post(send_msg_url, headers=headers, json=data)
+        response = self.session.post(send_msg_url, headers=headers, json=data)
         response.raise_for_status()
 
 
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.2 on 2025-04-08 10:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_providers', '0026_add_google_gemini_models'),
+        ('teams', '0007_create_commcare_connect_flag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpeechCacheStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('hits', models.PositiveBigIntegerField(default=0)),
+                ('misses', models.PositiveBigIntegerField(default=0)),
+                ('team', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='speech_cache_stats', to='teams.team')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='SpeechCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(upload_to='speech_cache/')),
+                ('format', models.CharField(max_length=16)),
+                ('duration', models.FloatField()),
+                ('size', models.PositiveIntegerField()),
+                ('hit_count', models.PositiveIntegerField(default=0)),
+                ('last_used_at', models.DateTimeField(auto_now_add=True)),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='teams.team', verbose_name='Team')),
+                ('voice_provider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='service_providers.voiceprovider')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['team', 'last_used_at'], name='speech_cache_team_last_used')],
+            },
+        ),
+    ]
@@ -323,9 +323,46 @@ class VoiceProvider(BaseTeamModel, ProviderMixin):
         if self.type == VoiceProviderType.openai_voice_engine:
             files_to_delete = self.get_files()
             [f.delete() for f in files_to_delete]
+        for entry in self.speechcacheentry_set.all():
+            entry.file.delete(save=False)
         return super().delete()
 
 
+class SpeechCacheEntry(BaseTeamModel):
+    """Synthesized audio for a voice provider, synthetic voice and text. See `apps.service_providers.speech_cache`"""
+
+    key = models.CharField(max_length=64, unique=True)
+    voice_provider = models.ForeignKey(VoiceProvider, on_delete=models.CASCADE)
+    file = models.FileField(upload_to="speech_cache/")
+    format = models.CharField(max_length=16)
+    duration = models.FloatField()
+    size = models.PositiveIntegerField()
+    hit_count = models.PositiveIntegerField(default=0)
+    last_used_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["team", "last_used_at"], name="speech_cache_team_last_used")]
+
+    def __str__(self):
+        return f"{self.voice_provider}: {self.key}"
+
+
+class SpeechCacheStats(BaseTeamModel):
+    """Number of speech cache hits and misses for a team"""
+
+    team = models.OneToOneField(Team, on_delete=models.CASCADE, related_name="speech_cache_stats")
+    hits = models.PositiveBigIntegerField(default=0)
+    misses = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.team}: {self.hit_rate:.0%}"
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
 class MessagingProviderType(models.TextChoices):
     twilio = "twilio", _("Twilio")
     turnio = "turnio", _("Turn.io")
@@ -464,12 +501,12 @@ class TraceProviderType(models.TextChoices):
                 return forms.LangsmithTraceProviderForm
         raise Exception(f"No config form configured for {self}")
 
-    def get_service(self, config: dict) -> tracing.TraceService:
+    def get_service(self, config: dict, sample_rate: float = 1.0) -> tracing.TraceService:
         match self:
             case TraceProviderType.langfuse:
-                return tracing.LangFuseTraceService(self, config)
+                return tracing.LangFuseTraceService(self, config, sample_rate)
             case TraceProviderType.langsmith:
-                return tracing.LangSmithTraceService(self, config)
+                return tracing.LangSmithTraceService(self, config, sample_rate)
         raise Exception(f"No tracing service configured for {self}")
 
 
@@ -490,5 +527,5 @@ class TraceProvider(BaseTeamModel):
     def type_enum(self):
         return TraceProviderType(self.type)
 
-    def get_service(self) -> tracing.TraceService:
-        return self.type_enum.get_service(self.config)
+    def get_service(self, sample_rate: float = 1.0) -> tracing.TraceService:
+        return self.type_enum.get_service(self.config, sample_rate)
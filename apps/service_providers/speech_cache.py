@@ -0,0 +1,133 @@
+"""
+Content-addressed cache of synthesized speech.
+
+Bots with voice replies often synthesize the same text many times, e.g. consent text, seed messages and safety
+layer responses. Synthesized audio is stored in file storage and indexed by `SpeechCacheEntry` under a hash of the
+voice provider, synthetic voice, audio format and normalized text, so that synthesizing the same text again doesn't
+call the provider.
+
+Only text up to `settings.SPEECH_CACHE_MAX_TEXT_LENGTH` characters is cached since longer text is unlikely to be
+repeated. Each team's cache is limited to `settings.SPEECH_CACHE_MAX_SIZE` bytes, after which the least recently used
+audio is evicted. Hits and misses are counted per team in `SpeechCacheStats`.
+
+Usage:
+
+    audio = speech_cache.synthesize_voice(voice_provider, synthetic_voice, text)
+"""
+
+import hashlib
+import logging
+import unicodedata
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from apps.experiments.models import SyntheticVoice
+from apps.service_providers.models import SpeechCacheEntry, SpeechCacheStats, VoiceProvider
+from apps.service_providers.speech_service import SynthesizedAudio
+
+logger = logging.getLogger("ocs.speech")
+
+
+def normalize_text(text: str) -> str:
+    """Normalize unicode and whitespace so that text which sounds the same shares a cache entry"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def get_cache_key(voice_provider: VoiceProvider, synthetic_voice: SyntheticVoice, format: str, text: str) -> str:
+    parts = [voice_provider.type, str(voice_provider.id), str(synthetic_voice.id), format, normalize_text(text)]
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+class SpeechCache:
+    def synthesize_voice(
+        self, voice_provider: VoiceProvider, synthetic_voice: SyntheticVoice, text: str
+    ) -> SynthesizedAudio:
+        """Return the cached audio for the text if there is any, otherwise synthesize it with the voice provider's
+        speech service and cache it. Raises `AudioSynthesizeException` if the audio can't be synthesized."""
+        speech_service = voice_provider.get_speech_service()
+        if not settings.SPEECH_CACHE_ENABLED or len(text) > settings.SPEECH_CACHE_MAX_TEXT_LENGTH:
+            return speech_service.synthesize_voice(text, synthetic_voice)
+
+        key = get_cache_key(voice_provider, synthetic_voice, speech_service.output_format, text)
+        if audio := self._get(voice_provider.team_id, key):
+            self._record(voice_provider.team_id, hit=True)
+            return audio
+
+        self._record(voice_provider.team_id, hit=False)
+        audio = speech_service.synthesize_voice(text, synthetic_voice)
+        self._set(voice_provider, key, audio)
+        return audio
+
+    def _get(self, team_id: int, key: str) -> SynthesizedAudio | None:
+        entry = SpeechCacheEntry.objects.filter(team_id=team_id, key=key).first()
+        if not entry:
+            return None
+
+        try:
+            with entry.file.open("rb") as f:
+                audio = BytesIO(f.read())
+        except OSError:
+            logger.exception("Unable to read cached speech '%s'", key)
+            entry.delete()
+            return None
+
+        SpeechCacheEntry.objects.filter(id=entry.id).update(hit_count=F("hit_count") + 1, last_used_at=timezone.now())
+        return SynthesizedAudio(audio=audio, duration=entry.duration, format=entry.format)
+
+    def _set(self, voice_provider: VoiceProvider, key: str, audio: SynthesizedAudio):
+        content = audio.audio.getvalue()
+        entry = SpeechCacheEntry(
+            team_id=voice_provider.team_id,
+            key=key,
+            voice_provider=voice_provider,
+            format=audio.format,
+            duration=audio.duration,
+            size=len(content),
+        )
+        try:
+            entry.file.save(f"{key}.{audio.format}", ContentFile(content), save=False)
+            with transaction.atomic():
+                entry.save()
+        except IntegrityError:
+            # the same text was synthesized concurrently
+            entry.file.delete(save=False)
+            return
+        except OSError:
+            logger.exception("Unable to cache speech '%s'", key)
+            return
+
+        self._evict(voice_provider.team_id, keep=entry)
+
+    def _evict(self, team_id: int, keep: SpeechCacheEntry):
+        """Delete the least recently used entries, other than `keep`, until the team's cache is within the size
+        limit"""
+        entries = SpeechCacheEntry.objects.filter(team_id=team_id)
+        excess = (entries.aggregate(total=Sum("size"))["total"] or 0) - settings.SPEECH_CACHE_MAX_SIZE
+        if excess <= 0:
+            return
+
+        evicted = []
+        for entry in entries.exclude(id=keep.id).order_by("last_used_at").only("id", "file", "size").iterator():
+            evicted.append(entry)
+            excess -= entry.size
+            if excess <= 0:
+                break
+
+        logger.debug("Evicting %s cached speech entries for team %s", len(evicted), team_id)
+        SpeechCacheEntry.objects.filter(id__in=[entry.id for entry in evicted]).delete()
+        for entry in evicted:
+            entry.file.delete(save=False)
+
+    def _record(self, team_id: int, hit: bool):
+        field = "hits" if hit else "misses"
+        if not SpeechCacheStats.objects.filter(team_id=team_id).update(**{field: F(field) + 1}):
+            SpeechCacheStats.objects.get_or_create(team_id=team_id)
+            SpeechCacheStats.objects.filter(team_id=team_id).update(**{field: F(field) + 1})
+
+
+speech_cache = SpeechCache()
@@ -1,7 +1,7 @@
 import logging
 import tempfile
 from contextlib import closing
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from io import BytesIO
 from typing import ClassVar
 
@@ -10,9 +10,8 @@ import boto3
 import pydantic
 import requests
 from openai import OpenAI
-from pydub import AudioSegment
 
-from apps.channels.audio import convert_audio
+from apps.channels.audio import convert_audio, get_duration
 from apps.chat.exceptions import AudioSynthesizeException, AudioTranscriptionException
 from apps.experiments.models import SyntheticVoice
 
@@ -24,20 +23,28 @@ class SynthesizedAudio:
     audio: BytesIO
     duration: float
     format: str
+    _converted: dict[tuple[str, str | None], bytes] = field(init=False, default_factory=dict, repr=False, compare=False)
 
     def get_audio_bytes(self, format: str, codec: str | None = None) -> bytes:
         """Returns the audio bytes in the specified `format` and `codec`. A conversion will always be triggered
-        when `codec` is specified to ensure that this codec was used.
+        when `codec` is specified to ensure that this codec was used. Converted audio is kept so that the audio is
+        only converted once per format and codec.
         """
-        audio = self.audio
-        if self.format != format or codec is not None:
+        if self.format == format and codec is None:
+            return self.audio.getvalue()
+
+        key = (format, codec)
+        if key not in self._converted:
             audio = convert_audio(audio=self.audio, target_format=format, source_format=self.format, codec=codec)
-        return audio.getvalue()
+            self._converted[key] = audio.getvalue()
+        return self._converted[key]
 
 
 class SpeechService(pydantic.BaseModel):
     _type: ClassVar[str]
     supports_transcription: ClassVar[bool] = False
+    # The format of the audio returned by `synthesize_voice`
+    output_format: ClassVar[str] = "mp3"
 
     def synthesize_voice(self, text: str, synthetic_voice: SyntheticVoice) -> SynthesizedAudio:
         assert synthetic_voice.service == self._type
@@ -82,19 +89,17 @@ class AWSSpeechService(SpeechService):
             VoiceId=synthetic_voice.name, OutputFormat="mp3", Text=text, Engine=engine
         )
 
-        audio_stream = response["AudioStream"]
-        audio_data = audio_stream.read()
-
-        audio_segment = AudioSegment.from_file(BytesIO(audio_data), format="mp3")
-        duration_seconds = len(audio_segment) / 1000  # Convert milliseconds to seconds
+        with closing(response["AudioStream"]) as audio_stream:
+            audio_data = audio_stream.read()
 
-        with closing(audio_stream):
-            return SynthesizedAudio(audio=BytesIO(audio_data), duration=duration_seconds, format="mp3")
+        duration_seconds = get_duration(audio_data, format="mp3")
+        return SynthesizedAudio(audio=BytesIO(audio_data), duration=duration_seconds, format="mp3")
 
 
 class AzureSpeechService(SpeechService):
     _type: ClassVar[str] = SyntheticVoice.Azure
     supports_transcription: ClassVar[bool] = True
+    output_format: ClassVar[str] = "wav"
     azure_subscription_key: str
     azure_region: str
 
@@ -119,14 +124,11 @@ class AzureSpeechService(SpeechService):
 
             # Check if synthesis was successful
             if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-                audio_segment = AudioSegment.from_file(
-                    temp_file.name, format="wav"
-                )  # Azure returns audio in WAV format
-                duration_seconds = len(audio_segment) / 1000  # Convert milliseconds to seconds
-
                 with open(temp_file.name, "rb") as f:
                     file_content = f.read()
 
+                # Azure returns audio in WAV format
+                duration_seconds = get_duration(file_content, format="wav")
                 return SynthesizedAudio(audio=BytesIO(file_content), duration=duration_seconds, format="wav")
             elif result.reason == speechsdk.ResultReason.Canceled:
                 cancellation_details = result.cancellation_details
@@ -180,8 +182,7 @@ class OpenAISpeechService(SpeechService):
         response = self._client.audio.speech.create(model="tts-1", voice=synthetic_voice.name, input=text)
         audio_data = response.read()
 
-        audio_segment = AudioSegment.from_file(BytesIO(audio_data), format="mp3")
-        duration_seconds = len(audio_segment) / 1000  # Convert milliseconds to seconds
+        duration_seconds = get_duration(audio_data, format="mp3")
         return SynthesizedAudio(audio=BytesIO(audio_data), duration=duration_seconds, format="mp3")
 
     def _transcribe_audio(self, audio: BytesIO) -> str:
@@ -222,10 +223,8 @@ class OpenAIVoiceEngineSpeechService(SpeechService):
         response = requests.post(url, headers=headers, data=data, files=files)
 
         if response.status_code == 200:
-            audio_data = BytesIO(response.content)
-            audio_segment = AudioSegment.from_file(audio_data, format="mp3")
-            audio_data.seek(0)
-            return SynthesizedAudio(audio=audio_data, duration=audio_segment.duration_seconds, format="mp3")
+            duration_seconds = get_duration(response.content, format="mp3")
+            return SynthesizedAudio(audio=BytesIO(response.content), duration=duration_seconds, format="mp3")
         else:
             msg = f"Error synthesizing voice with OpenAI Voice Engine. Response status: {response.status_code}."
             raise AudioSynthesizeException(msg)
@@ -1,11 +1,23 @@
+import json
+import threading
 from contextlib import nullcontext as does_not_raise
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from typing import Literal
 from unittest import mock
 from unittest.mock import Mock, patch
+from urllib.parse import urlparse
 
 import openai
 import pytest
-from openai.types.beta.threads import ImageFile, ImageFileContentBlock, Run
+from openai.types.beta.threads import (
+    ImageFile,
+    ImageFileContentBlock,
+    MessageDelta,
+    MessageDeltaEvent,
+    Run,
+    TextDelta,
+    TextDeltaBlock,
+)
 from openai.types.beta.threads import Message as ThreadMessage
 from openai.types.beta.threads.file_citation_annotation import FileCitation, FileCitationAnnotation
 from openai.types.beta.threads.file_path_annotation import FilePath, FilePathAnnotation
@@ -19,6 +31,7 @@ from apps.chat.agent.tools import TOOL_CLASS_MAP
 from apps.chat.models import Chat, ChatAttachment, ChatMessage, ChatMessageType
 from apps.service_providers.llm_service.adapters import AssistantAdapter
 from apps.service_providers.llm_service.history_managers import ExperimentHistoryManager
+from apps.service_providers.llm_service.main import OpenAIAssistantRunnable
 from apps.service_providers.llm_service.runnables import (
     AssistantChat,
     GenerationCancelled,
@@ -64,7 +77,7 @@ def db_session(request):
     "apps.service_providers.llm_service.adapters.AssistantAdapter.get_messages_to_sync_to_thread",
     Mock(return_value=[]),
 )
-@patch("apps.service_providers.llm_service.history_managers.ExperimentHistoryManager.save_message_to_history", Mock())
+@patch("apps.service_providers.llm_service.history_managers.ExperimentHistoryManager.save_messages_to_history", Mock())
 @patch("apps.service_providers.llm_service.adapters.AssistantAdapter.get_attachments", Mock())
 @patch("apps.service_providers.llm_service.runnables.AssistantChat._get_output_with_annotations")
 @patch("openai.resources.beta.threads.messages.Messages.list")
@@ -98,7 +111,7 @@ def test_assistant_conversation_new_chat(
     "apps.service_providers.llm_service.adapters.AssistantAdapter.get_messages_to_sync_to_thread",
     Mock(return_value=[]),
 )
-@patch("apps.service_providers.llm_service.history_managers.ExperimentHistoryManager.save_message_to_history", Mock())
+@patch("apps.service_providers.llm_service.history_managers.ExperimentHistoryManager.save_messages_to_history", Mock())
 @patch("apps.service_providers.llm_service.adapters.AssistantAdapter.get_attachments", Mock())
 @patch("apps.service_providers.llm_service.runnables.AssistantChat._get_output_with_annotations")
 @patch("openai.resources.beta.threads.messages.Messages.list")
@@ -124,8 +137,9 @@ def test_assistant_conversation_existing_chat(
     assistant_runnable = create_experiment_runnable(session.experiment, session)
     result = assistant_runnable.invoke("test")
 
-    assert create_message.call_args.args == (thread_id,)
+    create_message.assert_not_called()
     assert create_run.call_args.args == (thread_id,)
+    assert create_run.call_args.kwargs["additional_messages"][-1]["role"] == "user"
     assert result.output == "ai response"
 
 
@@ -134,7 +148,7 @@ def test_assistant_conversation_existing_chat(
     "apps.service_providers.llm_service.adapters.AssistantAdapter.get_messages_to_sync_to_thread",
     Mock(return_value=[]),
 )
-@patch("apps.service_providers.llm_service.history_managers.ExperimentHistoryManager.save_message_to_history", Mock())
+@patch("apps.service_providers.llm_service.history_managers.ExperimentHistoryManager.save_messages_to_history", Mock())
 @patch("apps.service_providers.llm_service.adapters.AssistantAdapter.get_attachments", Mock())
 @patch("apps.service_providers.llm_service.runnables.AssistantChat._get_output_with_annotations")
 @patch("openai.resources.beta.threads.messages.Messages.list")
@@ -210,7 +224,7 @@ def test_assistant_includes_file_type_information(
     "apps.service_providers.llm_service.adapters.AssistantAdapter.get_messages_to_sync_to_thread",
     Mock(return_value=[]),
 )
-@patch("apps.service_providers.llm_service.history_managers.ExperimentHistoryManager.save_message_to_history", Mock())
+@patch("apps.service_providers.llm_service.history_managers.ExperimentHistoryManager.save_messages_to_history", Mock())
 @patch("apps.service_providers.llm_service.adapters.AssistantAdapter.get_attachments", Mock())
 def test_assistant_runnable_raises_error(session):
     error = openai.BadRequestError("test", response=mock.Mock(), body={})
@@ -225,7 +239,7 @@ def test_assistant_runnable_raises_error(session):
     "apps.service_providers.llm_service.adapters.AssistantAdapter.get_messages_to_sync_to_thread",
     Mock(return_value=[]),
 )
-@patch("apps.service_providers.llm_service.history_managers.ExperimentHistoryManager.save_message_to_history", Mock())
+@patch("apps.service_providers.llm_service.history_managers.ExperimentHistoryManager.save_messages_to_history", Mock())
 @patch("apps.service_providers.llm_service.adapters.AssistantAdapter.get_attachments", Mock())
 def test_assistant_runnable_handles_cancellation_status(session):
     error = ValueError("unexpected status: cancelled")
@@ -274,7 +288,7 @@ def test_assistant_runnable_handles_cancellation_status(session):
     "apps.service_providers.llm_service.adapters.AssistantAdapter.get_messages_to_sync_to_thread",
     Mock(return_value=[]),
 )
-@patch("apps.service_providers.llm_service.history_managers.ExperimentHistoryManager.save_message_to_history", Mock())
+@patch("apps.service_providers.llm_service.history_managers.ExperimentHistoryManager.save_messages_to_history", Mock())
 @patch("apps.service_providers.llm_service.adapters.AssistantAdapter.get_attachments", Mock())
 @patch("apps.service_providers.llm_service.runnables.AssistantChat._get_output_with_annotations")
 def test_assistant_runnable_cancels_existing_run(save_response_annotations, responses, exception, output, session):
@@ -557,30 +571,46 @@ def test_assistant_response_with_image_file_content_block(
 
 @pytest.mark.django_db()
 @pytest.mark.parametrize(
-    ("messages", "thread_id", "thread_created", "messages_created"),
+    ("messages", "thread_id", "thread_created", "pending_messages"),
     [
-        ([], None, False, False),
-        ([], "test_thread_id", False, False),
-        ([{"role": "user", "content": "hello"}], None, True, False),
-        ([{"role": "user", "content": "hello"}], "test_thread_id", False, True),
+        ([], None, False, []),
+        ([], "test_thread_id", False, []),
+        ([{"role": "user", "content": "hello"}], None, True, []),
+        ([{"role": "user", "content": "hello"}], "test_thread_id", False, [{"role": "user", "content": "hello"}]),
     ],
 )
-def test_sync_messages_to_thread(messages, thread_id, thread_created, messages_created):
+def test_sync_messages_to_thread(messages, thread_id, thread_created, pending_messages):
     adapter = Mock(spec=AssistantAdapter)
     adapter.get_messages_to_sync_to_thread.return_value = messages
     session = ExperimentSessionFactory()
     history_manager = ExperimentHistoryManager.for_assistant(session, experiment=session.experiment)
     assistant_runnable = AssistantChat(adapter=adapter, history_manager=history_manager)
-    assistant_runnable._sync_messages_to_thread(thread_id)
+    _thread_id, to_add_with_run = assistant_runnable._sync_messages_to_thread(thread_id)
 
     assert adapter.get_messages_to_sync_to_thread.called
-    if messages_created:
-        assert adapter.assistant_client.beta.threads.messages.create.call_count == len(messages)
+    assert to_add_with_run == pending_messages
+    adapter.assistant_client.beta.threads.messages.create.assert_not_called()
     assert adapter.assistant_client.beta.threads.create.called == thread_created
     if thread_created:
         adapter.update_thread_id.assert_called
 
 
+@pytest.mark.django_db()
+def test_sync_messages_to_thread_in_batches():
+    messages = [{"role": "user", "content": f"hello{i}"} for i in range(70)]
+    adapter = Mock(spec=AssistantAdapter)
+    adapter.get_messages_to_sync_to_thread.return_value = messages
+    session = ExperimentSessionFactory()
+    history_manager = ExperimentHistoryManager.for_assistant(session, experiment=session.experiment)
+    assistant_runnable = AssistantChat(adapter=adapter, history_manager=history_manager)
+    _thread_id, to_add_with_run = assistant_runnable._sync_messages_to_thread(None)
+
+    client = adapter.assistant_client
+    assert client.beta.threads.create.call_args.kwargs["messages"] == messages[:32]
+    assert [call.kwargs for call in client.beta.threads.messages.create.call_args_list] == messages[32:39]
+    assert to_add_with_run == messages[39:]
+
+
 @pytest.mark.django_db()
 def test_get_messages_to_sync_to_thread():
     session = ExperimentSessionFactory(experiment__assistant=OpenAiAssistantFactory())
@@ -605,7 +635,7 @@ def _get_assistant_mocked_history_recording(session, get_attachments_return_valu
     adapter = AssistantAdapter.for_experiment(session.experiment, session)
     history_manager = ExperimentHistoryManager.for_assistant(session, session.experiment)
     assistant = AssistantChat(adapter=adapter, history_manager=history_manager)
-    history_manager.save_message_to_history = Mock()
+    history_manager.save_messages_to_history = Mock()
     adapter.get_attachments = lambda _type: get_attachments_return_value or []
     return assistant
 
@@ -739,3 +769,137 @@ def test_assistant_empty_messages_list(
 
     # Verify that an empty output was returned
     assert result.output == ""
+
+
+def test_wait_for_run_cancels_run_when_cancellation_event_is_set():
+    client = Mock()
+    client.beta.threads.runs.retrieve.side_effect = [
+        _create_run(ASSISTANT_ID, "thread_abc", "in_progress"),
+        _create_run(ASSISTANT_ID, "thread_abc", "cancelling"),
+    ]
+    cancellation_event = threading.Event()
+    cancellation_event.set()
+    runnable = OpenAIAssistantRunnable(assistant_id=ASSISTANT_ID, client=client, cancellation_event=cancellation_event)
+
+    run = runnable._wait_for_run("test", "thread_abc")
+    assert run.status == "cancelling"
+    client.beta.threads.runs.cancel.assert_called_once_with("test", thread_id="thread_abc")
+
+
+@pytest.fixture()
+def openai_server():
+    """A local server that stands in for the OpenAI API. POST requests respond with the server-sent `events` and
+    GET requests with the thread `messages`."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            server.requests.append(("POST", urlparse(self.path).path))
+            events = [(event, data.model_dump(mode="json")) for event, data in server.events]
+            body = "".join(f"event: {event}\ndata: {json.dumps(data)}\n\n" for event, data in events)
+            self._respond(body + "event: done\ndata: [DONE]\n\n", "text/event-stream")
+
+        def do_GET(self):
+            server.requests.append(("GET", urlparse(self.path).path))
+            data = [message.model_dump(mode="json") for message in server.messages]
+            body = {"object": "list", "data": data, "first_id": None, "last_id": None, "has_more": False}
+            self._respond(json.dumps(body), "application/json")
+
+        def _respond(self, body, content_type):
+            body = body.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.requests = []
+    server.events = []
+    server.messages = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+def test_assistant_runnable_streams_tokens(openai_server):
+    thread_id = "thread_abc"
+    openai_server.events = [
+        ("thread.run.created", _create_run(ASSISTANT_ID, thread_id, "queued")),
+        ("thread.run.in_progress", _create_run(ASSISTANT_ID, thread_id, "in_progress")),
+        ("thread.message.delta", _create_message_delta("Hel")),
+        ("thread.message.delta", _create_message_delta("lo")),
+        ("thread.run.completed", _create_run(ASSISTANT_ID, thread_id, "completed")),
+    ]
+    openai_server.messages = _create_thread_messages(
+        ASSISTANT_ID, "test", thread_id, [{"assistant": "Hello"}], include_image_file=False
+    )
+    client = openai.OpenAI(api_key="test", base_url=openai_server.url)
+    tokens = []
+    runnable = OpenAIAssistantRunnable(assistant_id=ASSISTANT_ID, client=client, token_callback=tokens.append)
+
+    response = runnable.invoke({"content": "hi"})
+
+    assert tokens == ["Hel", "lo"]
+    assert response[0].content[0].text.value == "Hello"
+    # the run is not polled
+    assert openai_server.requests == [("POST", "/threads/runs"), ("GET", f"/threads/{thread_id}/messages")]
+
+
+def test_assistant_runnable_adds_messages_with_run():
+    client = Mock()
+    client.beta.threads.runs.create.return_value = _create_run(ASSISTANT_ID, "thread_abc")
+    client.beta.threads.runs.retrieve.return_value = _create_run(ASSISTANT_ID, "thread_abc")
+    runnable = OpenAIAssistantRunnable(assistant_id=ASSISTANT_ID, client=client)
+
+    runnable.invoke(
+        {"content": "hi", "thread_id": "thread_abc", "additional_messages": [{"role": "assistant", "content": "hello"}]}
+    )
+
+    client.beta.threads.messages.create.assert_not_called()
+    additional_messages = client.beta.threads.runs.create.call_args.kwargs["additional_messages"]
+    assert [(message["role"], message["content"]) for message in additional_messages] == [
+        ("assistant", "hello"),
+        ("user", "hi"),
+    ]
+
+
+@pytest.mark.django_db()
+@patch("openai.resources.files.Files.retrieve")
+def test_cited_files_are_resolved_in_bulk(retrieve_openai_file, django_assert_num_queries, db_session):
+    retrieve_openai_file.return_value = FileObject(
+        id="remote-file",
+        bytes=1,
+        created_at=1,
+        filename="remote.txt",
+        object="file",
+        purpose="assistants",
+        status="processed",
+        status_details=None,
+    )
+    files = [FileFactory(team=db_session.team, external_id=f"local-file-{i}") for i in range(3)]
+    assistant = create_experiment_runnable(db_session.experiment, db_session)
+    assert assistant.adapter.assistant_client
+    file_ids = {file.external_id for file in files} | {"remote-file"}
+
+    with django_assert_num_queries(1):
+        links = assistant._get_file_links_for_citations(file_ids, [], allow_assistant_file_downloads=True)
+    assert links["remote-file"] == ("remote.txt", "")
+    for file in files:
+        assert links[file.external_id] == (file.name, f"file:{db_session.team.slug}:{db_session.id}:{file.id}")
+
+    # remote file names are cached
+    assistant._get_file_links_for_citations(file_ids, [], allow_assistant_file_downloads=True)
+    retrieve_openai_file.assert_called_once()
+
+
+def _create_message_delta(text):
+    return MessageDeltaEvent(
+        id="msg_abc",
+        object="thread.message.delta",
+        delta=MessageDelta(content=[TextDeltaBlock(index=0, type="text", text=TextDelta(value=text))]),
+    )
@@ -58,7 +58,7 @@ def test_assistant_tool_response(submit_tool_outputs, session):
 
 
 @patch("openai.resources.files.Files.create")  # called when tool output is being processed
-@patch("openai.resources.beta.threads.messages.Messages.create")  # called when tool output is submitted
+@patch("openai.resources.beta.threads.messages.Messages.create")
 @patch("openai.resources.beta.threads.runs.Runs.create")  # called when tool output is submitted
 @patch("openai.resources.beta.threads.runs.Runs.cancel", Mock())  # called when tool output is submitted
 @pytest.mark.django_db()
@@ -88,18 +88,22 @@ def test_assistant_tool_artifact_response(create_run, create_message, create_fil
             "\n\nFile type information:\n\n| File Path | Mime Type |" "\n| /mnt/data/file-123abc | text/plain |\n"
         )
 
-    assert create_message.call_args == (
-        ("test_thread_id",),
-        {
-            "role": "user",
-            "content": f"I have uploaded the results as a file for you to use.{file_type_info}",
-            "attachments": [{"file_id": "file-123abc", "tools": [{"type": builtin_tools[0]}] if builtin_tools else []}],
-            "metadata": None,
-        },
-    )
+    # the message is added to the thread when the run is created
+    create_message.assert_not_called()
+    message = {
+        "role": "user",
+        "content": f"I have uploaded the results as a file for you to use.{file_type_info}",
+        "attachments": [{"file_id": "file-123abc", "tools": [{"type": builtin_tools[0]}] if builtin_tools else []}],
+        "metadata": None,
+    }
     # check that the run was created with the correct tools (excluding the artifact tool)
     assert create_run.call_args_list == [
-        mock.call("test_thread_id", assistant_id="assistant_1", tools=[{"type": tool} for tool in builtin_tools])
+        mock.call(
+            "test_thread_id",
+            assistant_id="assistant_1",
+            tools=[{"type": tool} for tool in builtin_tools],
+            additional_messages=[message],
+        )
     ]
 
 
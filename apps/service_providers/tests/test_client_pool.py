@@ -0,0 +1,92 @@
+import uuid
+from unittest import mock
+
+import pytest
+
+from apps.service_providers.client_pool import ClientPool
+from apps.service_providers.messaging_service import TwilioService
+
+
+@pytest.fixture()
+def client_pool():
+    with mock.patch("threading.Thread"):
+        yield ClientPool(stale_timeout=1, max_clients=2)
+
+
+def test_get_reuses_client(client_pool):
+    factory = mock.Mock(side_effect=lambda: mock.Mock())
+    first_client = client_pool.get("test", {"token": "123"}, factory)
+    assert client_pool.get("test", {"token": "123"}, factory) is first_client
+    factory.assert_called_once()
+
+    assert client_pool.get("test", {"token": "456"}, factory) is not first_client
+    assert client_pool.get("other", {"token": "123"}, factory) is not first_client
+    assert factory.call_count == 3
+
+
+def test_concurrently_created_client_is_discarded(client_pool):
+    close = mock.Mock()
+    existing_client = mock.Mock()
+
+    def factory():
+        # another thread adds a client with the same config while this one is being created
+        client_pool.get("test", {"token": "123"}, lambda: existing_client, close=close)
+        return mock.Mock()
+
+    assert client_pool.get("test", {"token": "123"}, factory, close=close) is existing_client
+    assert len(client_pool.clients) == 1
+    close.assert_called_once()
+    assert close.call_args[0][0] is not existing_client
+
+
+def test_config_is_not_stored(client_pool):
+    client_pool.get("test", {"token": "secret-token"}, mock.Mock)
+    assert "secret-token" not in str(client_pool.clients.keys())
+
+
+def test_prune_stale_clients(client_pool):
+    close = mock.Mock()
+    with mock.patch("time.time", return_value=100):
+        stale_client = client_pool.get("test", {"token": "1"}, mock.Mock, close=close)
+    with mock.patch("time.time", return_value=101.5):
+        client_pool.get("test", {"token": "2"}, mock.Mock, close=close)
+        client_pool._prune_stale()
+
+    assert len(client_pool.clients) == 1
+    assert stale_client not in [client for _, client, _ in client_pool.clients.values()]
+    # the stale client may still be in use so it isn't closed
+    close.assert_not_called()
+
+
+def test_max_clients_limit(client_pool):
+    clients = []
+    for i in range(3):
+        with mock.patch("time.time", return_value=100 + i / 10):
+            clients.append(client_pool.get("test", {"token": i}, mock.Mock, close=lambda client: client.close()))
+
+    with mock.patch("time.time", return_value=100.5):
+        client_pool._prune_stale()
+
+    assert len(client_pool.clients) == 2
+    clients[0].close.assert_not_called()
+    assert clients[0] not in [client for _, client, _ in client_pool.clients.values()]
+    assert clients[1] in [client for _, client, _ in client_pool.clients.values()]
+
+
+def test_clear_closes_clients(client_pool):
+    close = mock.Mock()
+    client = client_pool.get("test", {"token": "1"}, mock.Mock, close=close)
+    client_pool.clear()
+
+    assert not client_pool.clients
+    close.assert_called_once_with(client)
+
+
+def test_twilio_clients_are_shared():
+    account_sid = uuid.uuid4().hex
+    with mock.patch("apps.service_providers.messaging_service.Client") as client_cls:
+        first = TwilioService(account_sid=account_sid, auth_token="token").client
+        second = TwilioService(account_sid=account_sid, auth_token="token").client
+
+    assert first is second
+    client_cls.assert_called_once_with(account_sid, "token")
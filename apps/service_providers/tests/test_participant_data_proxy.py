@@ -0,0 +1,69 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from apps.experiments.models import ParticipantData
+from apps.service_providers.llm_service.prompt_context import ParticipantDataProxy
+from apps.utils.factories.experiment import ExperimentSessionFactory
+
+
+@pytest.fixture()
+def session(db):
+    return ExperimentSessionFactory()
+
+
+@pytest.fixture()
+def participant_data(session):
+    return ParticipantData.objects.create(
+        team=session.team,
+        experiment=session.experiment,
+        participant=session.participant,
+        data={"color": "green", "number": 1},
+    )
+
+
+def _get_data(participant_data):
+    participant_data.refresh_from_db()
+    return participant_data.data
+
+
+def test_shared_proxy_loads_once(session, participant_data):
+    assert ParticipantDataProxy.for_session(session) is ParticipantDataProxy.for_session(session)
+
+    ParticipantDataProxy.for_session(session).get()
+    with CaptureQueriesContext(connection) as queries:
+        ParticipantDataProxy.for_session(session).get()
+        ParticipantDataProxy.for_session(session).get_timezone()
+    assert not queries.captured_queries
+
+
+def test_shared_proxy_writes_at_end_of_turn(session, participant_data):
+    proxy = ParticipantDataProxy.for_session(session)
+    proxy.set({"color": "blue"})
+    proxy.update({"number": 2})
+    assert proxy.get()["color"] == "blue"
+    assert _get_data(participant_data) == {"color": "green", "number": 1}
+
+    with CaptureQueriesContext(connection) as queries:
+        ParticipantDataProxy.end_turn(session)
+    assert len([query for query in queries.captured_queries if query["sql"].startswith("UPDATE")]) == 1
+    assert _get_data(participant_data) == {"color": "blue", "number": 2}
+
+    # the next turn gets a new proxy
+    assert ParticipantDataProxy.for_session(session) is not proxy
+
+
+def test_concurrent_changes_are_not_lost(session, participant_data):
+    proxy = ParticipantDataProxy.for_session(session)
+    proxy.set({"color": "blue"})
+
+    other = ParticipantDataProxy(session)
+    other.update({"name": "Dimagi", "number": 2})
+
+    ParticipantDataProxy.end_turn(session)
+    assert _get_data(participant_data) == {"color": "blue", "name": "Dimagi"}
+
+
+def test_proxy_without_turn_writes_immediately(session, participant_data):
+    ParticipantDataProxy(session).update({"color": "blue"})
+    assert _get_data(participant_data)["color"] == "blue"
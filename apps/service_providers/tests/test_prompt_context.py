@@ -22,7 +22,9 @@ def mock_session():
     proxy_mock.get.return_value = {"name": "Dimagi", "email": "hello@world.com"}
     proxy_mock.get_timezone.return_value = "UTC"
     session._proxy_mock = proxy_mock
-    with patch("apps.service_providers.llm_service.prompt_context.ParticipantDataProxy", return_value=proxy_mock):
+    with patch(
+        "apps.service_providers.llm_service.prompt_context.ParticipantDataProxy.for_session", return_value=proxy_mock
+    ):
         yield session
 
 
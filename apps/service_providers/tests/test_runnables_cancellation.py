@@ -4,6 +4,7 @@ import pytest
 from langchain_core.messages import AIMessageChunk
 
 from apps.chat.agent.tools import OneOffReminderTool
+from apps.chat.cancellation import cancellation_manager
 from apps.chat.models import Chat
 from apps.experiments.models import AgentTools
 from apps.service_providers.llm_service.adapters import ChatAdapter
@@ -73,7 +74,7 @@ def _test_runnable(runnable, session, expected_output):
             """Simulate a cancellation after the 2nd token."""
             for i, token in enumerate(orig_stream(*args, **kwargs)):
                 if i == 1:
-                    session.chat.metadata = {"cancelled": True}
+                    cancellation_manager.cancel(session.chat_id)
                 yield token
 
         chain.__dict__["stream"] = _stream
@@ -92,6 +93,25 @@ def _get_runnable_with_mocked_history(session, runnable_cls):
         session=session,
         experiment=session.experiment,
     )
-    runnable = runnable_cls(adapter=adapter, history_manager=history_manager, check_every_ms=0)
+    runnable = runnable_cls(adapter=adapter, history_manager=history_manager)
     history_manager.add_messages_to_history = Mock()
     return runnable
+
+
+def test_cancel_after_generation_finished():
+    with cancellation_manager.track(chat_id=-1) as cancelled:
+        assert not cancelled.is_set()
+
+    assert cancellation_manager.cancel(chat_id=-1) is False
+
+
+def test_finished_generation_does_not_clear_newer_generation():
+    older = cancellation_manager.track(chat_id=-2)
+    newer = cancellation_manager.track(chat_id=-2)
+    older.__enter__()
+    newer_cancelled = newer.__enter__()
+    older.__exit__(None, None, None)
+
+    assert cancellation_manager.cancel(chat_id=-2) is True
+    assert newer_cancelled.is_set()
+    newer.__exit__(None, None, None)
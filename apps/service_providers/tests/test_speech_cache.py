@@ -0,0 +1,77 @@
+from io import BytesIO
+from unittest import mock
+
+import pytest
+
+from apps.service_providers.models import SpeechCacheEntry, SpeechCacheStats
+from apps.service_providers.speech_cache import get_cache_key, speech_cache
+from apps.service_providers.speech_service import SynthesizedAudio
+from apps.utils.factories.experiment import SyntheticVoiceFactory
+from apps.utils.factories.service_provider_factories import VoiceProviderFactory
+
+
+@pytest.fixture()
+def voice_provider(db):
+    return VoiceProviderFactory()
+
+
+@pytest.fixture()
+def synthetic_voice(db):
+    return SyntheticVoiceFactory()
+
+
+@pytest.fixture(autouse=True)
+def _media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+
+
+@pytest.fixture()
+def synthesize_voice():
+    with mock.patch("apps.service_providers.speech_service.AWSSpeechService._synthesize_voice") as synthesize_voice:
+        synthesize_voice.side_effect = lambda text, voice: SynthesizedAudio(
+            audio=BytesIO(text.encode()), duration=1.5, format="mp3"
+        )
+        yield synthesize_voice
+
+
+def test_cache_key_normalizes_text(voice_provider, synthetic_voice):
+    key = get_cache_key(voice_provider, synthetic_voice, "mp3", "Hello  there\n")
+    assert key == get_cache_key(voice_provider, synthetic_voice, "mp3", "Hello there")
+    assert key != get_cache_key(voice_provider, synthetic_voice, "wav", "Hello there")
+    assert key != get_cache_key(voice_provider, synthetic_voice, "mp3", "Hello")
+
+
+@pytest.mark.django_db()
+def test_cache_hit_skips_provider(voice_provider, synthetic_voice, synthesize_voice):
+    first = speech_cache.synthesize_voice(voice_provider, synthetic_voice, "Hello there")
+    second = speech_cache.synthesize_voice(voice_provider, synthetic_voice, " Hello there ")
+
+    synthesize_voice.assert_called_once()
+    assert second.get_audio_bytes("mp3") == first.get_audio_bytes("mp3") == b"Hello there"
+    assert second.duration == 1.5
+    assert SpeechCacheEntry.objects.get().hit_count == 1
+    stats = SpeechCacheStats.objects.get(team=voice_provider.team)
+    assert (stats.hits, stats.misses) == (1, 1)
+    assert stats.hit_rate == 0.5
+
+
+@pytest.mark.django_db()
+def test_long_text_is_not_cached(settings, voice_provider, synthetic_voice, synthesize_voice):
+    settings.SPEECH_CACHE_MAX_TEXT_LENGTH = 5
+    speech_cache.synthesize_voice(voice_provider, synthetic_voice, "Hello there")
+    speech_cache.synthesize_voice(voice_provider, synthetic_voice, "Hello there")
+
+    assert synthesize_voice.call_count == 2
+    assert not SpeechCacheEntry.objects.exists()
+
+
+@pytest.mark.django_db()
+def test_least_recently_used_audio_is_evicted(settings, voice_provider, synthetic_voice, synthesize_voice):
+    settings.SPEECH_CACHE_MAX_SIZE = 10
+    speech_cache.synthesize_voice(voice_provider, synthetic_voice, "first")
+    speech_cache.synthesize_voice(voice_provider, synthetic_voice, "second")
+    speech_cache.synthesize_voice(voice_provider, synthetic_voice, "third")
+
+    remaining = SpeechCacheEntry.objects.all()
+    assert {entry.size for entry in remaining} == {len("third")}
+    assert sum(entry.size for entry in remaining) <= settings.SPEECH_CACHE_MAX_SIZE
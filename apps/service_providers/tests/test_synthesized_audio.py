@@ -21,3 +21,14 @@ def test_synthesized_audio(source_format, target_format, codec, conversion_expec
             convert_audio.assert_called()
         else:
             convert_audio.assert_not_called()
+
+
+def test_synthesized_audio_is_converted_once():
+    audio = SynthesizedAudio(audio=BytesIO(b"123"), duration=10.0, format="mp3")
+
+    with mock.patch("apps.service_providers.speech_service.convert_audio") as convert_audio:
+        convert_audio.return_value = BytesIO(b"321")
+        assert audio.get_audio_bytes("ogg", "libopus") == b"321"
+        assert audio.get_audio_bytes("ogg", "libopus") == b"321"
+
+    convert_audio.assert_called_once()
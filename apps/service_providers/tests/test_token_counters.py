@@ -0,0 +1,109 @@
+import math
+from unittest import mock
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from apps.service_providers.llm_service import OpenAILlmService
+from apps.service_providers.llm_service.token_counters import (
+    GeminiTokenCounter,
+    LlmTokenCounter,
+    OpenAITokenCounter,
+    TokenCountCache,
+    _get_gemini_calibration_ratio,
+    gemini_calibration_ratios,
+    get_token_counter,
+    token_count_cache,
+)
+
+
+@pytest.fixture(autouse=True)
+def _clear_caches():
+    token_count_cache.clear()
+    gemini_calibration_ratios.clear()
+    yield
+    token_count_cache.clear()
+    gemini_calibration_ratios.clear()
+
+
+def test_token_count_cache():
+    cache = TokenCountCache(max_size=2)
+    count_texts = mock.Mock(side_effect=lambda texts: [len(text) for text in texts])
+
+    assert cache.get_or_count("test", ["a", "bb"], count_texts) == [1, 2]
+    assert cache.get_or_count("test", ["bb", "ccc"], count_texts) == [2, 3]
+    assert count_texts.call_args_list == [mock.call(["a", "bb"]), mock.call(["ccc"])]
+
+    # "a" was evicted
+    count_texts.reset_mock()
+    assert cache.get_or_count("test", ["a", "bb"], count_texts) == [1, 2]
+    count_texts.assert_called_once_with(["a"])
+
+    # counts aren't shared between tokenizers
+    count_texts.reset_mock()
+    cache.get_or_count("other", ["a"], count_texts)
+    count_texts.assert_called_once_with(["a"])
+
+
+def test_openai_counter_caches_counts():
+    counter = OpenAITokenCounter("gpt-4o")
+    with mock.patch.object(OpenAITokenCounter, "_count_texts", wraps=counter._count_texts) as count_texts:
+        counts = counter.get_tokens_from_texts(["Hello", "Hello world"])
+        assert counter.get_tokens_from_texts(["Hello world", "Hello"]) == counts[::-1]
+    count_texts.assert_called_once_with(["Hello", "Hello world"])
+
+
+@pytest.mark.parametrize("model", ["gpt-3.5-turbo", "gpt-4", "gpt-4o", "ft:gpt-4o-mini-2024-07-18:abc::xyz"])
+def test_openai_counter_matches_llm(model):
+    llm = OpenAILlmService(openai_api_key="123").get_chat_model(model, 0.5)
+    messages = [SystemMessage("Be nice"), HumanMessage("Hello"), AIMessage("Hi! How can I help you today?")]
+    counter = get_token_counter(llm)
+    assert counter.get_tokens_per_message(messages) == [
+        llm.get_num_tokens_from_messages([message]) for message in messages
+    ]
+
+
+@mock.patch("apps.service_providers.llm_service.token_counters.GenerativeServiceClient")
+def test_gemini_counter_is_calibrated_once(client):
+    client.return_value.count_tokens.return_value.total_tokens = 1000
+    counter = GeminiTokenCounter("gemini-1.5-flash", "123")
+    ratio = _get_gemini_calibration_ratio("gemini-1.5-flash", "123")
+
+    assert counter.get_tokens_from_text("Hello world") == math.ceil(2 * ratio)
+    assert counter.get_tokens_from_messages(["Hello world", {"content": "This is a longer piece of text"}]) > 0
+    client.return_value.count_tokens.assert_called_once()
+    client.assert_called_once_with(client_options={"api_key": "123"})
+
+
+@mock.patch("apps.service_providers.llm_service.token_counters.GenerativeServiceClient")
+def test_gemini_counter_falls_back_to_estimate(client):
+    client.side_effect = Exception("No network")
+    counter = GeminiTokenCounter("gemini-1.5-flash", "123")
+    assert counter.get_tokens_from_text("Hello world") == 2
+    assert not counter.counts_are_stable
+    # the uncalibrated estimate isn't cached
+    assert not token_count_cache.counts
+
+    # calibration isn't retried until the retry interval has passed
+    client.side_effect = None
+    client.return_value.count_tokens.return_value.total_tokens = 1000
+    assert _get_gemini_calibration_ratio("gemini-1.5-flash", "123") is None
+    client.return_value.count_tokens.assert_not_called()
+
+
+@mock.patch("apps.service_providers.llm_service.token_counters.CALIBRATION_RETRY_INTERVAL", 0)
+@mock.patch("apps.service_providers.llm_service.token_counters.GenerativeServiceClient")
+def test_gemini_calibration_failure_is_not_cached(client):
+    client.return_value.count_tokens.side_effect = Exception("No network")
+    assert _get_gemini_calibration_ratio("gemini-1.5-flash", "123") is None
+
+    client.return_value.count_tokens.side_effect = None
+    client.return_value.count_tokens.return_value.total_tokens = 1000
+    assert _get_gemini_calibration_ratio("gemini-1.5-flash", "123") > 1.0
+
+
+def test_llm_counter():
+    llm = mock.Mock()
+    llm.get_num_tokens_from_messages.side_effect = lambda messages: len(messages[0].content)
+    counter = LlmTokenCounter(llm)
+    assert counter.get_tokens_from_messages([HumanMessage("Hello"), AIMessage("Hi")]) == 7
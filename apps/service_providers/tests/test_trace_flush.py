@@ -0,0 +1,170 @@
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import pytest
+
+from apps.service_providers.tracing import LangFuseTraceService
+from apps.service_providers.tracing.base import TraceService, is_sampled
+from apps.service_providers.tracing.callback import DeferredCallbackHandler
+from apps.service_providers.tracing.flush import FlushWorker
+
+
+@pytest.fixture()
+def stub_server():
+    """A local HTTP server that records the requests it receives and responds slowly to simulate a remote
+    trace provider."""
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            requests.append((self.path, json.loads(body)))
+            time.sleep(0.5)
+            response = json.dumps({"successes": [], "errors": []}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.requests = requests
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    yield server
+    server.shutdown()
+
+
+def test_flushes_are_combined():
+    worker = FlushWorker(max_latency=0.1)
+    flush = mock.Mock()
+    for _ in range(3):
+        worker.submit("client", flush)
+
+    worker.shutdown(timeout=1)
+    flush.assert_called_once()
+
+
+def test_flush_runs_within_max_latency():
+    worker = FlushWorker(max_latency=0.05)
+    flushed = threading.Event()
+
+    start = time.monotonic()
+    worker.submit("client", flushed.set)
+
+    assert flushed.wait(timeout=1)
+    assert time.monotonic() - start < 0.5
+
+
+def test_submit_does_not_block_when_queue_is_full():
+    worker = FlushWorker(max_queue_size=1)
+    with mock.patch.object(worker, "_ensure_started"):
+        assert worker.submit("client1", mock.Mock())
+        assert not worker.submit("client2", mock.Mock())
+
+
+def test_flush_errors_are_logged():
+    worker = FlushWorker(max_latency=0)
+    flush = mock.Mock()
+    worker.submit("broken", mock.Mock(side_effect=Exception("boom")))
+    worker.submit("client", flush)
+
+    worker.shutdown(timeout=1)
+    flush.assert_called_once()
+
+
+def test_langfuse_end_does_not_wait_for_flush(stub_server):
+    worker = FlushWorker(max_latency=0)
+    config = {"public_key": f"pk-{uuid.uuid4()}", "secret_key": "sk", "host": stub_server.url}
+    service = LangFuseTraceService("langfuse", config)
+    with mock.patch("apps.service_providers.tracing.langfuse.flush_worker", worker):
+        service.get_callback(trace_name="test trace", participant_id="participant", session_id="session")
+
+        start = time.monotonic()
+        service.end()
+        assert time.monotonic() - start < 0.5
+
+    worker.shutdown(timeout=5)
+    batches = [body["batch"] for path, body in stub_server.requests if path == "/api/public/ingestion"]
+    events = [event for batch in batches for event in batch]
+    assert any(event["body"].get("name") == "test trace" for event in events)
+
+
+@pytest.mark.parametrize(("sample_rate", "expected"), [(1, True), (0, False)])
+def test_is_sampled_bounds(sample_rate, expected):
+    assert all(is_sampled(str(uuid.uuid4()), sample_rate) == expected for _ in range(100))
+
+
+def test_is_sampled_rate():
+    sampled = sum(is_sampled(str(uuid.uuid4()), 0.05) for _ in range(10000))
+    assert 300 < sampled < 700
+
+
+def test_is_sampled_is_consistent_for_a_session():
+    session_id = str(uuid.uuid4())
+    assert len({is_sampled(session_id, 0.5) for _ in range(10)}) == 1
+
+
+class FakeTraceService(TraceService):
+    def __init__(self, sample_rate):
+        super().__init__("fake", {}, sample_rate)
+        self.callback = mock.Mock()
+        self.ended = False
+
+    def _get_callback(self, trace_name: str, participant_id: str, session_id: str):
+        return self.callback
+
+    def _get_trace_metadata(self):
+        return {"trace_id": "123"}
+
+    def _end(self):
+        self.ended = True
+
+
+def test_unsampled_runs_are_not_traced():
+    service = FakeTraceService(sample_rate=0)
+    callback = service.get_callback(trace_name="test", participant_id="participant", session_id="session")
+    assert isinstance(callback, DeferredCallbackHandler)
+
+    callback.on_chain_start({}, {"input": "hi"}, run_id=uuid.uuid4())
+    callback.on_chain_end({"output": "hello"}, run_id=uuid.uuid4())
+    assert service.get_trace_metadata() == {}
+
+    service.end()
+    assert service.callback.method_calls == []
+    assert not service.ended
+
+
+def test_unsampled_runs_are_traced_on_error():
+    service = FakeTraceService(sample_rate=0)
+    callback = service.get_callback(trace_name="test", participant_id="participant", session_id="session")
+
+    run_id = uuid.uuid4()
+    error = Exception("boom")
+    callback.on_chain_start({}, {"input": "hi"}, run_id=run_id)
+    callback.on_chain_error(error, run_id=run_id)
+
+    service.end()
+    assert service.callback.method_calls == [
+        mock.call.on_chain_start({}, {"input": "hi"}, run_id=run_id),
+        mock.call.on_chain_error(error, run_id=run_id),
+    ]
+    assert service.ended
+
+
+def test_sampled_runs_are_traced():
+    service = FakeTraceService(sample_rate=1)
+    callback = service.get_callback(trace_name="test", participant_id="participant", session_id="session")
+    assert callback is service.callback
+    assert service.get_trace_metadata() == {"trace_id": "123"}
+
+    service.end()
+    assert service.ended
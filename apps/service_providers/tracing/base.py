@@ -1,5 +1,9 @@
+import hashlib
+
 from langchain_core.callbacks import BaseCallbackHandler
 
+from .callback import DeferredCallbackHandler
+
 
 class ServiceReentryException(Exception):
     pass
@@ -10,15 +14,57 @@ class ServiceNotInitializedException(Exception):
 
 
 class TraceService:
-    def __init__(self, type_, config: dict):
+    """Base class for trace services.
+
+    Sessions are sampled for tracing at `sample_rate`. Runs in sessions that aren't sampled are recorded by a
+    `DeferredCallbackHandler` and are only sent to the trace provider if they fail.
+
+    Subclasses implement `_get_callback`, `_get_trace_metadata` and `_end`.
+    """
+
+    def __init__(self, type_, config: dict, sample_rate: float = 1.0):
         self.type = type_
         self.config = config
+        self.sample_rate = sample_rate
+        self.deferred_callback: DeferredCallbackHandler | None = None
+        self._trace_kwargs: dict | None = None
 
     def get_callback(self, trace_name: str, participant_id: str, session_id: str) -> BaseCallbackHandler:
-        raise NotImplementedError
+        if is_sampled(session_id, self.sample_rate):
+            return self._get_callback(trace_name=trace_name, participant_id=participant_id, session_id=session_id)
+
+        self._trace_kwargs = {"trace_name": trace_name, "participant_id": participant_id, "session_id": session_id}
+        self.deferred_callback = DeferredCallbackHandler()
+        return self.deferred_callback
 
     def get_trace_metadata(self) -> dict[str, str]:
-        return {}
+        if self.deferred_callback:
+            return {}
+        return self._get_trace_metadata()
 
     def end(self):
+        if self.deferred_callback:
+            deferred_callback, self.deferred_callback = self.deferred_callback, None
+            if not deferred_callback.has_errors:
+                return
+            deferred_callback.replay(self._get_callback(**self._trace_kwargs))
+        self._end()
+
+    def _get_callback(self, trace_name: str, participant_id: str, session_id: str) -> BaseCallbackHandler:
+        raise NotImplementedError
+
+    def _get_trace_metadata(self) -> dict[str, str]:
+        return {}
+
+    def _end(self):
         pass
+
+
+def is_sampled(session_id: str, sample_rate: float) -> bool:
+    """Sample sessions deterministically so that all the runs in a session are either traced or not."""
+    if sample_rate >= 1:
+        return True
+    if sample_rate <= 0:
+        return False
+    digest = hashlib.blake2b(session_id.encode(), digest_size=8).digest()
+    return int.from_bytes(digest) / 2**64 < sample_rate
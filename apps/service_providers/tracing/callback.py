@@ -1,3 +1,4 @@
+import logging
 from dataclasses import asdict, is_dataclass
 from typing import Any
 
@@ -7,6 +8,8 @@ from pydantic import BaseModel
 
 from apps.utils.proxy import Proxy
 
+logger = logging.getLogger("ocs.tracing")
+
 
 class CallbackWrapper(Proxy):
     def on_chain_start(
@@ -53,3 +56,61 @@ def safe_serialize(obj: Any) -> Any:
     if isinstance(obj, Model):
         return str(obj)
     return obj
+
+
+CALLBACK_EVENTS = [
+    "on_llm_start",
+    "on_chat_model_start",
+    "on_llm_new_token",
+    "on_llm_end",
+    "on_llm_error",
+    "on_chain_start",
+    "on_chain_end",
+    "on_chain_error",
+    "on_tool_start",
+    "on_tool_end",
+    "on_tool_error",
+    "on_retriever_start",
+    "on_retriever_end",
+    "on_retriever_error",
+    "on_agent_action",
+    "on_agent_finish",
+    "on_text",
+    "on_retry",
+    "on_custom_event",
+]
+ERROR_EVENTS = {"on_llm_error", "on_chain_error", "on_tool_error", "on_retriever_error"}
+
+
+class DeferredCallbackHandler(BaseCallbackHandler):
+    """Records callback events so that they can be sent to a trace callback after the run has finished.
+
+    This is used for runs that aren't sampled for tracing. If the run fails the recorded events are replayed to the
+    trace callback so that failed runs are always traced, otherwise they are discarded.
+    """
+
+    def __init__(self):
+        self.events: list[tuple[str, tuple, dict]] = []
+        self.has_errors = False
+
+    def replay(self, callback: BaseCallbackHandler):
+        for name, args, kwargs in self.events:
+            try:
+                getattr(callback, name)(*args, **kwargs)
+            except Exception:
+                logger.exception("Error replaying '%s' event to trace callback", name)
+        self.events = []
+
+
+def _record_event(name: str):
+    def record(self, *args, **kwargs):
+        if name in ERROR_EVENTS:
+            self.has_errors = True
+        self.events.append((name, args, kwargs))
+
+    record.__name__ = name
+    return record
+
+
+for _name in CALLBACK_EVENTS:
+    setattr(DeferredCallbackHandler, _name, _record_event(_name))
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+from collections.abc import Callable, Hashable
+
+from django.conf import settings
+
+logger = logging.getLogger("ocs.tracing.flush")
+
+_STOP = object()
+
+
+class FlushWorker:
+    """Flushes trace clients from a background thread so that requests don't wait for traces to be sent.
+
+    `submit` only adds the flush to a bounded queue. Each flush runs at most `max_latency` seconds after it was
+    submitted and flushes submitted with the same key in the meantime are combined, so a busy client is flushed
+    once per `max_latency` seconds rather than once per run.
+
+    If the queue is full the flush is dropped. The clients send events from their own background threads so
+    dropping a flush only delays the trace.
+
+    Usage:
+
+        flush_worker.submit(id(client), client.flush)
+    """
+
+    def __init__(self, max_queue_size=1000, max_latency=1.0) -> None:
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self.max_latency = max_latency
+        self.lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def submit(self, key: Hashable, flush: Callable[[], None]) -> bool:
+        """Queue `flush` to be called from the worker thread. Returns False if the queue is full."""
+        self._ensure_started()
+        try:
+            self.queue.put_nowait((key, flush))
+        except queue.Full:
+            logger.warning("Trace flush queue is full, dropping flush for '%s'", key)
+            return False
+        return True
+
+    def _ensure_started(self):
+        # The thread is started on first use rather than on import so that forked worker processes start their own
+        if self._thread and self._thread.is_alive():
+            return
+
+        with self.lock:
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, daemon=True)
+                self._thread.start()
+
+    def _worker(self):
+        pending: dict[Hashable, tuple[float, Callable[[], None]]] = {}
+        while True:
+            timeout = max(0, min(deadline for deadline, _ in pending.values()) - time.monotonic()) if pending else None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._flush(pending, force=True)
+                return
+
+            if item:
+                key, flush = item
+                if key not in pending:
+                    pending[key] = (time.monotonic() + self.max_latency, flush)
+            self._flush(pending)
+
+    def _flush(self, pending: dict, force=False):
+        now = time.monotonic()
+        for key in [key for key, (deadline, _) in pending.items() if force or deadline <= now]:
+            _, flush = pending.pop(key)
+            try:
+                flush()
+            except Exception:
+                logger.exception("Error flushing traces for '%s'", key)
+
+    def shutdown(self, timeout: float | None = None):
+        """Flush everything that has been submitted and stop the worker thread."""
+        if not self._thread or not self._thread.is_alive():
+            return
+
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning("Timed out waiting to stop the trace flush worker")
+            return
+        self._thread.join(timeout)
+
+
+flush_worker = FlushWorker(max_queue_size=settings.TRACE_FLUSH_QUEUE_SIZE, max_latency=settings.TRACE_FLUSH_MAX_LATENCY)
@@ -10,6 +10,7 @@ from typing import TYPE_CHECKING, Any
 from . import TraceService
 from .base import ServiceNotInitializedException, ServiceReentryException
 from .callback import wrap_callback
+from .flush import flush_worker
 
 if TYPE_CHECKING:
     from langchain.callbacks.base import BaseCallbackHandler
@@ -25,14 +26,17 @@ class LangFuseTraceService(TraceService):
 
     The API is designed to be used with a single set of credentials whereas we need to provide
     different credentials per call. This is why we don't use the standard 'observe' decorator.
+
+    Clients are shared between requests and flushed by the background `flush_worker` so that requests don't wait
+    for their traces to be sent.
     """
 
-    def __init__(self, type_, config: dict):
-        super().__init__(type_, config)
+    def __init__(self, type_, config: dict, sample_rate: float = 1.0):
+        super().__init__(type_, config, sample_rate)
         self.client = None
         self.trace = None
 
-    def get_callback(self, trace_name: str, participant_id: str, session_id: str) -> BaseCallbackHandler:
+    def _get_callback(self, trace_name: str, participant_id: str, session_id: str) -> BaseCallbackHandler:
         from langfuse.callback import CallbackHandler
 
         if self.trace:
@@ -48,7 +52,7 @@ class LangFuseTraceService(TraceService):
         )
         return wrap_callback(callback)
 
-    def get_trace_metadata(self) -> dict[str, str]:
+    def _get_trace_metadata(self) -> dict[str, str]:
         if not self.trace:
             raise ServiceNotInitializedException("Service not initialized.")
 
@@ -60,10 +64,10 @@ class LangFuseTraceService(TraceService):
             "trace_provider": self.type,
         }
 
-    def end(self):
+    def _end(self):
         if not self.client:
             raise ServiceNotInitializedException("Service not initialized.")
-        self.client.flush()
+        flush_worker.submit(id(self.client), self.client.flush)
 
 
 class ClientManager:
@@ -141,5 +145,6 @@ client_manager = ClientManager()
 
 @atexit.register
 def _shutdown():
-    """Shutdown the client manager when the program exits."""
+    """Flush pending traces and shutdown the client manager when the program exits."""
+    flush_worker.shutdown(timeout=10)
     client_manager.shutdown()
@@ -4,19 +4,28 @@ from typing import TYPE_CHECKING
 
 from langchain_core.tracers import LangChainTracer
 
+from apps.service_providers.client_pool import client_pool
+
 from . import TraceService
+from .flush import flush_worker
 
 if TYPE_CHECKING:
     from langchain.callbacks.base import BaseCallbackHandler
 
 
 class LangSmithTraceService(TraceService):
-    def get_callback(self, trace_name: str, participant_id: str, session_id: str) -> BaseCallbackHandler:
+    def __init__(self, type_, config: dict, sample_rate: float = 1.0):
+        super().__init__(type_, config, sample_rate)
+        self.tracer = None
+
+    def _get_callback(self, trace_name: str, participant_id: str, session_id: str) -> BaseCallbackHandler:
         from langsmith import Client
 
-        client = Client(
-            api_url=self.config["api_url"],
-            api_key=self.config["api_key"],
-        )
+        client_config = {"api_url": self.config["api_url"], "api_key": self.config["api_key"]}
+        client = client_pool.get("langsmith", client_config, lambda: Client(**client_config))
+        self.tracer = LangChainTracer(client=client, project_name=self.config["project"])
+        return self.tracer
 
-        return LangChainTracer(client=client, project_name=self.config["project"])
+    def _end(self):
+        if self.tracer:
+            flush_worker.submit(id(self.tracer), self.tracer.wait_for_futures)
@@ -110,6 +110,7 @@ class FakeLlmService(LlmService):
 class FakeAssistant(RunnableSerializable[dict, OutputType]):
     responses: list
     i: int = 0
+    cancellation_event: Any = None
 
     def invoke(self, input: dict, config: RunnableConfig | None = None) -> OutputType:
         response = self._get_next_response()
@@ -21,6 +21,7 @@ def project_meta(request):
         # then reference them as {{ project_settings.MY_VALUE }} in templates
         "project_settings": {
             "ACCOUNT_SIGNUP_PASSWORD_ENTER_TWICE": settings.ACCOUNT_SIGNUP_PASSWORD_ENTER_TWICE,
+            "CHAT_EVENT_STREAM_ENABLED": settings.CHAT_EVENT_STREAM_ENABLED,
         },
         "use_i18n": getattr(settings, "USE_I18N", False) and len(getattr(settings, "LANGUAGES", [])) > 1,
         "signup_enabled": settings.SIGNUP_ENABLED,
@@ -397,6 +397,9 @@ if REDIS_URL.startswith("rediss"):
 
 CELERY_BROKER_URL = CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+CELERY_TASK_ROUTES = {
+    "apps.events.tasks.fire_scheduled_message": {"queue": "scheduled_messages"},
+}
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
@@ -627,6 +630,55 @@ COMMCARE_CONNECT_SERVER_URL = env("COMMCARE_CONNECT_SERVER_URL", default="https:
 COMMCARE_CONNECT_GET_CONNECT_ID_URL = f"{COMMCARE_CONNECT_SERVER_URL}/o/userinfo/"
 
 
+# Pipelines
+# Maximum number of compiled pipeline graphs to keep in memory per process
+PIPELINE_RUNNABLE_CACHE_SIZE = env.int("PIPELINE_RUNNABLE_CACHE_SIZE", default=128)
+# Maximum number of compiled Python node code objects to keep in memory per process
+CODE_NODE_CACHE_SIZE = env.int("CODE_NODE_CACHE_SIZE", default=256)
+# Maximum number of compiled template node templates to keep in memory per process
+PIPELINE_TEMPLATE_CACHE_SIZE = env.int("PIPELINE_TEMPLATE_CACHE_SIZE", default=256)
+
+# Chat
+# Push web chat responses to the browser over server-sent events instead of polling. Each open chat holds a
+# connection (and, under WSGI, a web worker thread) for up to 5 minutes, so this should only be enabled when the web
+# process is served by an ASGI server.
+CHAT_EVENT_STREAM_ENABLED = env.bool("CHAT_EVENT_STREAM_ENABLED", default=False)
+# Maximum number of published experiment versions to keep bot configuration for in memory per process
+TOPIC_BOT_BLUEPRINT_CACHE_SIZE = env.int("TOPIC_BOT_BLUEPRINT_CACHE_SIZE", default=128)
+# Maximum age in seconds of cached bot configuration
+TOPIC_BOT_BLUEPRINT_CACHE_TIMEOUT = env.int("TOPIC_BOT_BLUEPRINT_CACHE_TIMEOUT", default=300)
+# Maximum number of custom action operation tool definitions to keep in memory per process
+CUSTOM_ACTION_TOOL_CACHE_SIZE = env.int("CUSTOM_ACTION_TOOL_CACHE_SIZE", default=256)
+# Maximum number of system tag IDs (e.g. bot and version tags) to keep in memory per process
+CHAT_SYSTEM_TAG_CACHE_SIZE = env.int("CHAT_SYSTEM_TAG_CACHE_SIZE", default=1024)
+
+# Channels
+# Time in seconds to wait for more messages from a participant before the bot responds to all of them at once
+INBOUND_MESSAGE_DEBOUNCE = env.float("INBOUND_MESSAGE_DEBOUNCE", default=1.5)
+# Whether to reuse synthesized audio for voice replies with the same text
+SPEECH_CACHE_ENABLED = env.bool("SPEECH_CACHE_ENABLED", default=True)
+# Maximum length of text to keep synthesized audio for
+SPEECH_CACHE_MAX_TEXT_LENGTH = env.int("SPEECH_CACHE_MAX_TEXT_LENGTH", default=500)
+# Maximum size in bytes of each team's synthesized audio before the least recently used audio is removed
+SPEECH_CACHE_MAX_SIZE = env.int("SPEECH_CACHE_MAX_SIZE", default=100 * 1024 * 1024)
+
+# Events
+# Maximum number of due scheduled messages to claim per query when polling
+SCHEDULED_MESSAGE_BATCH_SIZE = env.int("SCHEDULED_MESSAGE_BATCH_SIZE", default=500)
+# Time in seconds that a claimed scheduled message waits to be fired before it can be claimed by another poll
+SCHEDULED_MESSAGE_CLAIM_TIMEOUT = env.int("SCHEDULED_MESSAGE_CLAIM_TIMEOUT", default=60 * 60)
+# Maximum number of scheduled messages to fire per second for each team
+SCHEDULED_MESSAGE_TEAM_RATE_LIMIT = env.int("SCHEDULED_MESSAGE_TEAM_RATE_LIMIT", default=10)
+# Maximum number of scheduled messages to fire per second for each messaging provider
+SCHEDULED_MESSAGE_PROVIDER_RATE_LIMIT = env.int("SCHEDULED_MESSAGE_PROVIDER_RATE_LIMIT", default=20)
+
+# Tracing
+# Maximum number of trace flushes waiting to be sent by the background flush worker
+TRACE_FLUSH_QUEUE_SIZE = env.int("TRACE_FLUSH_QUEUE_SIZE", default=1000)
+# Maximum time in seconds between a run ending and its trace being flushed
+TRACE_FLUSH_MAX_LATENCY = env.float("TRACE_FLUSH_MAX_LATENCY", default=1.0)
+
+
 # AI helper
 AI_HELPER_API_KEY = env("AI_HELPER_API_KEY", default="")
 
@@ -162,7 +162,7 @@ def runserver(c: Context, public=False):
 
 @task
 def celery(c: Context, gevent=False, beat=True):
-    cmd = "celery -A gpt_playground worker -l INFO"
+    cmd = "celery -A gpt_playground worker -l INFO -Q celery,scheduled_messages"
     if gevent:
         cmd += " --pool gevent --concurrency 10"
     else: